@@ -14,6 +14,7 @@ export const useChat = () => {
   const [currentQuery, setCurrentQuery] = useState("");
   const [isLoading, setIsLoading] = useState(false);
   const [selectedToolChainMessage, setSelectedToolChainMessage] = useState<Message | null>(null);
+  const [sessionId, setSessionId] = useState<string | null>(null);
 
   const sendMessage = async () => {
     if (!currentQuery.trim() || isLoading) return;
@@ -36,7 +37,8 @@ export const useChat = () => {
           'Content-Type': 'application/json'
         },
         body: JSON.stringify({
-          query: messages.length > 0 ? {...messages, userMessage} : userMessage.content
+          query: userMessage.content,
+          session_id: sessionId,
         }),
         credentials: 'include',
       });
@@ -47,6 +49,9 @@ export const useChat = () => {
 
       const data = await response.json();
       const toolChain = data.reply || [];
+      if (data.session_id) {
+        setSessionId(data.session_id);
+      }
 
       const agentMessage: Message = {
         id: (Date.now() + 1).toString(),
@@ -93,6 +98,7 @@ export const useChat = () => {
   const clearChat = () => {
     setMessages([]);
     setSelectedToolChainMessage(null);
+    setSessionId(null);
   };
 
   const sampleQueries = [
@@ -0,0 +1,30 @@
+import multiprocessing
+import os
+
+# Production server config:
+#   gunicorn -c src/api/gunicorn.conf.py src.api.wsgi:app
+# Flask is a WSGI app, so workers are pre-forked gthread workers: each process serves
+# WEB_THREADS requests at once (requests mostly wait on LLM calls), and workers are
+# recycled after WEB_MAX_REQUESTS requests with jitter so they never restart together.
+# Conversation sessions are shared between workers through SESSION_STORE_PATH (see
+# session.py); with SESSION_STORE_PATH="" they are per process, so run a single worker.
+
+bind = os.getenv("WEB_BIND", "0.0.0.0:5000")
+shared_sessions = bool(os.getenv("SESSION_STORE_PATH", "session_store.db"))
+workers = int(os.getenv("WEB_WORKERS", multiprocessing.cpu_count() if shared_sessions else 1))
+worker_class = "gthread"
+threads = int(os.getenv("WEB_THREADS", 8))
+
+preload_app = True
+
+max_requests = int(os.getenv("WEB_MAX_REQUESTS", 1000))
+max_requests_jitter = int(os.getenv("WEB_MAX_REQUESTS_JITTER", 100))
+timeout = int(os.getenv("WEB_TIMEOUT", 120))
+graceful_timeout = int(os.getenv("WEB_GRACEFUL_TIMEOUT", 30))
+keepalive = 5
+
+accesslog = "-"
+
+
+def post_fork(server, worker):
+    server.log.info(f"[SERVER] Worker {worker.pid} forked with {threads} threads")
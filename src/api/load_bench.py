@@ -0,0 +1,112 @@
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+
+from ..plan_templates import load_dataset_rows
+
+# Load test for the production server. Sends the dataset queries to /respond from
+# --concurrency client threads and reports throughput and latency. With --workers it starts
+# gunicorn once per worker count (WEB_WORKERS) and prints how throughput scales with cores:
+#
+#   python3 -m src.api.load_bench --workers 1,2,4,8 --requests 400 --concurrency 32
+#   python3 -m src.api.load_bench --url http://my-host:5000      # against a running server
+
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "gunicorn.conf.py")
+
+
+def _post(url: str, payload: dict, timeout: float) -> float:
+    request = urllib.request.Request(url, data=json.dumps(payload).encode("utf-8"),
+                                     headers={"Content-Type": "application/json"})
+    start = time.perf_counter()
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        response.read()
+    return (time.perf_counter() - start) * 1000
+
+
+def run_load(url: str, queries: list, total: int, concurrency: int, timeout: float = 120) -> dict:
+    latencies, errors = [], []
+    lock = threading.Lock()
+    counter = iter(range(total))
+
+    def client():
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            try:
+                elapsed = _post(url, {"query": queries[i % len(queries)]}, timeout)
+                with lock:
+                    latencies.append(elapsed)
+            except Exception as e:
+                with lock:
+                    errors.append(str(e))
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - start
+
+    latencies.sort()
+    pick = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] if latencies else 0.0
+    return {"requests": total, "errors": len(errors), "seconds": wall,
+            "throughput": len(latencies) / wall if wall else 0.0, "p50_ms": pick(0.5), "p99_ms": pick(0.99)}
+
+
+def _wait_ready(base_url: str, deadline: float):
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(base_url + "/", timeout=2):
+                return True
+        except Exception:
+            time.sleep(0.5)
+    return False
+
+
+def start_server(workers: int, port: int):
+    env = dict(os.environ, WEB_WORKERS=str(workers), WEB_BIND=f"127.0.0.1:{port}")
+    process = subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", CONFIG_PATH, "src.api.wsgi:app"],
+                               env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    if not _wait_ready(f"http://127.0.0.1:{port}", time.time() + 120):
+        process.kill()
+        raise RuntimeError(f"gunicorn with {workers} workers did not come up")
+    return process
+
+
+def print_row(label, result: dict):
+    print(f"{label:>8}  {result['throughput']:>9.1f}  {result['p50_ms']:>8.0f}  {result['p99_ms']:>8.0f}  {result['errors']:>6}")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Load test the /respond endpoint.")
+    arg_parser.add_argument("--url", default=None, help="server to test; omit to start gunicorn locally")
+    arg_parser.add_argument("--workers", default=str(os.cpu_count()), help="comma separated worker counts")
+    arg_parser.add_argument("--requests", type=int, default=200)
+    arg_parser.add_argument("--concurrency", type=int, default=16)
+    arg_parser.add_argument("--port", type=int, default=5055)
+    args = arg_parser.parse_args()
+
+    queries = [query for query, _ in load_dataset_rows()]
+    print(" workers  req/s      p50(ms)   p99(ms)  errors")
+    if args.url:
+        print_row("remote", run_load(args.url.rstrip("/") + "/respond", queries, args.requests, args.concurrency))
+    else:
+        for workers in [int(w) for w in args.workers.split(",")]:
+            server = start_server(workers, args.port)
+            try:
+                # Warm-up pass so every worker has its clients and caches ready
+                run_load(f"http://127.0.0.1:{args.port}/respond", queries, workers * 2, workers)
+                print_row(workers, run_load(f"http://127.0.0.1:{args.port}/respond", queries,
+                                            args.requests, args.concurrency))
+            finally:
+                server.send_signal(signal.SIGTERM)
+                server.wait(timeout=60)
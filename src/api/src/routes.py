@@ -1,12 +1,31 @@
 from flask import jsonify, request
 import json
+import time
 from . import app
-from ...parser import generate_tool_chain
+from ...parser import generate_tool_chain, last_skeleton_source
+from ... import self_consistency
 from ...argument_filler import fill_arguments_with_context
-from ...loadModel import loadHeavyModel
-from ...hallucination_check import verify_plan
+from ...loadModel import loadHeavyModel, describeModels
+from ...hallucination_check import verify_plan_diff, verification_stats
+from ...plan_confidence import score_plan, needs_verification
+from ...structured_output import last_logprob, reset_last_logprobs
+from ...query_classifier import is_out_of_domain
+from ...plan_templates import match_template
+from ...skeleton_cache import skeleton_cache
+from ...session import sessions, plan_follow_up, is_follow_up, latest_user_message
+from ...plan_store import get_plan_store, VERIFIED, REJECTED, ACCEPTED
+from ...tool_registry import get_registry
+from ...token_budget import prompt_stats, compress_text, resolve_handles
+from ...blob_store import get_blob_store
+from ...model_cascade import cascade_stats
+from ...object_index import resolve_object_lookups, object_resolution_stats
+from ...deadline import Deadline, DeadlineExceeded, offer_partial, request_budget, watch_disconnect
 import os
 
+get_registry().start_watching()
+
+VERIFY_TRIES = int(os.getenv("VERIFY_TRIES", 2))
+
 def clean_json_output(output: str) -> str:
     cleaned = output.strip()
     if cleaned.startswith("```"):
@@ -17,20 +36,136 @@ def clean_json_output(output: str) -> str:
 def home():
     return jsonify({ "message": "API is live!" })
 
-@app.route('/respond', methods=['POST'])
-def respond():
-    query = request.json.get('query', '')
-    raw_output = generate_tool_chain(query)
+@app.route('/stats/skeleton_cache', methods=['GET'])
+def skeleton_cache_stats():
+    return jsonify(skeleton_cache.stats())
+
+def plan_query(query: str, planner_query: str, user_query: str):
+    """
+    Returns (filled_plan, skeleton, source, verdict) for a query that is not a follow-up delta;
+    verdict is the plan store verdict (None when nothing judged the plan).
+    query/planner_query are the prompt forms (handles for long text); user_query is the raw
+    text the plan store is keyed on.
+    """
+    # A follow-up (planner_query carries the history) means nothing on its own: "only the
+    # high priority ones" is neither out of domain nor a template query
+    follow_up = planner_query != query
+    if not follow_up and is_out_of_domain(query):
+        return [], None, "out_of_domain", None
+    template_match = None if follow_up else match_template(query)
+    if template_match:
+        # A template plan skips the verifier when the match is confident enough, and falls
+        # through to the planner when the verifier rejects it
+        report = score_plan(template_match.plan, query, source="template",
+                            template_confidence=template_match.confidence)
+        if not needs_verification(report):
+            return template_match.plan, None, "template", ACCEPTED
+        if verify_plan_diff(template_match.plan, query, loadHeavyModel())[0]:
+            return template_match.plan, None, "template", VERIFIED
+        print(f"Template {template_match.template_id} rejected by the verifier, planning instead")
+    past_plan = get_plan_store().latest_for_query(user_query)
+    if past_plan and not follow_up:
+        return past_plan["filled_plan"], past_plan["skeleton"], "plan_store", past_plan["verdict"]
+    if self_consistency.enabled():
+        raw_output = self_consistency.vote_tool_chain(planner_query)
+    else:
+        raw_output = generate_tool_chain(planner_query)
+    source = last_skeleton_source()
     json_string_output = clean_json_output(raw_output)
-    plan = json.loads(json_string_output)
-    filled_plan = fill_arguments_with_context(plan, query)
-    verifier_model  = loadHeavyModel()
-    tries = 0
-    for i in range(tries):
-        flag , err = verify_plan(filled_plan, query, verifier_model)
-        if not flag:
+    plan = get_registry().canonicalize_plan(json.loads(json_string_output))
+    filled_plan = fill_arguments_with_context(plan, planner_query)
+    offer_partial(filled_plan, "filler")
+    # Only plans the confidence model is unsure about pay for the LLM verifier
+    report = score_plan(filled_plan, query, source=source, logprobs=[last_logprob("planner"), last_logprob("filler")])
+    verdict = ACCEPTED
+    if needs_verification(report):
+        verifier_model  = loadHeavyModel()
+        tries = VERIFY_TRIES
+        for i in range(tries):
+            flag , err = verify_plan_diff(filled_plan, query, verifier_model)
+            if flag:
+                break
+            # The skeleton may be what the verifier objected to, do not serve it again
+            skeleton_cache.invalidate(planner_query)
             print("Reprompting\n")
-            filled_plan = fill_arguments_with_context(plan, query, err)
-    response = jsonify({ "reply":  filled_plan})
+            filled_plan = fill_arguments_with_context(plan, planner_query, err)
+            offer_partial(filled_plan, "filler")
+        verdict = VERIFIED if flag else REJECTED
+    return filled_plan, plan, source, verdict
+
+@app.route('/stats/verifier', methods=['GET'])
+def verifier_stats():
+    return jsonify(verification_stats())
+
+@app.route('/stats/object_resolution', methods=['GET'])
+def object_index_stats():
+    return jsonify(object_resolution_stats())
+
+@app.route('/stats/cascade', methods=['GET'])
+def model_cascade_stats():
+    return jsonify(cascade_stats())
+
+@app.route('/stats/self_consistency', methods=['GET'])
+def self_consistency_stats():
+    return jsonify(self_consistency.consistency_stats())
+
+@app.route('/stats/prompt_tokens', methods=['GET'])
+def prompt_token_stats():
+    return jsonify({ "prompts": prompt_stats(), "blobs": get_blob_store().stats() })
+
+@app.route('/stats/tool_registry', methods=['GET'])
+def tool_registry_stats():
+    registry = get_registry()
+    return jsonify({ "version": registry.version, "tools": [tool["name"] for tool in registry.api_list] })
+
+@app.route('/respond', methods=['POST'])
+def respond():
+    start = time.perf_counter()
+    # Long pasted text is swapped for a $$TEXT[...] handle before any stage sees it; the
+    # session history and the plan store keep the raw text
+    user_query = latest_user_message(request.json.get('query', ''))
+    query = compress_text(user_query)
+    session = sessions.get_or_create(request.json.get('session_id'))
+    # Worker threads serve many requests, log-probs from the previous one must not leak in
+    reset_last_logprobs()
+
+    # Every LLM call below runs under this request's deadline, and a client that hangs up
+    # cancels whatever is still in flight. Clients may ask for less time, never for more
+    deadline = Deadline(request_budget(request.json.get('budget_seconds')))
+    watcher = watch_disconnect(request.environ, deadline)
+    partial = False
+    try:
+        with deadline.scope():
+            filled_plan, skeleton, source, verdict = plan_follow_up(query, session), None, "follow_up", None
+            if filled_plan is None:
+                # Only follow-ups we could not turn into a delta carry the (bounded) history
+                planner_query = session.with_history(query) if is_follow_up(query, session) else query
+                filled_plan, skeleton, source, verdict = plan_query(query, planner_query, user_query)
+    except DeadlineExceeded as e:
+        print(f"[DEADLINE] {e}, returning the best partial result ({deadline.partial_stage})")
+        filled_plan, skeleton, source, verdict, partial = deadline.partial, None, "partial", None, True
+    except json.JSONDecodeError:
+        # The planner (or every self-consistency sample) produced output that is not a plan
+        print("The planner returned invalid JSON, no plan for this request")
+        return jsonify({ "reply": [], "session_id": session.session_id, "error": "invalid_plan" }), 502
+    finally:
+        if watcher is not None:
+            watcher.set()
+
+    if filled_plan is None:
+        return jsonify({ "reply": [], "session_id": session.session_id, "partial": True }), 504
+
+    filled_plan = resolve_handles(filled_plan)
+    # Names the local object index knows confidently need no search_object_by_name call
+    filled_plan, resolutions = resolve_object_lookups(filled_plan)
+    if resolutions:
+        print(f"[OBJECTS] Resolved {[r['query'] for r in resolutions]} locally")
+    session.record_turn(user_query, filled_plan)
+    sessions.save(session)
+    get_plan_store().record(user_query, skeleton=skeleton, filled_plan=filled_plan, verdict=verdict,
+                            latency_ms=(time.perf_counter() - start) * 1000,
+                            model=describeModels(), source=source)
+
+    response = jsonify({ "reply":  filled_plan, "session_id": session.session_id, "partial": partial })
 
-    return response
\ No newline at end of file
+    return response
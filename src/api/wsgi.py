@@ -0,0 +1,38 @@
+import gc
+
+from .src import app
+from .src import routes
+from ..gazetteer import get_gazetteer
+from ..loadModel import loadFastModel, loadSmallModel, loadHeavyModel
+from ..object_index import get_object_index
+from ..plan_confidence import get_confidence_model
+from ..plan_templates import get_template_index
+from ..query_classifier import get_classifier
+from ..structured_output import plan_schema
+from ..tool_registry import get_registry
+
+# Production WSGI entry point (see gunicorn.conf.py). With preload_app the master imports
+# this module once, so the tool registry, template index, OOD classifier, confidence weights,
+# entity catalogs, plan schema and model clients are built before fork and shared
+# copy-on-write by every worker.
+
+
+def preload():
+    get_registry()
+    get_template_index()
+    get_classifier()
+    get_confidence_model()
+    get_gazetteer()
+    get_object_index()
+    plan_schema()
+    loadFastModel()
+    loadSmallModel()
+    loadHeavyModel()
+    # Move everything built so far out of the collector's generations, so GC passes in the
+    # workers do not touch (and un-share) these pages
+    gc.collect()
+    gc.freeze()
+    print(f"[SERVER] Preloaded registry v{get_registry().version} and model clients")
+
+
+preload()
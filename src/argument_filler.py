@@ -1,34 +1,41 @@
 import json
 import time
-from .loadModel import loadSmallModel, loadHeavyModel
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
 from dotenv import load_dotenv
 import os
 
-from .tool_list.usable_tool import API_LIST
+from .tool_registry import get_registry
+from .plan_store import get_plan_store
+from .structured_output import (
+    invoke_structured, parse_plan_output, project_onto_skeleton, fill_schema, parse_fill_output, merge_fill,
+)
+from .token_budget import budget_sections, record_completion, resolve_handles
+from .gazetteer import get_gazetteer
+from .model_cascade import run_cascade, fill_problems
 
 load_dotenv()
 
-# --- Load heavy model once ---
-model = loadHeavyModel()
+# "compact": the model returns only {step_index: {argument_name: value}} and the values are
+# merged into the skeleton locally. "plan": the model echoes the whole filled plan.
+FILL_PROTOCOL = os.getenv("FILL_PROTOCOL", "compact")
 
 # --- Template for SINGLE CALL ---
 contextual_extraction_template = """
 You are a master AI assistant that analyzes a user query and a multi-step tool plan to determine the correct arguments for each tool.
 
 CRITICAL RULES:
-- Output ONLY a JSON array.
-- If the plan is [], output [] EXACTLY (no prose).
+- Output ONLY a JSON object of the form {{"plan": [...]}} holding the filled plan array.
 - Do NOT add/remove/reorder tools or arguments.
 - Only edit "argument_value". Leave names/structure untouched.
 - If a value depends on a previous tool, write exactly "$$PREV[index]" (index starts at 0).
   - NEVER use property paths with $$PREV (e.g., "$$PREV[0].task_ids" is forbidden).
   - If you believe a field like "task_ids" is needed, still output "$$PREV[index]" only.
 - If a value is unknown, leave it as "".
+- $$TEXT[...] stands for a long passage of the query. When an argument needs that passage, write the handle itself as the value.
 
 --- CONTEXT ---
 User Query: "{user_query}"
+{entities}
 
 {error_context}
 
@@ -39,77 +46,133 @@ User Query: "{user_query}"
 {plan_json}
 
 --- NOW FILL THE PLAN BELOW ---
-Output the fully filled JSON plan only, nothing else.
+Output the fully filled JSON plan only, wrapped as {{"plan": [...]}}, nothing else.
 """
 
 
 
 
 contextual_prompt = ChatPromptTemplate.from_template(contextual_extraction_template)
-parser = StrOutputParser()
-contextual_extraction_chain = contextual_prompt | model | parser
 
+# --- Template for the compact fill protocol ---
+compact_fill_template = """
+You are a master AI assistant that analyzes a user query and a multi-step tool plan to determine the correct arguments for each tool.
+
+CRITICAL RULES:
+- Output ONLY a JSON object mapping step index to an object of argument name -> value,
+  e.g. {{"0": {{"issue.priority": ["p0"]}}, "1": {{"objects": "$$PREV[0]"}}}}.
+- Only use the step indexes and argument names listed in the plan. Omit arguments whose value is unknown.
+- If a value depends on a previous tool, write exactly "$$PREV[index]" (index starts at 0).
+  - NEVER use property paths with $$PREV (e.g., "$$PREV[0].task_ids" is forbidden).
+- $$TEXT[...] stands for a long passage of the query. When an argument needs that passage, write the handle itself as the value.
 
-# --- Helper Function to format API docs ---
-def format_tool_docs(api_list: list) -> str:
-    doc_string = ""
-    for tool in api_list:
-        doc_string += f"Tool Name: {tool['name']}\nDescription: {tool['description']}\n"
-        if tool.get('arguments'):
-            doc_string += "Arguments:\n"
-            for arg in tool['arguments']:
-                doc_string += f"- {arg['argument_name']} ({arg['argument_type']}): {arg['argument_description']}\n"
-        doc_string += "---\n"
-    return doc_string
+--- CONTEXT ---
+User Query: "{user_query}"
+{entities}
+
+{error_context}
+
+--- TOOL DOCUMENTATION (only tools present in the plan) ---
+{tool_docs}
+
+--- PLAN (step index: tool(argument names)) ---
+{plan_json}
+
+Output the JSON object only, nothing else.
+"""
+
+compact_prompt = ChatPromptTemplate.from_template(compact_fill_template)
+
+
+def format_plan_outline(plan: list) -> str:
+    """One line per step: "0: works_list(issue.priority, owned_by)"."""
+    return "\n".join(
+        f"{i}: {step.get('tool_name')}({', '.join(arg['argument_name'] for arg in step.get('arguments', []))})"
+        for i, step in enumerate(plan)
+    )
+
+
+def format_known_entities(user_query: str) -> str:
+    """
+    Catalog entities found in the query, including inside $$TEXT[...] passages, with the
+    canonical value the filler should use: "Known entities: customer "ACME" = Acme Corporation".
+    """
+    text = resolve_handles(user_query)
+    found = {}
+    for start, end, kind, value in get_gazetteer().find(text):
+        found.setdefault((kind, value), text[start:end])
+    if not found:
+        return ""
+    return "Known entities (use the value after '='): " + "; ".join(
+        f'{kind} "{mention}" = {value}' for (kind, value), mention in found.items()
+    )
 
 
 # --- Core Logic ---
 def fill_arguments_with_context(plan: list, user_query: str, err_response:str = "") -> list:
-    tool_docs = format_tool_docs(API_LIST)
-    plan_json = json.dumps(plan, indent=4)
+    if not plan:
+        return plan
+
     error_context = ""
     if err_response != "":
         error_context += f"The following is the error response from the previous prompt, where you hallucinated, ensure this does not happen : {err_response}"
-
-    print("Sending single LLM request to fill all arguments...")
-    response_str = contextual_extraction_chain.invoke({
+    compact = FILL_PROTOCOL == "compact"
+    sections = budget_sections("filler", {
         "user_query": user_query,
         "error_context": error_context,
-        "tool_docs": tool_docs,
-        "plan_json": plan_json
+        "entities": format_known_entities(user_query),
+        "tool_docs": get_registry().tool_docs([step.get("tool_name") for step in plan]),
+        "plan_json": format_plan_outline(plan) if compact else plan,
     })
 
-    response_str = response_str.strip().replace("```json", "").replace("```", "").strip()
-
-    try:
-        filled_plan = json.loads(response_str)
-        print("Successfully parsed LLM response into JSON")
-        return filled_plan
-    except json.JSONDecodeError:
-        print("Failed to decode LLM output. Raw response:")
-        print(response_str)
-        return plan
+    def attempt(model):
+        print("Sending single LLM request to fill all arguments...")
+        if compact:
+            response_str = invoke_structured(compact_prompt, model, sections, stage="filler", schema=fill_schema(plan))
+        else:
+            response_str = invoke_structured(contextual_prompt, model, sections, stage="filler")
+        record_completion("filler", response_str)
+
+        try:
+            if compact:
+                filled_plan = merge_fill(plan, parse_fill_output(response_str, plan, stage="filler"))
+            else:
+                filled_plan = project_onto_skeleton(plan, parse_plan_output(response_str, stage="filler"))
+            print("Successfully parsed LLM response into JSON")
+            return filled_plan
+        except json.JSONDecodeError:
+            print("Failed to decode LLM output. Raw response:")
+            print(response_str)
+            return None
+
+    # The fast model's fill is kept when it parses, keeps the skeleton's steps, fills every
+    # needed argument with a value of the right type and only references earlier steps
+    filled_plan = run_cascade("filler", attempt, lambda filled: not fill_problems(plan, filled))
+    return plan if filled_plan is None else filled_plan
 
 
 # --- Main Execution ---
 if __name__ == "__main__":
     user_query = input("Enter your query: ")
+    plan_store = get_plan_store()
+
+    print("Loading the latest skeleton plan for this query from the plan store...")
+    past = plan_store.latest_for_query(user_query, verified_only=False)
 
     try:
-        print("Loading skeleton plan from 'output.json'...")
-        with open("output.json", "r") as f:
-            skeleton_plan_str = f.read().replace("who_am_i", "whoami")
-            skeleton_plan = json.loads(skeleton_plan_str)
+        if not past or past["skeleton"] is None:
+            raise LookupError("no skeleton recorded for this query, run the parser first.")
+        skeleton_plan = get_registry().canonicalize_plan(past["skeleton"])
 
+        start = time.perf_counter()
         filled_plan = fill_arguments_with_context(skeleton_plan, user_query)
+        plan_store.record(user_query, skeleton=skeleton_plan, filled_plan=filled_plan,
+                          latency_ms=(time.perf_counter() - start) * 1000, source="filler_cli")
+        plan_store.flush()
 
-        output_filename = "filled_output.json"
-        with open(output_filename, "w") as f:
-            json.dump(filled_plan, f, indent=4)
-
-        print(f"\nSuccess! The filled plan has been saved to '{output_filename}'")
+        print(f"\nSuccess! The filled plan has been recorded in '{plan_store.path}'")
 
-    except FileNotFoundError:
-        print("Error: 'output.json' not found.")
+    except LookupError as e:
+        print(f"Error: {e}")
     except Exception as e:
-        print(f"An unexpected error occurred: {e}")
\ No newline at end of file
+        print(f"An unexpected error occurred: {e}")
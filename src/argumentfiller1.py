@@ -6,7 +6,7 @@ from langchain_core.output_parsers import StrOutputParser
 from dotenv import load_dotenv
 import os
 
-from tools import API_LIST
+from .tool_registry import get_registry
 
 load_dotenv()
 
@@ -141,12 +141,7 @@ contextual_prompt = ChatPromptTemplate.from_template(contextual_extraction_templ
 contextual_extraction_chain = contextual_prompt | model | StrOutputParser()
 
 def get_tool_details(tool_name):
-    if tool_name == "whoami":
-        tool_name = "who_am_i"
-    for tool in API_LIST:
-        if tool['name'] == tool_name:
-            return tool
-    return None
+    return get_registry().get(tool_name)
 
 # ============================================================================
 # ENHANCED RULE EXTRACTOR - Uses Normalized Query Data
@@ -359,8 +354,7 @@ if __name__ == "__main__":
     
     try:
         with open("output.json", "r") as f:
-            skeleton_plan_str = f.read().replace("who_am_i", "whoami")
-            skeleton_plan = json.loads(skeleton_plan_str)
+            skeleton_plan = json.loads(f.read())
         
         filled_plan = fill_arguments_with_context(skeleton_plan, user_query)
         
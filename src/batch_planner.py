@@ -0,0 +1,222 @@
+import argparse
+import json
+import os
+import time
+from collections import Counter
+
+from dotenv import load_dotenv
+from langchain_core.prompts import ChatPromptTemplate
+
+from .loadModel import loadFastModel, loadHeavyModel
+from .model_cascade import CASCADE_ENABLED
+from .parser import generate_tool_chain
+from .plan_store import get_plan_store
+from .plan_templates import load_dataset_rows
+from .query_classifier import is_out_of_domain
+from .skeleton_cache import skeleton_cache
+from .structured_output import invoke_structured, packed_plan_schema, parse_packed_output
+from .token_budget import budget_sections, compress_text, record_completion
+from .tool_registry import get_registry
+
+# Batch planning for offline runs. Several queries are packed into one planner prompt that
+# carries the tool docs once; the model answers with a lean plan per query index, and only
+# the queries whose plan is missing or fails registry validation are re-planned one by one
+# (generate_tool_chain). The pack size is tuned while the batch runs: it grows while the
+# effective throughput (re-plans included) improves and the share of re-planned queries stays
+# under MAX_PACK_ERROR_RATE.
+#
+#   python3 -m src.batch_planner                    # auto-tuned pack size over dataset.csv
+#   python3 -m src.batch_planner --pack-size 8      # fixed pack size
+#   python3 -m src.batch_planner --record           # also record the skeletons in the plan store
+
+load_dotenv()
+
+PACK_SIZES = [1, 2, 4, 8, 16, 32]
+MAX_PACK_SIZE = int(os.getenv("BATCH_MAX_PACK_SIZE", 16))
+MAX_PACK_ERROR_RATE = float(os.getenv("BATCH_MAX_PACK_ERROR_RATE", 0.1))
+# Queries a pack size must have planned before the tuner judges it
+TUNER_MIN_QUERIES = 8
+
+PACK_PROMPT_TEMPLATE = """
+    You are an expert AI agent. Your task is to identify the correct sequence of tools to call for each of several independent user queries.
+    You must output a JSON object with one key per query index. Each value lists the tools to call for that query, in order, one string per call.
+    Each string is the tool name followed by the names of the arguments the query gives a value for (or that take a previous tool's output), in parentheses.
+
+    Example output for two queries:
+    {{"0": ["works_list(issue.priority, owned_by)", "summarize_objects(objects)"], "1": ["who_am_i()"]}}
+
+    Here is the list of available tools you can use:
+    --- START OF TOOLS ---
+    {tools}
+    --- END OF TOOLS ---
+
+    User Queries:
+    {queries}
+
+    Plan every query on its own; a query never refers to another one.
+    Now, generate the JSON object. Your output should only be the JSON object, with no other text or formatting.
+    If a query cannot be answered with these tools, give it an empty list.
+    """
+
+_stats = Counter()
+
+
+class PackSizeTuner:
+    """
+    Picks the pack size from what the batch has seen so far. Every size is judged on its
+    effective throughput (queries per second, including the time spent re-planning its
+    failures one by one) among the sizes whose failure rate is within max_error_rate; the next
+    larger size is tried once the best one has enough data.
+    """
+
+    def __init__(self, start: int = 2, max_size: int = MAX_PACK_SIZE, max_error_rate: float = MAX_PACK_ERROR_RATE):
+        self.sizes = [s for s in PACK_SIZES if s <= max_size] or [1]
+        self.max_error_rate = max_error_rate
+        self.current = max(s for s in self.sizes if s <= max(start, 1))
+        self._seen = {}
+
+    def observe(self, size: int, queries: int, failed: int, seconds: float):
+        seen = self._seen.setdefault(size, Counter())
+        seen["queries"] += queries
+        seen["failed"] += failed
+        seen["seconds"] += seconds
+        self.current = self._next()
+
+    def error_rate(self, size: int) -> float:
+        seen = self._seen[size]
+        return seen["failed"] / seen["queries"] if seen["queries"] else 0.0
+
+    def throughput(self, size: int) -> float:
+        seen = self._seen[size]
+        return seen["queries"] / seen["seconds"] if seen["seconds"] else 0.0
+
+    def _next(self) -> int:
+        if self._seen.get(self.current, {}).get("queries", 0) < TUNER_MIN_QUERIES:
+            return self.current
+        judged = [s for s in self.sizes if self._seen.get(s, {}).get("queries", 0) >= TUNER_MIN_QUERIES]
+        within = [s for s in judged if self.error_rate(s) <= self.max_error_rate]
+        if not within:
+            # Every size tried fails too often: go smaller than anything tried
+            return max([s for s in self.sizes if s < min(judged)] or [self.sizes[0]])
+        best = max(within, key=self.throughput)
+        larger = [s for s in self.sizes if s > best]
+        if larger and larger[0] not in judged:
+            return larger[0]
+        return best
+
+    def report(self) -> list:
+        return [{"pack_size": s, "queries": self._seen[s]["queries"], "error_rate": self.error_rate(s),
+                 "queries_per_second": self.throughput(s)} for s in sorted(self._seen)]
+
+
+def _pack_model():
+    return loadFastModel() if CASCADE_ENABLED else loadHeavyModel()
+
+
+def plan_pack(queries: list) -> list:
+    """
+    One planner call for all queries. Returns a skeleton or None per query, in order; every
+    query gets None when the call fails, so the pack is re-planned one query at a time.
+    """
+    sections = budget_sections("planner_pack", {"tool_docs": get_registry().tool_docs()})
+    numbered = "\n    ".join(f'{i}: "{query}"' for i, query in enumerate(queries))
+    prompt = ChatPromptTemplate.from_template(PACK_PROMPT_TEMPLATE)
+    try:
+        response = invoke_structured(prompt, _pack_model(), {"tools": sections["tool_docs"], "queries": numbered},
+                                     stage="planner_pack", schema=packed_plan_schema(len(queries)))
+        record_completion("planner_pack", response)
+        return parse_packed_output(response, len(queries), stage="planner_pack")
+    except Exception as e:
+        print(f"[BATCH] Pack of {len(queries)} queries failed, re-planning them one by one ({e})")
+        _stats["failed_packs"] += 1
+        return [None] * len(queries)
+
+
+def _usable(skeleton, query: str) -> bool:
+    # An empty plan is only taken when the out-of-domain gate agrees the tools cannot serve
+    # the query; any other plan must name only registry tools and their arguments (unknown
+    # steps are kept by the expansion)
+    if skeleton == []:
+        return is_out_of_domain(query)
+    return skeleton is not None and not get_registry().validate_plan(skeleton)
+
+
+def plan_batch(queries: list, pack_size: int = None, tuner: PackSizeTuner = None) -> list:
+    """
+    Plans every query and returns one JSON string per query, with generate_tool_chain's
+    contract (raw model output when even the single re-plan could not be parsed). A fixed
+    pack_size disables tuning.
+    """
+    if tuner is None:
+        tuner = PackSizeTuner(start=pack_size or 2)
+    results = [None] * len(queries)
+    compressed = [compress_text(query) for query in queries]
+
+    pending = []
+    for i, query in enumerate(compressed):
+        cached = skeleton_cache.get(query)
+        if cached is not None:
+            _stats["cache_hits"] += 1
+            results[i] = json.dumps(cached)
+        else:
+            pending.append(i)
+
+    while pending:
+        size = pack_size or tuner.current
+        pack, pending = pending[:size], pending[size:]
+        start = time.perf_counter()
+        skeletons = plan_pack([compressed[i] for i in pack]) if size > 1 else [None]
+        failed = 0
+        for i, skeleton in zip(pack, skeletons):
+            if _usable(skeleton, compressed[i]):
+                if skeleton:
+                    skeleton_cache.put(compressed[i], skeleton)
+                results[i] = json.dumps(skeleton)
+            else:
+                failed += size > 1
+                results[i] = generate_tool_chain(queries[i])
+        tuner.observe(size, len(pack), failed, time.perf_counter() - start)
+        _stats["packs"] += 1
+        _stats["packed_queries"] += len(pack)
+        _stats["replanned"] += failed
+    return results
+
+
+def batch_stats() -> dict:
+    return dict(_stats)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Plan the dataset queries in packed batches.")
+    arg_parser.add_argument("--pack-size", default="auto", help="queries per planner call, or 'auto'")
+    arg_parser.add_argument("--limit", type=int, default=None, help="only use the first N queries")
+    arg_parser.add_argument("--record", action="store_true", help="record the skeletons in the plan store")
+    args = arg_parser.parse_args()
+
+    rows = [row for row in load_dataset_rows() if row[1]][:args.limit]
+    queries = [query for query, _ in rows]
+    tuner = PackSizeTuner()
+    start = time.perf_counter()
+    planned = plan_batch(queries, pack_size=None if args.pack_size == "auto" else int(args.pack_size), tuner=tuner)
+    seconds = time.perf_counter() - start
+
+    registry = get_registry()
+    correct = 0
+    for (query, expected), raw in zip(rows, planned):
+        try:
+            skeleton = json.loads(raw)
+        except json.JSONDecodeError:
+            continue
+        correct += [s["tool_name"] for s in skeleton] == [s["tool_name"] for s in registry.canonicalize_plan(expected)]
+        if args.record:
+            get_plan_store().record(query, skeleton=skeleton, source="batch")
+    if args.record:
+        get_plan_store().flush()
+
+    print(f"{len(queries)} queries in {seconds:.1f}s ({len(queries) / max(seconds, 1e-9):.2f} queries/s), "
+          f"tool sequence accuracy {correct / max(len(rows), 1):.3f}")
+    print(f"stats: {batch_stats()}")
+    print("pack size  queries  re-planned  queries/s")
+    for row in tuner.report():
+        print(f"{row['pack_size']:>9}  {row['queries']:>7}  {row['error_rate']:>10.0%}  {row['queries_per_second']:>9.2f}")
+    print(f"chosen pack size: {tuner.current}")
@@ -0,0 +1,296 @@
+import argparse
+import json
+import random
+import time
+
+from dotenv import load_dotenv
+
+from . import argument_filler, parser, structured_output
+from .argument_filler import fill_arguments_with_context
+from .hallucination_check import verify_plan, verify_plans_batch, reset_step_verdicts, VERIFY_BATCH_SIZE
+from .loadModel import loadHeavyModel
+from .parser import generate_tool_chain
+from .plan_confidence import labelled_plans, score_plan
+from .plan_templates import load_dataset_rows
+from .token_budget import prompt_stats, reset_prompt_stats
+from .tool_registry import get_registry
+from .verdict_cache import verdict_cache
+
+# Offline benchmark over dataset/dataset.csv: runs the planner and filler on every query
+# and reports accuracy, latency and how many round-trips were spent on malformed output.
+#
+#   python3 -m src.benchmark              # structured output (default)
+#   python3 -m src.benchmark --compare    # structured vs. free-form output side by side
+#   python3 -m src.benchmark --confidence-curve   # verifier latency/accuracy per confidence threshold
+#   python3 -m src.benchmark --fill-protocols     # compact fill map vs. echoing the whole plan
+#   python3 -m src.benchmark --planner-modes      # tool-name-only planner vs. full skeleton JSON
+#   python3 -m src.benchmark --verify-batch       # batched verifier requests vs. one plan per call
+
+load_dotenv()
+
+MAX_RETRIES = 3
+CURVE_THRESHOLDS = [0.0, 0.5, 0.7, 0.8, 0.85, 0.9, 0.95, 0.99, 1.01]
+
+
+def _percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def plan_query(query: str):
+    """Planner + filler with main.py's retry policy on malformed output. Returns (plan or None, retries)."""
+    retries = 0
+    for attempt in range(MAX_RETRIES):
+        raw = generate_tool_chain(query, use_cache=False)
+        try:
+            skeleton = json.loads(raw.strip().replace("```json", "").replace("```", "").strip())
+        except json.JSONDecodeError:
+            retries += attempt < MAX_RETRIES - 1
+            continue
+        return fill_arguments_with_context(get_registry().canonicalize_plan(skeleton), query), retries
+    return None, retries
+
+
+def run(rows: list, structured: bool = True) -> dict:
+    structured_output.STRUCTURED_OUTPUT = structured
+    structured_output.reset_output_stats()
+    registry = get_registry()
+
+    latencies = []
+    tool_matches = exact_matches = malformed_retries = failures = 0
+    for query, expected in rows:
+        start = time.perf_counter()
+        filled, retries = plan_query(query)
+        latencies.append((time.perf_counter() - start) * 1000)
+        malformed_retries += retries
+        if filled is None:
+            failures += 1
+            continue
+
+        expected = registry.canonicalize_plan(expected)
+        tool_matches += [s["tool_name"] for s in filled] == [s["tool_name"] for s in expected]
+        exact_matches += filled == expected
+
+    n = max(len(rows), 1)
+    return {
+        "mode": "structured" if structured else "free-form",
+        "queries": len(rows),
+        "tool_sequence_accuracy": tool_matches / n,
+        "exact_accuracy": exact_matches / n,
+        "unrecoverable": failures,
+        "malformed_retry_round_trips": malformed_retries,
+        "latency_p50_ms": _percentile(latencies, 0.5),
+        "latency_p95_ms": _percentile(latencies, 0.95),
+        "output_stats": structured_output.output_stats(),
+    }
+
+
+def confidence_curve(rows: list, thresholds: list = CURVE_THRESHOLDS) -> list:
+    """
+    Plans every query once, scores it and runs the verifier on it, then replays the gate at
+    each threshold: plans at or above it are accepted unverified, the rest take the verifier's
+    verdict. Reports verifier share, added latency and how many wrong plans get through.
+    """
+    registry = get_registry()
+    verifier_model = loadHeavyModel()
+    samples = []
+    for query, expected in rows:
+        filled, _ = plan_query(query)
+        if filled is None:
+            continue
+        report = score_plan(filled, query, logprobs=[structured_output.last_logprob("planner"),
+                                                     structured_output.last_logprob("filler")])
+        start = time.perf_counter()
+        verified, _ = verify_plan(filled, query, verifier_model)
+        samples.append({
+            "confidence": report["confidence"],
+            "verified": verified,
+            "verify_ms": (time.perf_counter() - start) * 1000,
+            "correct": filled == registry.canonicalize_plan(expected),
+        })
+
+    curve = []
+    for threshold in thresholds:
+        gated = [s for s in samples if s["confidence"] < threshold]
+        accepted = [s for s in samples if s["confidence"] >= threshold or s["verified"]]
+        curve.append({
+            "threshold": threshold,
+            "verified_share": len(gated) / max(len(samples), 1),
+            "added_latency_ms": sum(s["verify_ms"] for s in gated) / max(len(samples), 1),
+            "accepted": len(accepted),
+            "accepted_correct": sum(s["correct"] for s in accepted),
+            "wrong_accepted": sum(not s["correct"] for s in accepted),
+        })
+    return curve
+
+
+def compare_fill_protocols(rows: list, protocols=("plan", "compact")) -> list:
+    """
+    Runs only the filler, on the dataset's own plans with their values blanked, once per
+    protocol. Reports output tokens, fill latency and exact-match accuracy.
+    """
+    registry = get_registry()
+    results = []
+    for protocol in protocols:
+        argument_filler.FILL_PROTOCOL = protocol
+        reset_prompt_stats()
+        latencies = []
+        exact = 0
+        for query, expected in rows:
+            expected = registry.canonicalize_plan(expected)
+            skeleton = [dict(step, arguments=[dict(arg, argument_value="") for arg in step.get("arguments", [])])
+                        for step in expected]
+            start = time.perf_counter()
+            filled = fill_arguments_with_context(skeleton, query)
+            latencies.append((time.perf_counter() - start) * 1000)
+            exact += filled == expected
+        stats = prompt_stats().get("filler", {})
+        results.append({
+            "protocol": protocol,
+            "output_tokens": stats.get("output", 0.0),
+            "prompt_tokens": sum(v for k, v in stats.items() if k not in ("output", "prompts")),
+            "latency_p50_ms": _percentile(latencies, 0.5),
+            "latency_p95_ms": _percentile(latencies, 0.95),
+            "exact_accuracy": exact / max(len(rows), 1),
+        })
+    return results
+
+
+def compare_planner_modes(rows: list, modes=("full", "lean")) -> list:
+    """Runs only the planner once per mode; reports output tokens, latency and accuracy."""
+    registry = get_registry()
+    results = []
+    for mode in modes:
+        parser.PLANNER_MODE = mode
+        reset_prompt_stats()
+        structured_output.reset_output_stats()
+        latencies = []
+        tools_ok = arguments_ok = 0
+        for query, expected in rows:
+            expected = registry.canonicalize_plan(expected)
+            start = time.perf_counter()
+            raw = generate_tool_chain(query, use_cache=False)
+            latencies.append((time.perf_counter() - start) * 1000)
+            try:
+                skeleton = json.loads(raw)
+            except json.JSONDecodeError:
+                continue
+            tools_ok += [s["tool_name"] for s in skeleton] == [s["tool_name"] for s in expected]
+            arguments_ok += [sorted(a["argument_name"] for a in s["arguments"]) for s in skeleton] == \
+                [sorted(a["argument_name"] for a in s["arguments"]) for s in expected]
+        results.append({
+            "mode": mode,
+            "output_tokens": prompt_stats().get("planner", {}).get("output", 0.0),
+            "latency_p50_ms": _percentile(latencies, 0.5),
+            "tool_sequence_accuracy": tools_ok / max(len(rows), 1),
+            "argument_names_accuracy": arguments_ok / max(len(rows), 1),
+            "repaired": structured_output.output_stats().get("planner", {}).get("repaired", 0),
+        })
+    return results
+
+
+def compare_verifier_batching(rows: list, batch_size: int = VERIFY_BATCH_SIZE, wrong_per_query: int = 1) -> list:
+    """
+    Verifies the dataset's own plans, plus wrong_per_query perturbed plans per query (a step
+    dropped or swapped, values blanked or wrong, another query's plan), one per call and then
+    batch_size per call, each run starting from an empty verdict cache. Reports plans per
+    second, the verdicts and how many of them are right.
+    """
+    verifier_model = loadHeavyModel()
+    rng = random.Random(0)
+    by_query = {}
+    for query, plan, label in labelled_plans(rows):
+        by_query.setdefault(query, ([], []))[label].append(plan)
+    items, labels = [], []
+    for query, (wrong, correct) in by_query.items():
+        chosen = [(plan, 1) for plan in correct[:1]] + [(plan, 0) for plan in rng.sample(wrong, min(wrong_per_query, len(wrong)))]
+        items += [(plan, query) for plan, _ in chosen]
+        labels += [label for _, label in chosen]
+
+    results = []
+    for label, verify in (("single", lambda: [verify_plan(plan, query, verifier_model) for plan, query in items]),
+                          (f"batch{batch_size}", lambda: verify_plans_batch(items, verifier_model, batch_size))):
+        reset_step_verdicts()
+        start = time.perf_counter()
+        verdicts = verify()
+        seconds = time.perf_counter() - start
+        results.append({
+            "mode": label,
+            "plans_per_second": len(items) / seconds if seconds else 0.0,
+            "seconds": seconds,
+            "accepted": sum(ok for ok, _ in verdicts),
+            "accuracy": sum(ok == bool(expected) for (ok, _), expected in zip(verdicts, labels)) / max(len(items), 1),
+            "wrong_accepted": sum(ok and not expected for (ok, _), expected in zip(verdicts, labels)),
+            "verdicts": [ok for ok, _ in verdicts],
+        })
+    agreement = sum(a == b for a, b in zip(results[0]["verdicts"], results[1]["verdicts"]))
+    for result in results:
+        result["agreement"] = agreement / max(len(items), 1)
+        result["plans"], result["wrong_plans"] = len(items), labels.count(0)
+    return results
+
+
+def print_report(metrics: dict):
+    print(f"\n=== {metrics['mode']} ({metrics['queries']} queries) ===")
+    print(f"Tool sequence accuracy: {metrics['tool_sequence_accuracy']:.3f}")
+    print(f"Exact plan accuracy:    {metrics['exact_accuracy']:.3f}")
+    print(f"Malformed-output retry round-trips: {metrics['malformed_retry_round_trips']}"
+          f" (unrecoverable queries: {metrics['unrecoverable']})")
+    print(f"Latency p50/p95: {metrics['latency_p50_ms']:.0f} / {metrics['latency_p95_ms']:.0f} ms")
+    for stage, counts in metrics["output_stats"].items():
+        print(f"  {stage}: {counts}")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Benchmark the planner and filler on the dataset.")
+    arg_parser.add_argument("--unstructured", action="store_true", help="disable structured output")
+    arg_parser.add_argument("--compare", action="store_true", help="run structured and free-form output")
+    arg_parser.add_argument("--confidence-curve", action="store_true",
+                            help="measure verifier latency/accuracy per confidence threshold")
+    arg_parser.add_argument("--fill-protocols", action="store_true",
+                            help="compare the compact fill map with echoing the whole plan")
+    arg_parser.add_argument("--planner-modes", action="store_true",
+                            help="compare the tool-name-only planner with full skeleton JSON")
+    arg_parser.add_argument("--verify-batch", action="store_true",
+                            help="compare batched verifier requests with one plan per call")
+    arg_parser.add_argument("--limit", type=int, default=None, help="only use the first N queries")
+    args = arg_parser.parse_args()
+
+    rows = [row for row in load_dataset_rows() if row[1]][:args.limit]
+    if args.verify_batch:
+        results = compare_verifier_batching(rows)
+        print(f"{results[0]['plans']} plans, {results[0]['wrong_plans']} of them wrong")
+        print("  mode  plans/s  seconds  accepted  wrong accepted  accuracy  agreement")
+        for result in results:
+            print(f"{result['mode']:>6}  {result['plans_per_second']:>7.2f}  {result['seconds']:>7.1f}"
+                  f"  {result['accepted']:>8}  {result['wrong_accepted']:>14}  {result['accuracy']:>8.0%}"
+                  f"  {result['agreement']:>9.0%}")
+    elif args.planner_modes:
+        print("mode  output tok/query  p50(ms)  tools  argument names  repaired outputs")
+        for result in compare_planner_modes(rows):
+            print(f"{result['mode']:>4}  {result['output_tokens']:>15.0f}  {result['latency_p50_ms']:>7.0f}"
+                  f"  {result['tool_sequence_accuracy']:>5.2f}  {result['argument_names_accuracy']:>14.2f}"
+                  f"  {result['repaired']:>16}")
+    elif args.fill_protocols:
+        print("protocol  output tok/query  prompt tok/query  p50(ms)  p95(ms)  exact")
+        for result in compare_fill_protocols(rows):
+            print(f"{result['protocol']:>8}  {result['output_tokens']:>15.0f}  {result['prompt_tokens']:>16.0f}"
+                  f"  {result['latency_p50_ms']:>7.0f}  {result['latency_p95_ms']:>7.0f}  {result['exact_accuracy']:>5.2f}")
+    elif args.confidence_curve:
+        print("threshold  verified  +latency(ms)  accepted  correct  wrong")
+        for point in confidence_curve(rows):
+            print(f"{point['threshold']:>9.2f}  {point['verified_share']:>8.0%}  {point['added_latency_ms']:>12.0f}"
+                  f"  {point['accepted']:>8}  {point['accepted_correct']:>7}  {point['wrong_accepted']:>5}")
+    elif args.compare:
+        structured = run(rows, structured=True)
+        free_form = run(rows, structured=False)
+        print_report(free_form)
+        print_report(structured)
+        saved = free_form["malformed_retry_round_trips"] - structured["malformed_retry_round_trips"]
+        print(f"\nRetry round-trips saved by structured output: {saved}")
+    else:
+        print_report(run(rows, structured=not args.unstructured))
+    # Verdicts carry over to the next run when VERDICT_CACHE_PATH is set
+    verdict_cache.save()
@@ -0,0 +1,154 @@
+import hashlib
+import mmap
+import os
+import threading
+from collections import OrderedDict
+
+# Content-addressed store for large payloads (transcripts, pasted ticket lists). A payload
+# is stored once under the hash of its bytes and referenced everywhere else by that key, so
+# the planner, filler, verifier and retry prompts only carry a short handle. Blobs live in
+# memory up to MEMORY_LIMIT_BYTES; past that the oldest ones either spill to an append-only
+# file read back through mmap (BLOB_SPILL_PATH plus the process id, when set) or are dropped.
+# A full spill file is never truncated or rewritten, since views handed out earlier may still
+# map it: the next blobs go to a new file and the old one is unlinked (the OS frees it once
+# the last view is gone).
+
+KEY_LENGTH = 16
+MEMORY_LIMIT_BYTES = int(os.getenv("BLOB_MEMORY_LIMIT_BYTES", 16 * 1024 * 1024))
+SPILL_PATH = os.getenv("BLOB_SPILL_PATH")
+SPILL_LIMIT_BYTES = int(os.getenv("BLOB_SPILL_LIMIT_BYTES", 512 * 1024 * 1024))
+
+
+def blob_key(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()[:KEY_LENGTH]
+
+
+class BlobStore:
+    def __init__(self, memory_limit: int = MEMORY_LIMIT_BYTES, spill_path: str = SPILL_PATH,
+                 spill_limit: int = SPILL_LIMIT_BYTES):
+        self.memory_limit = memory_limit
+        self.spill_path = spill_path
+        self.spill_limit = spill_limit
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._spilled = {}
+        self._spill_file = None
+        self._spill_generation = 0
+        self._spill_size = 0
+        self._map = None
+        self._lock = threading.Lock()
+        self._stats = {"puts": 0, "deduplicated": 0, "spilled": 0, "dropped": 0}
+
+    # --- Writes ---
+
+    def put(self, data) -> str:
+        """Stores the payload (str or bytes) and returns its key. Storing it again is free."""
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        key = blob_key(data)
+        with self._lock:
+            self._stats["puts"] += 1
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self._stats["deduplicated"] += 1
+                return key
+            if key in self._spilled:
+                self._stats["deduplicated"] += 1
+                return key
+            self._memory[key] = data
+            self._memory_bytes += len(data)
+            self._evict()
+        return key
+
+    def _evict(self):
+        while self._memory_bytes > self.memory_limit and len(self._memory) > 1:
+            key, data = self._memory.popitem(last=False)
+            self._memory_bytes -= len(data)
+            if self.spill_path:
+                self._spill(key, data)
+            else:
+                self._stats["dropped"] += 1
+
+    def _open_spill_file(self):
+        # One file per process, so pre-forked workers never share offsets; each file is
+        # opened once, for appending
+        self._spill_generation += 1
+        path = f"{self.spill_path}.{os.getpid()}.{self._spill_generation}"
+        if os.path.exists(path):
+            # Left over by an earlier process with the same pid, nothing maps it
+            os.remove(path)
+        self._spill_file = open(path, "a+b")
+        self._spill_size = 0
+        self._spilled = {}
+        self._map = None
+
+    def _spill(self, key: str, data: bytes):
+        if self._spill_file is None:
+            self._open_spill_file()
+        elif self._spill_size + len(data) > self.spill_limit:
+            # Start over rather than compacting: blobs only need to outlive one request
+            print(f"[BLOBS] Spill file reached {self._spill_size} bytes, starting a new one")
+            self._stats["dropped"] += len(self._spilled)
+            old = self._spill_file
+            self._open_spill_file()
+            old.close()
+            os.remove(old.name)
+        self._spill_file.write(data)
+        self._spill_file.flush()
+        self._spilled[key] = (self._spill_size, len(data))
+        self._spill_size += len(data)
+        self._stats["spilled"] += 1
+
+    # --- Reads ---
+
+    def _view(self, offset: int, length: int) -> memoryview:
+        if self._map is None or len(self._map) < offset + length:
+            # Views handed out earlier keep the previous mapping alive until they are released
+            self._map = mmap.mmap(self._spill_file.fileno(), self._spill_size, access=mmap.ACCESS_READ)
+        return memoryview(self._map)[offset:offset + length]
+
+    def get(self, key: str):
+        """Zero-copy memoryview of the payload, or None when the key is unknown or was dropped."""
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                return memoryview(data)
+            location = self._spilled.get(key)
+            if location is None:
+                return None
+            return self._view(*location)
+
+    def get_text(self, key: str):
+        view = self.get(key)
+        return None if view is None else str(view, "utf-8")
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            return key in self._memory or key in self._spilled
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats, in_memory=len(self._memory), memory_bytes=self._memory_bytes,
+                        on_disk=len(self._spilled), spill_bytes=self._spill_size)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_blob_store() -> BlobStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = BlobStore()
+        return _store
+
+
+def _reset_after_fork():
+    # Workers must not append to the parent's spill file, each one starts an empty store
+    global _store, _store_lock
+    _store, _store_lock = None, threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
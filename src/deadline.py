@@ -0,0 +1,187 @@
+import contextvars
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+# End-to-end request deadlines. A Deadline is bound to the request's context; every LLM
+# invoke goes through run_with_deadline, which gives the call its stage's share of the time
+# that is left and stops waiting when it runs out or the request is cancelled (client
+# disconnected). Stages offer their results as they finish, so the caller can return the
+# best partial result (e.g. the unverified filled plan) instead of nothing. Clients that take
+# a per-call timeout also get the stage's time bound to the HTTP request itself, so a call
+# that is abandoned stops at the provider too.
+
+REQUEST_BUDGET_SECONDS = float(os.getenv("REQUEST_BUDGET_SECONDS", 60))
+DISCONNECT_POLL_SECONDS = 0.5
+
+# Share of the remaining budget each stage may use; a stage that finishes early leaves its
+# time to the later ones.
+STAGE_SHARES = {
+    "planner": 0.35,
+    "filler": 0.35,
+    "verifier": 0.3,
+}
+# Variants of a stage (self-consistency samples, packed batch planning) draw on its share
+STAGE_ALIASES = {
+    "planner_sample": "planner",
+    "planner_pack": "planner",
+}
+
+# Clients whose invoke passes a timeout keyword through to the HTTP request
+TIMEOUT_CLIENTS = {"ChatGroq", "ChatOpenAI"}
+MIN_CLIENT_TIMEOUT = 1.0
+
+_current = contextvars.ContextVar("deadline", default=None)
+_calls = ThreadPoolExecutor(max_workers=int(os.getenv("LLM_CALL_THREADS", 32)), thread_name_prefix="llm-call")
+
+
+class DeadlineExceeded(TimeoutError):
+    def __init__(self, stage: str, reason: str = "time budget exhausted"):
+        super().__init__(f"{stage}: {reason}")
+        self.stage = stage
+
+
+def request_budget(requested) -> float:
+    """A client-requested budget in seconds, capped at REQUEST_BUDGET_SECONDS (the default when missing or invalid)."""
+    try:
+        budget = float(requested)
+    except (TypeError, ValueError):
+        return REQUEST_BUDGET_SECONDS
+    if not budget > 0:
+        return REQUEST_BUDGET_SECONDS
+    return min(budget, REQUEST_BUDGET_SECONDS)
+
+
+class Deadline:
+    def __init__(self, budget: float = REQUEST_BUDGET_SECONDS):
+        self.budget = budget
+        self.expires_at = time.monotonic() + budget
+        self.cancelled = threading.Event()
+        self.partial = None
+        self.partial_stage = None
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def check(self, stage: str):
+        if self.cancelled.is_set():
+            raise DeadlineExceeded(stage, "request cancelled")
+        if self.remaining() <= 0:
+            raise DeadlineExceeded(stage)
+
+    def stage_timeout(self, stage: str) -> float:
+        """This stage's share of what is left, counting only the stages still to come."""
+        stage = STAGE_ALIASES.get(stage, stage)
+        names = list(STAGE_SHARES)
+        later = names[names.index(stage):] if stage in STAGE_SHARES else names
+        share = STAGE_SHARES.get(stage, 1.0) / sum(STAGE_SHARES[n] for n in later)
+        return self.remaining() * min(share, 1.0)
+
+    def offer(self, result, stage: str):
+        """Keeps the latest usable result in case a later stage runs out of time."""
+        self.partial, self.partial_stage = result, stage
+
+    def scope(self):
+        return _DeadlineScope(self)
+
+
+class _DeadlineScope:
+    def __init__(self, deadline: Deadline):
+        self.deadline = deadline
+
+    def __enter__(self):
+        self.token = _current.set(self.deadline)
+        return self.deadline
+
+    def __exit__(self, *exc):
+        _current.reset(self.token)
+        return False
+
+
+def current_deadline():
+    return _current.get()
+
+
+def offer_partial(result, stage: str):
+    deadline = _current.get()
+    if deadline is not None:
+        deadline.offer(result, stage)
+
+
+def run_with_deadline(fn, stage: str):
+    """
+    Runs fn() under the current deadline. Without one it is a plain call. With one, the call
+    runs on a helper thread and is abandoned (its result discarded) when the stage's time is
+    up or the request is cancelled, so the request thread is freed immediately.
+    """
+    deadline = _current.get()
+    if deadline is None:
+        return fn()
+    deadline.check(stage)
+
+    timeout = deadline.stage_timeout(stage)
+    future = _calls.submit(contextvars.copy_context().run, fn)
+    waited = 0.0
+    while True:
+        try:
+            return future.result(timeout=min(DISCONNECT_POLL_SECONDS, max(timeout - waited, 0.0)))
+        except FutureTimeoutError:
+            waited += DISCONNECT_POLL_SECONDS
+            if deadline.cancelled.is_set() or waited >= timeout:
+                future.cancel()
+                print(f"[DEADLINE] Abandoned {stage} call after {waited:.1f}s")
+                deadline.check(stage)
+                raise DeadlineExceeded(stage, f"stage timeout of {timeout:.1f}s")
+
+
+def with_stage_timeout(llm, stage: str):
+    """
+    llm with its HTTP timeout bound to the stage's share of the budget, split across the
+    client's retries. Without a deadline, or for a client that takes no per-call timeout, llm
+    is returned unchanged. llm may already be a binding (response format, log-probs).
+    """
+    deadline = _current.get()
+    client = getattr(llm, "bound", llm)
+    if deadline is None or type(client).__name__ not in TIMEOUT_CLIENTS:
+        return llm
+    attempts = (getattr(client, "max_retries", 0) or 0) + 1
+    return llm.bind(timeout=max(deadline.stage_timeout(stage) / attempts, MIN_CLIENT_TIMEOUT))
+
+
+def _reset_after_fork():
+    global _calls
+    _calls = ThreadPoolExecutor(max_workers=int(os.getenv("LLM_CALL_THREADS", 32)), thread_name_prefix="llm-call")
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def watch_disconnect(environ: dict, deadline: Deadline):
+    """
+    Cancels the deadline when the client closes its connection. Needs the raw socket, which
+    gunicorn ("gunicorn.socket") and werkzeug ("werkzeug.socket") expose in the environ.
+    """
+    sock = environ.get("gunicorn.socket") or environ.get("werkzeug.socket")
+    if sock is None:
+        return None
+    done = threading.Event()
+
+    def watch():
+        while not done.wait(DISCONNECT_POLL_SECONDS):
+            try:
+                if sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b"":
+                    print("[DEADLINE] Client disconnected, cancelling the request")
+                    deadline.cancel()
+                    return
+            except BlockingIOError:
+                continue
+            except OSError:
+                return
+
+    threading.Thread(target=watch, name="disconnect-watcher", daemon=True).start()
+    return done
@@ -0,0 +1,125 @@
+import re
+
+from .gazetteer import get_gazetteer
+
+# Deterministic (regex based) entity extraction. No LLM calls, used by the template
+# matcher to fill slots and by anything that needs to mask argument values out of a query.
+# Catalog vocabularies (customer names, parts, user handles...) come from the gazetteer.
+
+PRIORITY_PATTERNS = [
+    (re.compile(r"\bp([0-3])\b", re.IGNORECASE), None),
+    (re.compile(r"\b(?:critical|urgent|top[- ]priority|highest[- ]priority)\b", re.IGNORECASE), "p0"),
+    (re.compile(r"\bhigh[- ]priority\b", re.IGNORECASE), "p1"),
+    (re.compile(r"\bmedium[- ]priority\b", re.IGNORECASE), "p2"),
+    (re.compile(r"\blow[- ]priority\b", re.IGNORECASE), "p3"),
+]
+
+SEVERITY_PATTERN = re.compile(r"\b(blocker|high|medium|low)[- ]severity\b|\bseverity\s+(blocker|high|medium|low)\b|\b(blocker)s?\b", re.IGNORECASE)
+STAGE_PATTERN = re.compile(r"\b(triage|backlog|in[ _]progress|done)\b", re.IGNORECASE)
+CHANNEL_PATTERN = re.compile(r"\b(slack|email|twitter|github)\b", re.IGNORECASE)
+WORK_ID_PATTERN = re.compile(r"\bdon:core:[\w\-:/.]+\w|\b(?:TKT|ISS|TASK)-\d+\b", re.IGNORECASE)
+PART_PATTERN = re.compile(r"\b(?:FEAT|ENH|PROD|CAPL)-\d+\b", re.IGNORECASE)
+CUSTOMER_PATTERNS = [
+    re.compile(r"\b(Cust\d+)\b"),
+    re.compile(r"\b[Cc]ustomer\s+(?!meeting\b)([A-Z][\w\-]*)"),
+]
+TRANSCRIPT_PATTERNS = [
+    re.compile(r"(\$\$TEXT\[[0-9a-f]+\])"),
+    re.compile(r"\b(Transcript [A-Z]\w*)\b"),
+    re.compile(r"\b[Tt]ranscript\s+([A-Z]\w*)\b"),
+]
+WORK_TYPE_PATTERN = re.compile(r"\b(issue|ticket|task)s?\b", re.IGNORECASE)
+SELF_PATTERN = re.compile(r"\b(?:my|me|mine|i)\b", re.IGNORECASE)
+
+# Normalized argument_name -> entity kind, shared by template mining and slot filling.
+ARG_SLOTS = {
+    "issue.priority": "priority",
+    "ticket.severity": "severity",
+    "stage.name": "stage",
+    "ticket.source_channel": "channel",
+    "applies_to_part": "part",
+    "type": "work_type",
+    "work_id": "work_id",
+    "query": "customer",
+    "text": "transcript",
+}
+
+
+def find_entity_spans(query: str) -> list:
+    """
+    Returns (start, end, kind, value) tuples for every entity found in the query,
+    sorted by position with overlapping spans removed (the first/longest one wins).
+    """
+    spans = []
+
+    for pattern, fixed in PRIORITY_PATTERNS:
+        for m in pattern.finditer(query):
+            spans.append((m.start(), m.end(), "priority", fixed or f"p{m.group(1)}"))
+
+    for m in SEVERITY_PATTERN.finditer(query):
+        value = next(g for g in m.groups() if g)
+        spans.append((m.start(), m.end(), "severity", value.lower()))
+
+    for m in STAGE_PATTERN.finditer(query):
+        spans.append((m.start(), m.end(), "stage", m.group(1).lower().replace(" ", "_")))
+
+    for m in CHANNEL_PATTERN.finditer(query):
+        spans.append((m.start(), m.end(), "channel", m.group(1).lower()))
+
+    for m in WORK_ID_PATTERN.finditer(query):
+        spans.append((m.start(), m.end(), "work_id", m.group(0)))
+
+    for m in PART_PATTERN.finditer(query):
+        spans.append((m.start(), m.end(), "part", m.group(0).upper()))
+
+    for pattern in CUSTOMER_PATTERNS:
+        for m in pattern.finditer(query):
+            spans.append((m.start(1), m.end(1), "customer", m.group(1)))
+
+    for pattern in TRANSCRIPT_PATTERNS:
+        for m in pattern.finditer(query):
+            spans.append((m.start(1), m.end(1), "transcript", m.group(1)))
+
+    for m in WORK_TYPE_PATTERN.finditer(query):
+        spans.append((m.start(), m.end(), "work_type", m.group(1).lower()))
+
+    spans += get_gazetteer().find(query)
+
+    spans.sort(key=lambda s: (s[0], -(s[1] - s[0])))
+    result = []
+    last_end = -1
+    for span in spans:
+        if span[0] >= last_end:
+            result.append(span)
+            last_end = span[1]
+    return result
+
+
+def extract_entities(query: str) -> dict:
+    """
+    Returns {kind: [values]} with values de-duplicated in order of appearance.
+    The "self" kind is set when the query talks about the current user ("my issues").
+    """
+    entities = {}
+    for _, _, kind, value in find_entity_spans(query):
+        values = entities.setdefault(kind, [])
+        if value not in values:
+            values.append(value)
+    if SELF_PATTERN.search(query):
+        entities["self"] = [True]
+    return entities
+
+
+def mask_entities(query: str) -> str:
+    """
+    Replaces every entity value with a <kind> placeholder, e.g.
+    "Summarize P0 issues for Cust12" -> "summarize <priority> <work_type> for <customer>".
+    """
+    masked = []
+    cursor = 0
+    for start, end, kind, _ in find_entity_spans(query):
+        masked.append(query[cursor:start])
+        masked.append(f"<{kind}>")
+        cursor = end
+    masked.append(query[cursor:])
+    return " ".join("".join(masked).lower().split())
@@ -1,19 +1,50 @@
+import hashlib
 import json
+import os
+import re
+import threading
+from collections import Counter, OrderedDict
+
+from .deadline import DeadlineExceeded, run_with_deadline, with_stage_timeout
+from .token_budget import budget_sections, compact_json, compress_plan
+from .verdict_cache import verdict_cache
+
+MAX_STEP_VERDICTS = 4096
+# Bump when the verifier prompts change, so cached verdicts from the old prompts are not reused
+VERIFIER_PROMPT_VERSION = 1
+# (query, plan) pairs per verifier request in bulk mode
+VERIFY_BATCH_SIZE = int(os.getenv("VERIFY_BATCH_SIZE", 8))
+STEP_PATTERN = re.compile(r"\bstep\s*(\d+)", re.IGNORECASE)
+
+# Per-step verdicts, keyed on (query, tool sequence, position, step). A step the verifier
+# accepted is never sent again for the same query and plan shape, so a retry that edits one
+# argument only asks about that step.
+_step_verdicts = OrderedDict()
+_verdicts_lock = threading.Lock()
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def _count(**values):
+    with _stats_lock:
+        _stats.update(values)
+
 
 def get_verification_prompt(plan_obj, user_query):
     """
     Creates a prompt for the LLM to verify the generated plan.
     """
-    plan_str = json.dumps(plan_obj, indent=4)
+    sections = budget_sections("verifier", {"user_query": user_query, "plan_json": plan_obj})
     prompt = f"""
 You are an expert plan verifier. Your task is to determine if a generated plan is a correct and logical way to fulfill a user's query.
 
 Analyze the following:
-1. Original User Query: "{user_query}"
+1. Original User Query: "{sections['user_query']}"
 2. Generated Plan:
 ```json
-{plan_str}
+{sections['plan_json']}
 ```
+$$TEXT[...] handles stand for the same long passage wherever they appear in the query and the plan.
 
 Does the generated plan accurately and logically address the user's query?
 - Check if the tools chosen are appropriate for the query.
@@ -22,35 +53,280 @@ Does the generated plan accurately and logically address the user's query?
 
 Respond with only "YES" if the plan is correct, logical, and directly addresses the query.
 Respond with "NO" followed by a concise, one-sentence explanation if the plan is incorrect, illogical, or hallucinated.
+If the problem is in a specific step, start the explanation with "step <index>:" (index starts at 0).
+"""
+    return prompt
+
+def get_diff_verification_prompt(plan_obj, user_query, changed: list):
+    """
+    Prompt that only asks about the changed steps; the rest of the plan is shown as its tool
+    sequence, since those steps were already verified.
+    """
+    sections = budget_sections("verifier_diff", {
+        "user_query": user_query,
+        "plan_json": [dict(step, index=i) for i, step in enumerate(plan_obj) if i in changed],
+    })
+    sequence = ", ".join(f"{i}: {step.get('tool_name')}" for i, step in enumerate(plan_obj))
+    prompt = f"""
+You are an expert plan verifier. A plan for the user's query was partly verified already; only some steps changed since.
+
+1. Original User Query: "{sections['user_query']}"
+2. Full tool sequence (index: tool): {sequence}
+3. Changed steps (only these need checking):
+```json
+{sections['plan_json']}
+```
+$$TEXT[...] handles stand for the same long passage wherever they appear in the query and the plan.
+"$$PREV[i]" refers to the output of step i in the tool sequence.
+
+Are the changed steps' arguments correct and relevant for the query, given the tool sequence?
+Respond with only "YES" if they are.
+Respond with "NO" followed by "step <index>:" and a concise, one-sentence explanation otherwise.
 """
     return prompt
 
+def get_batch_verification_prompt(items: list):
+    """
+    One prompt for several (plan, query) pairs; the instructions are sent once and the
+    verdicts come back as a JSON list in item order.
+    """
+    blocks = []
+    for i, (plan_obj, user_query) in enumerate(items):
+        sections = budget_sections("verifier_batch", {"user_query": user_query, "plan_json": plan_obj})
+        blocks.append(f"Item {i}:\nUser Query: \"{sections['user_query']}\"\nPlan: {sections['plan_json']}")
+    joined = "\n\n".join(blocks)
+    prompt = f"""
+You are an expert plan verifier. For each item below, determine if the generated plan is a correct and logical way to fulfill that item's user query.
+For each item check that the tools chosen are appropriate, the arguments are correct and relevant, and the sequence of tools makes sense.
+$$TEXT[...] handles stand for the same long passage wherever they appear in a query and its plan.
+"$$PREV[i]" refers to the output of step i of the same plan.
+
+{joined}
+
+Respond with only a JSON object, one verdict per item in item order:
+{{"verdicts": [{{"item": 0, "ok": true, "step": null, "reason": ""}}]}}
+"ok" is true if the plan is correct, logical and directly addresses its query. Otherwise "ok" is false,
+"reason" is a concise, one-sentence explanation and "step" is the index (from 0) of the wrong step, or null.
+"""
+    return prompt
+
+def _step_key(user_query: str, plan_obj: list, index: int) -> str:
+    sequence = ",".join(str(step.get("tool_name")) for step in plan_obj)
+    raw = "\x00".join([" ".join(user_query.lower().split()), sequence, str(index), compact_json(compress_plan(plan_obj[index]))])
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+def _remember(keys: list, ok: bool = True):
+    with _verdicts_lock:
+        for key in keys:
+            _step_verdicts[key] = ok
+            _step_verdicts.move_to_end(key)
+        while len(_step_verdicts) > MAX_STEP_VERDICTS:
+            _step_verdicts.popitem(last=False)
+
+def reset_step_verdicts():
+    with _verdicts_lock:
+        _step_verdicts.clear()
+    verdict_cache.clear()
+
+def verification_stats() -> dict:
+    """LLM verifier calls, how many plan steps were sent versus answered from cache, and the verdict cache."""
+    with _stats_lock:
+        counts = dict(_stats)
+    return dict(counts, verdict_cache=verdict_cache.stats())
+
+def _ask(llm_instance, prompt: str):
+    """Returns (ok, reason, step_index) from one verifier call."""
+    llm = with_stage_timeout(llm_instance, "verifier")
+    response = run_with_deadline(lambda: llm.invoke(prompt), "verifier")
+    llm_response = response.content.strip()
+    print(f"Verifier LLM response: '{llm_response}'")
+
+    if llm_response.upper().startswith("YES"):
+        return True, None, None
+    if llm_response.upper().startswith("NO"):
+        reason = llm_response[2:].strip(": ").strip()
+        step = STEP_PATTERN.search(reason)
+        return False, reason, int(step.group(1)) if step else None
+    return None, llm_response, None
+
+def _cached_verdict(filled_plan, user_query):
+    cached = verdict_cache.get(user_query, filled_plan, VERIFIER_PROMPT_VERSION)
+    if cached is None:
+        return None
+    print("\nVerdict cache hit, skipping the verifier call.")
+    ok, reason = cached
+    return (True, "Plan verified successfully.") if ok else (False, f"Plan rejected. Reason: {reason}")
+
 def verify_plan(filled_plan, user_query, llm_instance):
-    
-    print("\nVerifying the plan against the user query...")
-    verification_prompt = get_verification_prompt(filled_plan, user_query)
 
     try:
         json.dumps(filled_plan)
-    except (TypeError, ValueError) as e:
+        cached = _cached_verdict(filled_plan, user_query)
+    except (TypeError, ValueError, AttributeError, KeyError) as e:
         print(f"Plan is not a valid JSON object: {e}")
         return False, "Plan rejected. Reason: The generated plan is not a valid JSON object."
+    if cached is not None:
+        return cached
+
+    print("\nVerifying the plan against the user query...")
+    verification_prompt = get_verification_prompt(filled_plan, user_query)
+
+    try:
+        _count(llm_calls=1, steps_sent=len(filled_plan))
+        ok, reason, step = _ask(llm_instance, verification_prompt)
+        keys = [_step_key(user_query, filled_plan, i) for i in range(len(filled_plan))]
+
+        if ok:
+            _remember(keys)
+            verdict_cache.put(user_query, filled_plan, VERIFIER_PROMPT_VERSION, True)
+            return True, "Plan verified successfully."
+        elif ok is False:
+            if step is not None and step < len(keys):
+                # Steps before the one the verifier objected to are taken as checked
+                _remember(keys[:step])
+                _remember([keys[step]], ok=False)
+            verdict_cache.put(user_query, filled_plan, VERIFIER_PROMPT_VERSION, False, reason)
+            return False, f"Plan rejected. Reason: {reason}"
+        else:
+            return False, f"Verifier response was not in the expected 'YES' or 'NO' format. Full response: {reason}"
+
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        print(f"Error during verification LLM call: {e}")
+        return False, "Failed to get a response from the verifier LLM."
 
+def verify_plan_diff(filled_plan, user_query, llm_instance):
+    """
+    Same contract as verify_plan, for retry loops: steps already accepted for this query and
+    plan shape come from the per-step verdict cache and only the remaining steps are sent.
+    Falls back to full verification when nothing (or everything) is known.
+    """
     try:
-        response = llm_instance.invoke(verification_prompt)
-        llm_response = response.content.strip()
+        keys = [_step_key(user_query, filled_plan, i) for i in range(len(filled_plan))]
+        cached = _cached_verdict(filled_plan, user_query)
+    except (TypeError, ValueError, AttributeError) as e:
+        print(f"Plan is not a valid JSON object: {e}")
+        return False, "Plan rejected. Reason: The generated plan is not a valid JSON object."
+    if cached is not None:
+        return cached
+
+    with _verdicts_lock:
+        known = [_step_verdicts.get(key) for key in keys]
+    _count(steps_total=len(keys), steps_cached=sum(v is True for v in known))
 
-        print(f"Verifier LLM response: '{llm_response}'")
+    changed = [i for i, verdict in enumerate(known) if verdict is not True]
+    if not changed:
+        print("\nEvery step was verified before, skipping the verifier call.")
+        return True, "Plan verified successfully."
+    if len(changed) == len(keys):
+        return verify_plan(filled_plan, user_query, llm_instance)
 
-        if llm_response.upper().startswith("YES"):
+    print(f"\nVerifying only the changed steps {changed} of the plan...")
+    try:
+        _count(llm_calls=1, steps_sent=len(changed))
+        ok, reason, step = _ask(llm_instance, get_diff_verification_prompt(filled_plan, user_query, changed))
+        if ok:
+            _remember([keys[i] for i in changed])
+            verdict_cache.put(user_query, filled_plan, VERIFIER_PROMPT_VERSION, True)
             return True, "Plan verified successfully."
-        elif llm_response.upper().startswith("NO"):
-            reason = llm_response[2:].strip(": ").strip()
+        elif ok is False:
+            if step in changed:
+                _remember([keys[step]], ok=False)
+            verdict_cache.put(user_query, filled_plan, VERIFIER_PROMPT_VERSION, False, reason)
             return False, f"Plan rejected. Reason: {reason}"
         else:
-            return False, f"Verifier response was not in the expected 'YES' or 'NO' format. Full response: {llm_response}"
+            return False, f"Verifier response was not in the expected 'YES' or 'NO' format. Full response: {reason}"
 
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         print(f"Error during verification LLM call: {e}")
         return False, "Failed to get a response from the verifier LLM."
 
+def _parse_batch_verdicts(text: str, count: int) -> dict:
+    """{item_index: (ok, reason, step)} for the well-formed verdicts in a batch response."""
+    cleaned = text.strip().replace("```json", "").replace("```", "").strip()
+    starts = [i for i in (cleaned.find("["), cleaned.find("{")) if i != -1]
+    if not starts:
+        return {}
+    try:
+        value, _ = json.JSONDecoder().raw_decode(cleaned[min(starts):])
+    except json.JSONDecodeError:
+        return {}
+    if isinstance(value, dict):
+        value = value.get("verdicts")
+    if not isinstance(value, list):
+        return {}
+
+    verdicts = {}
+    for position, verdict in enumerate(value):
+        if not isinstance(verdict, dict) or not isinstance(verdict.get("ok"), bool):
+            continue
+        index = verdict.get("item", position)
+        step = verdict.get("step")
+        if isinstance(index, int) and 0 <= index < count:
+            verdicts[index] = (verdict["ok"], verdict.get("reason") or "", step if isinstance(step, int) else None)
+    return verdicts
+
+def verify_plans_batch(items: list, llm_instance, batch_size: int = VERIFY_BATCH_SIZE) -> list:
+    """
+    Bulk verification of (filled_plan, user_query) pairs. Returns verify_plan's (ok, message)
+    for every item, in order. Each request carries up to batch_size items; items whose
+    verdict is missing or malformed (or the whole request when it fails) are verified again
+    one at a time with verify_plan.
+    """
+    results = [None] * len(items)
+    pending = []
+    for i, (filled_plan, user_query) in enumerate(items):
+        try:
+            keys = [_step_key(user_query, filled_plan, j) for j in range(len(filled_plan))]
+            json.dumps(filled_plan)
+            results[i] = _cached_verdict(filled_plan, user_query)
+        except (TypeError, ValueError, AttributeError, KeyError) as e:
+            print(f"Plan is not a valid JSON object: {e}")
+            results[i] = (False, "Plan rejected. Reason: The generated plan is not a valid JSON object.")
+            continue
+        if results[i] is not None:
+            continue
+        # An empty plan has no step verdicts to reuse and goes to the verifier, as in verify_plan
+        with _verdicts_lock:
+            cached = bool(keys) and all(_step_verdicts.get(key) is True for key in keys)
+        _count(steps_total=len(keys))
+        if cached:
+            _count(steps_cached=len(keys))
+            results[i] = (True, "Plan verified successfully.")
+        else:
+            pending.append((i, keys))
+
+    for start in range(0, len(pending), batch_size):
+        chunk = pending[start:start + batch_size]
+        verdicts = {}
+        try:
+            _count(llm_calls=1, batch_calls=1, steps_sent=sum(len(keys) for _, keys in chunk))
+            prompt = get_batch_verification_prompt([items[i] for i, _ in chunk])
+            llm = with_stage_timeout(llm_instance, "verifier")
+            response = run_with_deadline(lambda: llm.invoke(prompt), "verifier")
+            verdicts = _parse_batch_verdicts(response.content, len(chunk))
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            print(f"Error during batch verification LLM call: {e}")
+
+        for position, (i, keys) in enumerate(chunk):
+            if position not in verdicts:
+                _count(batch_fallbacks=1)
+                results[i] = verify_plan(*items[i], llm_instance)
+                continue
+            ok, reason, step = verdicts[position]
+            _count(batch_items=1)
+            verdict_cache.put(items[i][1], items[i][0], VERIFIER_PROMPT_VERSION, ok, reason or None)
+            if ok:
+                _remember(keys)
+                results[i] = (True, "Plan verified successfully.")
+            else:
+                if step is not None and 0 <= step < len(keys):
+                    _remember(keys[:step])
+                    _remember([keys[step]], ok=False)
+                results[i] = (False, f"Plan rejected. Reason: {reason}")
+    return results
@@ -1,8 +1,16 @@
 import os
+from functools import lru_cache
 
 small_model = "gpt-oss-120b"
 large_model= "gpt-oss-120b"
+# First try of the small-to-heavy cascade (see model_cascade.py)
+fast_model = "llama8b"
 
+def describeModels():
+    return f"fast={fast_model},small={small_model},heavy={large_model}"
+
+# Clients are built once per process (and before fork when the server preloads the app)
+@lru_cache(maxsize=None)
 def loadSmallModel():
     if small_model == "gemini":
         from langchain_google_genai import ChatGoogleGenerativeAI
@@ -21,6 +29,19 @@ def loadSmallModel():
         return ChatGroq( temperature=0, model_name="openai/gpt-oss-120b", groq_api_key=os.getenv("GROQ_API_KEY"))
     
 
+@lru_cache(maxsize=None)
+def loadFastModel():
+    if fast_model == "llama8b":
+        from langchain_groq import ChatGroq
+        return ChatGroq( temperature=0, model_name="llama-3.1-8b-instant", groq_api_key=os.getenv("GROQ_API_KEY"))
+    elif fast_model == "gpt-oss20b":
+        from langchain_groq import ChatGroq
+        return ChatGroq( temperature=0, model_name="openai/gpt-oss-20b", groq_api_key=os.getenv("GROQ_API_KEY"))
+    elif fast_model == "gemini-flash":
+        from langchain_google_genai import ChatGoogleGenerativeAI
+        return ChatGoogleGenerativeAI(model='gemini-2.5-flash', temperature=0, google_api_key=os.getenv("GOOGLE_API_KEY"))
+
+@lru_cache(maxsize=None)
 def loadHeavyModel():
     if large_model == "gemini":
         from langchain_google_genai import ChatGoogleGenerativeAI
@@ -0,0 +1,121 @@
+import os
+import re
+import threading
+
+from .similarity_engine import SimilarityEngine, embed
+from .work_item_store import WorkItemStore, load_work_items
+
+# Local implementations of the tools, for executing and load-testing plans offline against
+# a work-item corpus instead of the system of record. The corpus is a JSONL or Parquet file
+# (WORK_ITEMS_PATH, default dataset/work_items.jsonl) of work items with "id", "title",
+# optionally "body", and the fields works_list filters on (see work_item_store.py).
+# works_list runs on the columnar store, rebuilt after items change. Similarity vectors
+# live in SIMILARITY_INDEX_DIR when set (memory-mapped, reused across runs; only items
+# missing from it are embedded), otherwise in memory.
+
+WORK_ITEMS_PATH = os.getenv(
+    "WORK_ITEMS_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "dataset", "work_items.jsonl"),
+)
+SIMILARITY_INDEX_DIR = os.getenv("SIMILARITY_INDEX_DIR")
+SIMILAR_ITEMS = 10
+EMBED_BATCH = 10_000
+PREV_PATTERN = re.compile(r"^\$\$PREV\[(\d+)\]$")
+
+
+def _item_text(item: dict) -> str:
+    return f"{item.get('title', '')}\n{item.get('body', '')}"
+
+
+class LocalBackend:
+    def __init__(self, items: list = None, index_dir: str = SIMILARITY_INDEX_DIR):
+        self.items = {}
+        self.similarity = SimilarityEngine(index_dir)
+        self._store = None
+        self._lock = threading.Lock()
+        self.add_work_items(load_work_items(WORK_ITEMS_PATH) if items is None else items)
+
+    def add_work_items(self, items: list):
+        """Adds or updates work items; only items without a vector yet (or changed ones) are embedded."""
+        with self._lock:
+            pending = []
+            for item in items:
+                previous = self.items.get(item["id"])
+                self.items[item["id"]] = item
+                if previous is None and self.similarity.vector(item["id"]) is not None:
+                    continue
+                if previous is not None and _item_text(previous) == _item_text(item):
+                    continue
+                pending.append(item)
+            for start in range(0, len(pending), EMBED_BATCH):
+                batch = pending[start:start + EMBED_BATCH]
+                self.similarity.append([item["id"] for item in batch],
+                                       [embed(_item_text(item), self.similarity.dim) for item in batch])
+            self._store = None
+
+    @property
+    def store(self) -> WorkItemStore:
+        with self._lock:
+            if self._store is None:
+                self._store = WorkItemStore(list(self.items.values()))
+            return self._store
+
+    # --- Tools ---
+
+    def works_list(self, arguments: dict) -> list:
+        return self.store.works_list(arguments)
+
+    def get_similar_work_items(self, work_id, k: int = SIMILAR_ITEMS) -> list:
+        # Bound to a previous works_list output the argument is a list of IDs; use the first
+        if isinstance(work_id, list):
+            if not work_id:
+                return []
+            work_id = work_id[0]
+        return [item_id for item_id, _ in self.similarity.similar_to(work_id, k)]
+
+
+# tool_name -> fn(backend, arguments); argument names like "issue.priority" are not identifiers,
+# so arguments are passed as one dict
+TOOLS = {
+    "works_list": lambda backend, arguments: backend.works_list(arguments),
+    "get_similar_work_items": lambda backend, arguments: backend.get_similar_work_items(arguments["work_id"]),
+}
+
+
+def _bind(value, outputs: list):
+    """Replaces "$$PREV[i]" values (or one-element lists of them) with step i's output."""
+    if isinstance(value, list) and len(value) == 1 and isinstance(value[0], str) and PREV_PATTERN.match(value[0]):
+        value = value[0]
+    if isinstance(value, str):
+        m = PREV_PATTERN.match(value)
+        if m:
+            return outputs[int(m.group(1))]
+    return value
+
+
+def execute_plan(plan: list, backend: "LocalBackend" = None) -> list:
+    """
+    Runs every step on the local backend, passing $$PREV outputs along. Returns the output of
+    each step; raises NotImplementedError for a tool the backend does not implement.
+    """
+    backend = backend or get_local_backend()
+    outputs = []
+    for step in plan:
+        tool = TOOLS.get(step["tool_name"])
+        if tool is None:
+            raise NotImplementedError(f"the local backend has no '{step['tool_name']}' tool")
+        arguments = {arg["argument_name"]: _bind(arg.get("argument_value"), outputs) for arg in step.get("arguments", [])}
+        outputs.append(tool(backend, arguments))
+    return outputs
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_local_backend() -> LocalBackend:
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = LocalBackend()
+        return _backend
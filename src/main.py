@@ -1,14 +1,25 @@
 import os
 import json
+import time
 from dotenv import load_dotenv
 
 # Import your custom model loaders
 from loadModel import loadSmallModel, loadHeavyModel
 
 # Import the high-level functions from your other modules
-from .parser import generate_tool_chain
+from .parser import generate_tool_chain, last_skeleton_source
+from . import self_consistency
 from .argument_filler import fill_arguments_with_context
-from hallucination_check import verify_plan
+from .hallucination_check import verify_plan_diff
+from .plan_confidence import score_plan, needs_verification
+from .structured_output import last_logprob, reset_last_logprobs
+from .query_classifier import is_out_of_domain
+from .plan_templates import match_template
+from .skeleton_cache import skeleton_cache
+from .plan_store import get_plan_store, VERIFIED, REJECTED, ACCEPTED
+from .loadModel import describeModels
+from .tool_registry import get_registry
+from .token_budget import compact_json, compress_plan, compress_text, resolve_handles
 
 # Load environment variables from your .env file
 load_dotenv()
@@ -28,6 +39,8 @@ def main():
         print("Please ensure your .env file is set up correctly and all dependencies are installed.")
         return
 
+    plan_store = get_plan_store()
+
     while True:
         user_query = input("\nEnter your query (or type 'exit' to quit): ")
 
@@ -37,12 +50,53 @@ def main():
         if not user_query:
             print("Please enter a valid query.")
             continue
+        # Long pasted text travels through every stage as a $$TEXT[...] handle; the plan store
+        # is keyed on the raw text, since handles mean nothing to another process
+        raw_query = user_query
+        user_query = compress_text(user_query)
+        reset_last_logprobs()
+
+        start = time.perf_counter()
+        if is_out_of_domain(user_query):
+            print("\nQuery is outside the toolset's domain, returning an empty plan.")
+            print("Final Plan:\n[]")
+            plan_store.record(raw_query, filled_plan=[], latency_ms=(time.perf_counter() - start) * 1000, source="out_of_domain")
+            continue
 
         max_retries = 3
         feedback = None
         last_failed_plan = None
         final_plan = None
         is_valid = False
+        skeleton_plan_obj = None
+        message = None
+        verdict = None
+        source = "planner"
+
+        template_match = match_template(user_query)
+        past_plan = None if template_match else plan_store.latest_for_query(raw_query)
+        if template_match:
+            print(f"\nMatched plan template {template_match.template_id} (confidence {template_match.confidence:.2f}), skipping the LLM planner.")
+            report = score_plan(template_match.plan, user_query, source="template",
+                                template_confidence=template_match.confidence)
+            if needs_verification(report):
+                is_valid, message = verify_plan_diff(template_match.plan, user_query, small_model)
+                verdict = VERIFIED if is_valid else REJECTED
+            else:
+                is_valid, message = True, f"Verifier skipped, plan confidence {report['confidence']:.2f}"
+                verdict = ACCEPTED
+            if is_valid:
+                final_plan = template_match.plan
+                max_retries = 0
+                source = "template"
+            else:
+                print(f"\nTemplate plan rejected ({message}), planning instead.")
+                verdict = message = None
+        elif past_plan:
+            print("\nReusing a previously verified plan for this query from the plan store.")
+            final_plan = past_plan["filled_plan"]
+            max_retries = 0
+            source = "plan_store"
 
         for attempt in range(max_retries):
             try:
@@ -56,14 +110,18 @@ Original User Query: "{user_query}"
 A previous attempt to generate a plan failed. Please create a new plan that corrects the following error.
 Error: "{feedback}"
 Failed Plan:
-{json.dumps(last_failed_plan, indent=2)}
+{compact_json(compress_plan(last_failed_plan))}
 
 Generate a corrected JSON tool chain based on the original query and the error feedback.
 """
 
                 # --- Step 1: Generate the Skeleton Plan ---
                 print("\n--- Step 1: Generating tool chain skeleton... ---")
-                skeleton_plan_str = generate_tool_chain(current_prompt)
+                # Retry prompts embed feedback, so only the first attempt goes through the cache
+                if self_consistency.enabled() and feedback is None:
+                    skeleton_plan_str = self_consistency.vote_tool_chain(current_prompt)
+                else:
+                    skeleton_plan_str = generate_tool_chain(current_prompt, use_cache=feedback is None)
 
                 if not skeleton_plan_str:
                     print("Error: Failed to generate a skeleton plan.")
@@ -74,15 +132,24 @@ Generate a corrected JSON tool chain based on the original query and the error f
                 if skeleton_plan_str.startswith("```json"):
                     skeleton_plan_str = skeleton_plan_str.strip("```json").strip()
 
-                skeleton_plan_obj = json.loads(skeleton_plan_str)
+                skeleton_plan_obj = get_registry().canonicalize_plan(json.loads(skeleton_plan_str))
+                source = last_skeleton_source()
 
                 # --- Step 2: Fill the Argument Values ---
                 print("\n--- Step 2: Filling argument values... ---")
-                filled_plan = fill_arguments_with_context(skeleton_plan_obj, user_query,)
+                filled_plan = fill_arguments_with_context(skeleton_plan_obj, user_query)
 
                 # --- Step 3: Hallucination and Correctness Check ---
                 print("\n--- Step 3: Verifying correctness of the final plan... ---")
-                is_valid, message = verify_plan(filled_plan, user_query, small_model)
+                report = score_plan(filled_plan, user_query, source=source,
+                                    logprobs=[last_logprob("planner"), last_logprob("filler")])
+                if needs_verification(report):
+                    # Steps accepted on an earlier attempt are not sent to the verifier again
+                    is_valid, message = verify_plan_diff(filled_plan, user_query, small_model)
+                    verdict = VERIFIED if is_valid else REJECTED
+                else:
+                    is_valid, message = True, f"Verifier skipped, plan confidence {report['confidence']:.2f}"
+                    verdict = ACCEPTED
 
                 if is_valid:
                     print("\nPlan verified successfully!")
@@ -90,6 +157,7 @@ Generate a corrected JSON tool chain based on the original query and the error f
                     break  # Exit the retry loop on success
                 else:
                     print(f"\nValidation Failed: {message}")
+                    skeleton_cache.invalidate(user_query)
                     feedback = message
                     last_failed_plan = filled_plan
                     if attempt == max_retries - 1:
@@ -105,13 +173,22 @@ Generate a corrected JSON tool chain based on the original query and the error f
                 # For unexpected errors, it might be better to stop retrying for this query
                 break
 
-        # --- Step 4: Save the Final Result (only if a valid plan was created) ---
-        if final_plan:
-            output_filename = "filled_output.json"
-            with open(output_filename, "w") as f:
-                json.dump(final_plan, f, indent=4)
+        # --- Step 4: Record the attempt in the plan store, valid or not ---
+        final_plan = resolve_handles(final_plan)
+        last_failed_plan = resolve_handles(last_failed_plan)
+        plan_store.record(
+            raw_query,
+            skeleton=skeleton_plan_obj,
+            filled_plan=final_plan if final_plan else (last_failed_plan if isinstance(last_failed_plan, list) else None),
+            verdict=verdict,
+            verdict_message=message,
+            latency_ms=(time.perf_counter() - start) * 1000,
+            model=describeModels(),
+            source=source,
+        )
 
-            print(f"\nSuccess! The final, verified plan has been saved to '{output_filename}'")
+        if final_plan:
+            print(f"\nSuccess! The final plan has been recorded in the plan store ('{plan_store.path}')")
             print("Final Plan:")
             print(json.dumps(final_plan, indent=4))
 
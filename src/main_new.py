@@ -1,9 +1,19 @@
 import json
+import time
 from dotenv import load_dotenv
-from .parser import generate_tool_chain
+from .parser import generate_tool_chain, last_skeleton_source
+from . import self_consistency
 from .argument_filler import fill_arguments_with_context
-from .hallucination_check import verify_plan
-from .loadModel import loadHeavyModel
+from .hallucination_check import verify_plan_diff
+from .plan_confidence import score_plan, needs_verification
+from .structured_output import last_logprob
+from .loadModel import loadHeavyModel, describeModels
+from .query_classifier import is_out_of_domain
+from .plan_templates import match_template
+from .plan_store import get_plan_store, VERIFIED, REJECTED, ACCEPTED
+from .skeleton_cache import skeleton_cache
+from .tool_registry import get_registry
+from .token_budget import compress_text, resolve_handles
 
 def clean_json_output(output: str) -> str:
     cleaned = output.strip()
@@ -11,6 +21,25 @@ def clean_json_output(output: str) -> str:
         cleaned = cleaned.replace("```json", "").replace("```", "").strip()
     return cleaned
 
+def save_final_plan(query: str, filled_plan: list, start: float, skeleton: list = None,
+                    verdict: str = None, verdict_message: str = None, source: str = "planner"):
+    filled_plan = resolve_handles(filled_plan)
+    plan_store = get_plan_store()
+    plan_store.record(
+        query,
+        skeleton=skeleton,
+        filled_plan=filled_plan,
+        verdict=verdict,
+        verdict_message=verdict_message,
+        latency_ms=(time.perf_counter() - start) * 1000,
+        model=describeModels(),
+        source=source,
+    )
+    plan_store.flush()
+
+    print(f"\nSuccess — filled plan recorded in '{plan_store.path}'")
+    print(json.dumps(filled_plan, indent=4))
+
 def main():
     load_dotenv()
 
@@ -18,42 +47,75 @@ def main():
     if not query:
         print("Please enter a valid query.")
         return
+    # Long pasted text travels through every stage as a $$TEXT[...] handle; the plan store
+    # is keyed on the raw text, since handles mean nothing to another process
+    raw_query = query
+    query = compress_text(query)
+
+    start = time.perf_counter()
+    if is_out_of_domain(query):
+        print("Query is outside the toolset's domain, the plan is [].")
+        save_final_plan(raw_query, [], start, source="out_of_domain")
+        return
+
+    template_match = match_template(query)
+    if template_match:
+        print(f"Matched plan template {template_match.template_id} (confidence {template_match.confidence:.2f}), skipping the LLM planner and filler.")
+        report = score_plan(template_match.plan, query, source="template",
+                            template_confidence=template_match.confidence)
+        if not needs_verification(report):
+            save_final_plan(raw_query, template_match.plan, start, verdict=ACCEPTED, source="template",
+                            verdict_message=f"Verifier skipped, plan confidence {report['confidence']:.2f}")
+            return
+        flag, err = verify_plan_diff(template_match.plan, query, loadHeavyModel())
+        if flag:
+            save_final_plan(raw_query, template_match.plan, start, verdict=VERIFIED, source="template")
+            return
+        print(f"Template plan rejected ({err}), planning instead.")
 
     print("\n[1/2] Generating tool chain with parser.py...")
-    raw_output = generate_tool_chain(query)
+    if self_consistency.enabled():
+        raw_output = self_consistency.vote_tool_chain(query)
+    else:
+        raw_output = generate_tool_chain(query)
 
     # Clean up LLM markdown wrapping
     json_string_output = clean_json_output(raw_output)
 
     try:
-        plan = json.loads(json_string_output)
+        plan = get_registry().canonicalize_plan(json.loads(json_string_output))
     except json.JSONDecodeError:
         print("Parser returned invalid JSON after cleaning. Raw output:")
         print(raw_output)
         return
 
-    with open("output.json", "w") as f:
-        json.dump(plan, f, indent=4)
-    print("Parsed skeleton plan and saved to output.json")
+    print("Parsed skeleton plan")
 
     print("\n[2/2] Filling argument values with argument_filler.py...")
+    source = last_skeleton_source()
     filled_plan = fill_arguments_with_context(plan, query)
 
+    report = score_plan(filled_plan, query, source=source, logprobs=[last_logprob("planner"), last_logprob("filler")])
+    if not needs_verification(report):
+        save_final_plan(raw_query, filled_plan, start, skeleton=plan, verdict=ACCEPTED, source=source,
+                        verdict_message=f"Verifier skipped, plan confidence {report['confidence']:.2f}")
+        return
+
     verifier_model  = loadHeavyModel()
     tries = 3
+    flag, err = False, None
     for i in range(tries):
-        flag , err = verify_plan(filled_plan, query, verifier_model)
-        if not flag:
-            print("Reprompting\n")
-            filled_plan = fill_arguments_with_context(plan, query, err)
+        # Re-fills usually change a few arguments, only those steps are re-verified
+        flag , err = verify_plan_diff(filled_plan, query, verifier_model)
+        if flag:
+            break
+        skeleton_cache.invalidate(query)
+        print("Reprompting\n")
+        filled_plan = fill_arguments_with_context(plan, query, err)
 
 
-    final_path = "final_output.json"
-    with open(final_path, "w") as f:
-        json.dump(filled_plan, f, indent=4)
-
-    print(f"\nSuccess — filled plan saved to '{final_path}'")
-    print(json.dumps(filled_plan, indent=4))
+    save_final_plan(raw_query, filled_plan, start, skeleton=plan, source=source,
+                    verdict=VERIFIED if flag else REJECTED, verdict_message=err)
 
 if __name__ == "__main__":
     main()
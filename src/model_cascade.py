@@ -0,0 +1,106 @@
+import os
+import re
+import threading
+import time
+from collections import Counter
+
+from .deadline import DeadlineExceeded
+from .loadModel import loadFastModel, loadHeavyModel
+from .tool_registry import get_registry
+
+# Small-to-heavy model cascade. Each stage first runs on the fast model; the result is
+# checked locally and only a result that fails the check, or a call that errors, is redone
+# on the heavy model. A skeleton must be non-empty and name only registry tools and their
+# arguments; a fill must keep the skeleton's steps, give every needed argument a value of
+# the right type and only reference earlier steps' outputs. Per-stage escalation rates and
+# the latency saved are kept for /stats/cascade.
+
+CASCADE_ENABLED = os.getenv("MODEL_CASCADE", "1") == "1"
+# Tools whose arguments are all optional filters; any other tool needs a value for every
+# argument its skeleton step lists
+OPTIONAL_ARGUMENT_TOOLS = {"works_list"}
+PREV_REFERENCE = re.compile(r"\$\$PREV(?:\[(\d+)\])?")
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def _record(stage: str, **values):
+    with _stats_lock:
+        counter = _stats.setdefault(stage, Counter())
+        for name, value in values.items():
+            counter[name] += value
+
+
+def run_cascade(stage: str, attempt, accept):
+    """
+    attempt(model) produces the stage's result, accept(result) says whether it is good
+    enough. Returns the fast model's result when accepted, otherwise the heavy model's.
+    """
+    if not CASCADE_ENABLED:
+        return attempt(loadHeavyModel())
+
+    start = time.perf_counter()
+    try:
+        result = attempt(loadFastModel())
+        fast_ms = (time.perf_counter() - start) * 1000
+        if accept(result):
+            _record(stage, calls=1, fast_accepted=1, fast_ms=fast_ms, fast_accepted_ms=fast_ms)
+            return result
+        reason = "rejected by local checks"
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        fast_ms = (time.perf_counter() - start) * 1000
+        reason = f"error: {e}"
+
+    print(f"[CASCADE] {stage}: escalating to the heavy model ({reason})")
+    start = time.perf_counter()
+    result = attempt(loadHeavyModel())
+    _record(stage, calls=1, escalated=1, fast_ms=fast_ms, heavy_ms=(time.perf_counter() - start) * 1000)
+    return result
+
+
+def skeleton_problems(skeleton) -> list:
+    """Why a planner skeleton cannot be kept (empty when it can)."""
+    if not skeleton:
+        return ["no plan"]
+    return get_registry().validate_plan(skeleton)
+
+
+def fill_problems(skeleton: list, filled) -> list:
+    """Why a filled plan cannot be kept (empty when it can)."""
+    if filled is None:
+        return ["no plan"]
+    if [step.get("tool_name") for step in filled] != [step.get("tool_name") for step in skeleton]:
+        return ["steps differ from the skeleton"]
+    problems = get_registry().validate_plan(filled)
+    for i, step in enumerate(filled):
+        for arg in step.get("arguments", []):
+            name, value = arg.get("argument_name"), arg.get("argument_value")
+            if value in ("", None, []) and step.get("tool_name") not in OPTIONAL_ARGUMENT_TOOLS:
+                problems.append(f"step {i}: no value for '{name}'")
+            for m in PREV_REFERENCE.finditer(str(value)):
+                if m.group(1) is None or int(m.group(1)) >= i:
+                    problems.append(f"step {i}: '{name}' references '{m.group(0)}', which does not run before it")
+    return problems
+
+
+def cascade_stats() -> dict:
+    """
+    Per stage: calls, escalation rate, mean fast/heavy latency and the net latency saved: what
+    the fast-only calls would have cost on the heavy model (mean heavy latency seen so far)
+    minus every fast attempt, including the ones that were escalated anyway.
+    """
+    with _stats_lock:
+        report = {}
+        for stage, c in _stats.items():
+            heavy_mean = c["heavy_ms"] / c["escalated"] if c["escalated"] else None
+            report[stage] = {
+                "calls": c["calls"],
+                "escalation_rate": c["escalated"] / c["calls"] if c["calls"] else 0.0,
+                "fast_ms_mean": c["fast_ms"] / c["calls"] if c["calls"] else 0.0,
+                "heavy_ms_mean": heavy_mean,
+                "saved_ms_total": c["fast_accepted"] * heavy_mean - c["fast_ms"] if heavy_mean is not None else None,
+            }
+        return report
@@ -0,0 +1,206 @@
+import bisect
+import csv
+import os
+import re
+import threading
+from collections import Counter
+
+from .gazetteer import normalize
+from .tool_registry import get_registry
+
+# Local object-name index over a catalog snapshot (customers, parts, users...), used to
+# resolve search_object_by_name steps without the tool call. Names are looked up exactly,
+# then by prefix, then by trigram similarity; each lookup gets a confidence and only
+# confident, unambiguous ones replace the step: its $$PREV references become the object ID
+# and later references are renumbered. Prefix and trigram matches are scored below the
+# default resolve bar, so only exact names and IDs resolve unless it is lowered. Ambiguous
+# names, and rewrites the registry would reject, keep the tool call.
+#
+# The snapshot is a CSV file (OBJECT_CATALOG_PATH, default dataset/objects.csv) with the columns
+#   id,name,type
+# e.g.  don:core:dvrv-us-1:devo/0:revo/12,UltimateCustomer,customer
+
+CATALOG_PATH = os.getenv(
+    "OBJECT_CATALOG_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "dataset", "objects.csv"),
+)
+RESOLVE_CONFIDENCE = float(os.getenv("OBJECT_RESOLVE_CONFIDENCE", 0.9))
+# A runner-up this close to the best candidate makes the name ambiguous
+AMBIGUITY_MARGIN = 0.1
+MIN_TRIGRAM_SCORE = 0.5
+# Prefix and trigram confidences are scaled to at most this
+PARTIAL_MATCH_CEILING = 0.85
+MAX_CANDIDATES = 5
+PREV_PATTERN = re.compile(r"\$\$PREV\[(\d+)\]")
+
+_stats = Counter()
+
+
+def _key(name: str) -> str:
+    return normalize(name)[0].strip()
+
+
+def _trigrams(key: str) -> set:
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class ObjectIndex:
+    def __init__(self, objects=()):
+        self.objects = []
+        self._exact = {}
+        self._trigrams = {}
+        for object_id, name, object_type in objects:
+            key = _key(name)
+            if not key:
+                continue
+            position = len(self.objects)
+            self.objects.append({"id": object_id, "name": name, "type": object_type, "key": key})
+            self._exact.setdefault(key, []).append(position)
+            # IDs resolve to themselves ("Cust123" given as its own ID)
+            self._exact.setdefault(_key(object_id), []).append(position)
+            for gram in _trigrams(key):
+                self._trigrams.setdefault(gram, []).append(position)
+        self._sorted_keys = sorted(self._exact)
+
+    def __len__(self):
+        return len(self.objects)
+
+    def _candidates(self, positions, confidence: float, method: str) -> list:
+        return [dict(self.objects[p], confidence=confidence, method=method) for p in dict.fromkeys(positions)]
+
+    def lookup(self, name: str) -> list:
+        """Candidates (best first) with "id", "name", "type", "confidence" and "method"."""
+        key = _key(name)
+        if not key or not self.objects:
+            return []
+        if key in self._exact:
+            return self._candidates(self._exact[key], 1.0, "exact")
+
+        # Prefix: keys starting with the name, the more of the key the name covers the better
+        start = bisect.bisect_left(self._sorted_keys, key)
+        prefixed = []
+        for k in self._sorted_keys[start:]:
+            if not k.startswith(key) or len(prefixed) >= MAX_CANDIDATES:
+                break
+            prefixed.append(k)
+        if prefixed:
+            candidates = []
+            for k in prefixed:
+                candidates += self._candidates(self._exact[k], PARTIAL_MATCH_CEILING * (0.5 + 0.5 * len(key) / len(k)),
+                                              "prefix")
+            return sorted(candidates, key=lambda c: -c["confidence"])[:MAX_CANDIDATES]
+
+        # Trigram: Dice similarity over the trigrams the name shares with each object name
+        grams = _trigrams(key)
+        shared = Counter()
+        for gram in grams:
+            for position in self._trigrams.get(gram, ()):
+                shared[position] += 1
+        candidates = []
+        for position, count in shared.most_common(MAX_CANDIDATES * 4):
+            score = 2 * count / (len(grams) + len(_trigrams(self.objects[position]["key"])))
+            if score >= MIN_TRIGRAM_SCORE:
+                candidates.append(dict(self.objects[position], confidence=PARTIAL_MATCH_CEILING * score,
+                                       method="trigram"))
+        return sorted(candidates, key=lambda c: -c["confidence"])[:MAX_CANDIDATES]
+
+    def resolve(self, name: str, min_confidence: float = RESOLVE_CONFIDENCE):
+        """The best candidate when it is confident and clearly ahead of the runner-up, else None."""
+        candidates = self.lookup(name)
+        if not candidates:
+            return None
+        best = candidates[0]
+        if len(candidates) > 1 and best["confidence"] - candidates[1]["confidence"] < AMBIGUITY_MARGIN:
+            return None
+        return best if best["confidence"] >= min_confidence else None
+
+
+def load_objects(path: str = CATALOG_PATH) -> list:
+    """(id, name, type) rows from the catalog snapshot, or [] when there is none."""
+    if not os.path.exists(path):
+        return []
+    with open(path, newline="", encoding="utf-8") as f:
+        return [(row["id"].strip(), row["name"], (row.get("type") or "").strip())
+                for row in csv.DictReader(f) if row.get("id") and row.get("name")]
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_object_index() -> ObjectIndex:
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = ObjectIndex(load_objects())
+            if len(_index):
+                print(f"[OBJECTS] Indexed {len(_index)} objects from {CATALOG_PATH}")
+        return _index
+
+
+def _substitute(value, removed: int, object_id: str):
+    """Replaces $$PREV[removed] with the object ID and shifts references to later steps down by one."""
+    if isinstance(value, list):
+        return [_substitute(v, removed, object_id) for v in value]
+    if not isinstance(value, str):
+        return value
+    if value == f"$$PREV[{removed}]":
+        return object_id
+
+    def shift(m):
+        index = int(m.group(1))
+        if index == removed:
+            return object_id
+        return f"$$PREV[{index - 1}]" if index > removed else m.group(0)
+    return PREV_PATTERN.sub(shift, value)
+
+
+def resolve_object_lookups(plan: list, min_confidence: float = RESOLVE_CONFIDENCE):
+    """
+    Drops the search_object_by_name steps whose query the index resolves confidently and
+    writes the object ID where their output was used. A rewrite that adds registry validation
+    errors (an ID where the argument takes a list, say) is not made. Returns (plan, resolutions).
+    """
+    index = get_object_index()
+    if not len(index):
+        return plan, []
+    registry = get_registry()
+    errors = len(registry.validate_plan(plan))
+    resolutions = []
+    i = 0
+    while i < len(plan):
+        step = plan[i]
+        query = next((arg.get("argument_value") for arg in step.get("arguments", [])
+                      if arg.get("argument_name") == "query"), None)
+        if step.get("tool_name") != "search_object_by_name" or not isinstance(query, str) or "$$" in query:
+            i += 1
+            continue
+        # A lookup whose output nothing uses is the answer itself and stays a tool call
+        if f"$$PREV[{i}]" not in str([arg.get("argument_value") for later in plan[i + 1:]
+                                      for arg in later.get("arguments", [])]):
+            i += 1
+            continue
+        _stats["lookups"] += 1
+        match = index.resolve(query, min_confidence)
+        if match is None:
+            _stats["kept_tool_call"] += 1
+            i += 1
+            continue
+        rewritten = plan[:i] + [
+            dict(later, arguments=[dict(arg, argument_value=_substitute(arg.get("argument_value"), i, match["id"]))
+                                   for arg in later.get("arguments", [])])
+            for later in plan[i + 1:]
+        ]
+        if len(registry.validate_plan(rewritten)) > errors:
+            _stats["kept_invalid_rewrite"] += 1
+            i += 1
+            continue
+        _stats[f"resolved_{match['method']}"] += 1
+        resolutions.append({"query": query, "id": match["id"], "confidence": match["confidence"], "method": match["method"]})
+        plan = rewritten
+    return plan, resolutions
+
+
+def object_resolution_stats() -> dict:
+    return dict(_stats, objects=len(get_object_index()))
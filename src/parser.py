@@ -1,48 +1,91 @@
-from .loadModel import loadSmallModel
+from .model_cascade import run_cascade, skeleton_problems
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
 from dotenv import load_dotenv
 import os
 import json
+import threading
 
-from .tool_list.usable_tool_minj import API_LIST
+from .tool_registry import get_registry
+from .skeleton_cache import skeleton_cache
+from .plan_store import get_plan_store
+from .structured_output import (
+    invoke_structured, parse_plan_output, parse_lean_output, lean_plan_schema, reset_last_logprobs,
+)
+from .token_budget import budget_sections, compress_text, record_completion
 
 load_dotenv()
 
-def format_tool_docs(api_list: list) -> str:
-    doc_string = ""
-    for tool in api_list:
-        doc_string += f"Tool Name: {tool['name']}\n"
-        doc_string += f"Description: {tool['description']}\n"
-        if tool.get('arguments'):
-            doc_string += "Arguments:\n"
-            for arg in tool['arguments']:
-                doc_string += f"- {arg['argument_name']} ({arg['argument_type']}): {arg['argument_description']}\n"
-        doc_string += "---\n"
-    return doc_string
-
-def generate_tool_chain(query: str) -> str:
-    model = loadSmallModel()
-    formatted_tools = format_tool_docs(API_LIST)
+# "lean": the model lists tool names (with the relevant argument names) and the skeleton is
+# expanded from the registry. "full": the model writes out the whole skeleton JSON.
+PLANNER_MODE = os.getenv("PLANNER_MODE", "lean")
+
+LEAN_PROMPT_TEMPLATE = """
+    You are an expert AI agent. Your task is to identify the correct sequence of tools to call to answer the user's query.
+    You must output a JSON object whose "plan" key holds the tools to call, in order, one string per call.
+    Each string is the tool name followed by the names of the arguments the query gives a value for (or that take a previous tool's output), in parentheses.
+
+    Example output:
+    {{"plan": ["works_list(issue.priority, owned_by)", "summarize_objects(objects)"]}}
+
+    Here is the list of available tools you can use:
+    --- START OF TOOLS ---
+    {tools}
+    --- END OF TOOLS ---
+
+    User Query: "{user_query}"
+
+    Now, generate the JSON object based on the user query. Your output should only be the JSON object, with no other text or formatting.
+    If the query cannot be answered with these tools, output {{"plan": []}}.
+    """
+
+_last_source = threading.local()
+
+
+def last_skeleton_source() -> str:
+    """"skeleton_cache" when this thread's last skeleton came from the cache, otherwise "planner"."""
+    return getattr(_last_source, "value", "planner")
+
+
+def note_skeleton_source(source: str):
+    _last_source.value = source
+    if source == "skeleton_cache":
+        # No planner call was made, an older response's log-prob must not score this plan
+        reset_last_logprobs("planner")
+
+
+def generate_tool_chain(query: str, use_cache: bool = True, temperature: float = None) -> str:
+    # Long pasted text only matters to the filler, the planner sees a $$TEXT[...] handle
+    query = compress_text(query)
+    if use_cache:
+        cached = skeleton_cache.get(query)
+        if cached is not None:
+            print("Skeleton cache hit, skipping the planning call.")
+            note_skeleton_source("skeleton_cache")
+            return json.dumps(cached)
+    note_skeleton_source("planner")
+
+    sections = budget_sections("planner", {"tool_docs": get_registry().tool_docs(), "user_query": query})
 
     prompt_template = """
     You are an expert AI agent. Your task is to identify the correct sequence of tools to call to answer the user's query.
-    You must output a JSON array of objects. For each tool, you must provide the 'tool_name' and the 'argument_name'.
+    You must output a JSON object whose "plan" key holds an array of objects. For each tool, you must provide the 'tool_name' and the 'argument_name'.
     However, you MUST leave the 'argument_value' as an empty string ("").
 
     Here is the required JSON schema for your output:
     ```json
-    [
-        {{
-            "tool_name": "name_of_the_tool",
-            "arguments": [
-                {{
-                    "argument_name": "name_of_the_argument",
-                    "argument_value": ""
-                }}
-            ]
-        }}
-    ]
+    {{
+        "plan": [
+            {{
+                "tool_name": "name_of_the_tool",
+                "arguments": [
+                    {{
+                        "argument_name": "name_of_the_argument",
+                        "argument_value": ""
+                    }}
+                ]
+            }}
+        ]
+    }}
     ```
 
     Here is the list of available tools you can use:
@@ -52,18 +95,42 @@ def generate_tool_chain(query: str) -> str:
 
     User Query: "{user_query}"
 
-    Now, generate the JSON tool chain based on the user query. Your output should only be the JSON array, with no other text or formatting.
+    Now, generate the JSON tool chain based on the user query. Your output should only be the JSON object, with no other text or formatting.
+    If the query cannot be answered with these tools, output {{"plan": []}}.
     """
 
-    prompt = ChatPromptTemplate.from_template(prompt_template)
-    parser = StrOutputParser()
-    chain = prompt | model | parser
+    lean = PLANNER_MODE == "lean"
+    prompt = ChatPromptTemplate.from_template(LEAN_PROMPT_TEMPLATE if lean else prompt_template)
 
-    response = chain.invoke({
-        "tools": formatted_tools,
-        "user_query": query
-    })
-    return response
+    def attempt(model):
+        if temperature is not None:
+            # Diverse samples for self-consistency voting
+            model = model.bind(temperature=temperature)
+        response = invoke_structured(prompt, model, {
+            "tools": sections["tool_docs"],
+            "user_query": sections["user_query"]
+        }, stage="planner", schema=lean_plan_schema() if lean else None)
+        record_completion("planner", response)
+        try:
+            if lean:
+                return response, parse_lean_output(response, stage="planner")
+            return response, parse_plan_output(response, stage="planner")
+        except json.JSONDecodeError:
+            return response, None
+
+    # The fast model's plan is kept when it parses, is not empty (out-of-domain queries are
+    # filtered before planning) and names only registry tools and their arguments
+    response, skeleton = run_cascade("planner", attempt, lambda result: not skeleton_problems(result[1]))
+
+    # Hand callers a clean JSON array; unrecoverable output is returned raw so their
+    # JSONDecodeError handling still sees it
+    if skeleton is None:
+        return response
+
+    # A skeleton still naming unknown tools goes to the caller's retries, not into the cache
+    if use_cache and not get_registry().validate_plan(skeleton):
+        skeleton_cache.put(query, skeleton)
+    return json.dumps(skeleton)
 
 if __name__ == "__main__":
     while True:
@@ -85,12 +152,13 @@ if __name__ == "__main__":
             json_string_output = json_string_output.strip("```json").strip()
         
         try:
-            # 2. Save the output to a JSON file
+            # 2. Record the skeleton in the plan store
             parsed_json = json.loads(json_string_output)
-            with open("output.json", "w") as f:
-                json.dump(parsed_json, f, indent=4)
-            
-            print(f"Success! Output saved to output.json")
+            plan_store = get_plan_store()
+            plan_store.record(user_query, skeleton=parsed_json, source="parser_cli")
+            plan_store.flush()
+
+            print(f"Success! Skeleton recorded in '{plan_store.path}'")
 
         except json.JSONDecodeError:
             print("Error: Failed to decode the LLM output into valid JSON.")
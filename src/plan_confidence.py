@@ -0,0 +1,311 @@
+import math
+import os
+import re
+
+from .entity_extractor import extract_entities
+from .plan_templates import TOOL_CUES, load_dataset_rows
+from .tool_registry import get_registry
+
+# Confidence score for a filled plan, used to decide whether it needs the LLM verifier.
+# Combines structural validation against the registry, how many of the query's entities the
+# plan actually uses, how many arguments were left empty, whether the query asks for the
+# tools the plan calls, where the plan came from (template, previously verified plan,
+# follow-up delta or fresh planner output) and, when the provider exposes them, the mean
+# token log-prob of the planner and filler responses. Only plans scoring below the
+# threshold are sent to the verifier.
+#
+# The feature weights are fitted (logistic regression) on labelled plans built from the
+# dataset: each dataset plan is a correct example and perturbations of it (dropped or swapped
+# steps, wrong or blank values, an empty plan, another query's plan) are wrong ones. The
+# verifier threshold is fitted with them: the score that best separates the correct plans from
+# the wrong ones, unless VERIFY_CONFIDENCE_THRESHOLD overrides it. Source priors and the
+# log-prob weight have no offline labels and stay hand-set.
+#
+#   python3 -m src.plan_confidence    # fitted weights and leave-one-query-out accuracy
+
+# None: use the threshold fitted with the weights
+CONFIDENCE_THRESHOLD = float(os.environ["VERIFY_CONFIDENCE_THRESHOLD"]) if os.getenv("VERIFY_CONFIDENCE_THRESHOLD") else None
+
+FEATURES = ["structural_errors", "bad_references", "entity_coverage", "filled_ratio",
+            "unexplained_tools", "missing_tools"]
+# Used until (or when there is no dataset to) fit the weights
+DEFAULT_BIAS = -0.5
+DEFAULT_THRESHOLD = 0.9
+DEFAULT_WEIGHTS = {
+    "structural_errors": -4.0,
+    "bad_references": -3.0,
+    "entity_coverage": 2.5,
+    "filled_ratio": 1.0,
+    "unexplained_tools": -4.0,
+    "missing_tools": -3.0,
+}
+LOGPROB_WEIGHT = 3.0
+TEMPLATE_WEIGHT = 3.0
+SOURCE_PRIORS = {
+    "plan_store": 3.0,
+    "follow_up": 2.0,
+    "skeleton_cache": 0.5,
+    "planner": 0.0,
+}
+
+# Tools that only make sense when the query says something that calls for them, on top of
+# the action cues the template matcher uses
+SUPPORT_CUES = {
+    "get_sprint_id": re.compile(r"sprint", re.IGNORECASE),
+    "who_am_i": re.compile(r"\b(?:my|me|mine|i|myself|current user)\b", re.IGNORECASE),
+}
+TOOL_CUES_ALL = dict(TOOL_CUES, **SUPPORT_CUES)
+
+PREV_PATTERN = re.compile(r"\$\$PREV\[(\d+)\]")
+
+
+def _sigmoid(z: float) -> float:
+    return 1 / (1 + math.exp(-max(min(z, 30.0), -30.0)))
+
+
+def _bad_references(plan: list) -> int:
+    """$$PREV[i] references that point at the step itself, a later step or past the end."""
+    bad = 0
+    for index, step in enumerate(plan):
+        for arg in step.get("arguments", []):
+            for m in PREV_PATTERN.finditer(str(arg.get("argument_value"))):
+                bad += int(m.group(1)) >= index
+    return bad
+
+
+def _entity_coverage(plan: list, query: str) -> float:
+    """Share of the query's entity values (priorities, stages, IDs...) that appear in the plan."""
+    entities = extract_entities(query)
+    values = [str(v).lower() for kind, vs in entities.items() if kind not in ("self", "work_type") for v in vs]
+    if not values:
+        return 1.0
+    plan_text = str([arg.get("argument_value") for step in plan for arg in step.get("arguments", [])]).lower()
+    return sum(v in plan_text for v in values) / len(values)
+
+
+def _filled_ratio(plan: list) -> float:
+    arguments = [arg.get("argument_value") for step in plan for arg in step.get("arguments", [])]
+    if not arguments:
+        return 1.0
+    return sum(value not in ("", None, []) for value in arguments) / len(arguments)
+
+
+def _unexplained_tools(plan: list, query: str) -> float:
+    """Share of the plan's cued tools (summarize, sprint, who_am_i...) the query gives no cue for."""
+    tools = [step.get("tool_name") for step in plan if step.get("tool_name") in TOOL_CUES_ALL]
+    if not tools:
+        return 0.0
+    return sum(not TOOL_CUES_ALL[tool].search(query) for tool in tools) / len(tools)
+
+
+def _missing_tools(plan: list, query: str) -> float:
+    """
+    Share of the actions the query asks for (summarize, prioritize...) that no step performs.
+    Out-of-domain queries never get here (the gate answers them with an empty plan first), so
+    an empty plan misses everything.
+    """
+    if not plan:
+        return 1.0
+    cued = {tool for tool, cue in TOOL_CUES.items() if cue.search(query)}
+    if not cued:
+        return 0.0
+    return len(cued - {step.get("tool_name") for step in plan}) / len(cued)
+
+
+def plan_features(plan: list, query: str) -> dict:
+    return {
+        "structural_errors": min(len(get_registry().validate_plan(plan)), 1),
+        "bad_references": min(_bad_references(plan), 1),
+        "entity_coverage": _entity_coverage(plan, query),
+        "filled_ratio": _filled_ratio(plan),
+        "unexplained_tools": _unexplained_tools(plan, query),
+        "missing_tools": _missing_tools(plan, query),
+    }
+
+
+# --- Labelled plans and fitting ---
+
+def _wrong_values(value):
+    if isinstance(value, list):
+        return [_wrong_values(v) for v in value]
+    if isinstance(value, str) and value and not PREV_PATTERN.search(value):
+        return f"wrong-{value[::-1]}"
+    return value
+
+
+def labelled_plans(rows: list) -> list:
+    """
+    (query, plan, label) triples: every dataset plan labelled 1 and perturbations of it
+    labelled 0 (a step dropped, a tool swapped, one step's values blanked or wrong, no steps
+    at all, another query's plan, a lone support tool). Rows whose plan is empty are left
+    out: those queries are the out-of-domain gate's to answer, not the verifier's.
+    """
+    registry = get_registry()
+    tools = sorted(registry.snapshot.entries)
+    examples = []
+    rows = [(query, gold) for query, gold in rows if gold]
+    for i, (query, gold) in enumerate(rows):
+        gold = registry.canonicalize_plan(gold)
+        examples.append((query, gold, 1))
+        wrong = []
+        for s, step in enumerate(gold):
+            if len(gold) > 1:
+                wrong.append(gold[:s] + gold[s + 1:])
+            swap = tools[(tools.index(step["tool_name"]) + 1) % len(tools)] if step["tool_name"] in tools else tools[0]
+            wrong.append(gold[:s] + [{"tool_name": swap, "arguments": []}] + gold[s + 1:])
+            if step.get("arguments"):
+                # The swapped tool called with the original arguments, which it does not take
+                wrong.append(gold[:s] + [dict(step, tool_name=swap)] + gold[s + 1:])
+                for broken in ("", None):
+                    arguments = [dict(arg, argument_value=_wrong_values(arg["argument_value"]) if broken is None else "")
+                                 for arg in step["arguments"]]
+                    wrong.append(gold[:s] + [dict(step, arguments=arguments)] + gold[s + 1:])
+        other = registry.canonicalize_plan(rows[(i + 1) % len(rows)][1])
+        wrong.append(other)
+        wrong.append([])
+        wrong += [[{"tool_name": tool, "arguments": []}] for tool in SUPPORT_CUES if tool in registry.snapshot.entries]
+        examples += [(query, plan, 0) for plan in wrong if plan != gold]
+    return examples
+
+
+class ConfidenceModel:
+    def __init__(self, weights: dict = None, bias: float = DEFAULT_BIAS, threshold: float = DEFAULT_THRESHOLD):
+        self.weights = dict(weights or DEFAULT_WEIGHTS)
+        self.bias = bias
+        self.threshold = threshold
+        self.fitted = False
+
+    def z(self, features: dict) -> float:
+        return self.bias + sum(self.weights[name] * features[name] for name in FEATURES)
+
+    def fit(self, examples: list, epochs: int = 200, lr: float = 0.1, l2: float = 1e-3):
+        """
+        examples: (features, label) pairs. Classes are re-weighted since every correct plan
+        comes with several wrong ones. Also sets the threshold, see _fit_threshold.
+        """
+        positives = sum(1 for _, y in examples if y == 1)
+        negatives = len(examples) - positives
+        if positives == 0 or negatives == 0:
+            print("[CONFIDENCE] Labelled plans have a single class, keeping the default weights.")
+            return self
+
+        class_weight = {1: len(examples) / (2.0 * positives), 0: len(examples) / (2.0 * negatives)}
+        self.weights = {name: 0.0 for name in FEATURES}
+        self.bias = 0.0
+        for _ in range(epochs):
+            for features, y in examples:
+                p = _sigmoid(self.z(features))
+                grad = (p - y) * class_weight[y]
+                for name in FEATURES:
+                    self.weights[name] -= lr * (grad * features[name] + l2 * self.weights[name])
+                self.bias -= lr * grad
+        self._fit_threshold(examples)
+        self.fitted = True
+        return self
+
+    def _fit_threshold(self, examples: list):
+        """
+        Picks, among the correct plans' scores, the threshold with the largest gap between the
+        share of correct plans and the share of wrong plans at or above it (the higher one on
+        ties). Wrong plans whose features match a correct plan's cannot be told apart and pass
+        with it; those are what the log-prob and source terms are for.
+        """
+        scored = [(_sigmoid(self.z(features)), y) for features, y in examples]
+        positives = [p for p, y in scored if y == 1]
+        negatives = [p for p, y in scored if y == 0]
+
+        def gap(threshold):
+            return (sum(p >= threshold for p in positives) / len(positives)
+                    - sum(p >= threshold for p in negatives) / len(negatives))
+
+        self.threshold = max(set(positives), key=lambda t: (gap(t), t))
+
+
+_model = None
+
+
+def get_confidence_model() -> ConfidenceModel:
+    global _model
+    if _model is None:
+        examples = [(plan_features(plan, query), label) for query, plan, label in labelled_plans(load_dataset_rows())]
+        _model = ConfidenceModel().fit(examples) if examples else ConfidenceModel()
+    return _model
+
+
+# --- Scoring ---
+
+def score_plan(plan: list, query: str, source: str = "planner", template_confidence: float = None,
+               logprobs: list = None, model: ConfidenceModel = None) -> dict:
+    """
+    Returns {"confidence": float in [0, 1], **features}. logprobs are mean token log-probs of
+    the responses that produced the plan (None entries are ignored).
+    """
+    if not isinstance(plan, list):
+        return {"confidence": 0.0, "structural_errors": 1, "source": source}
+
+    features = plan_features(plan, query)
+    z = (model or get_confidence_model()).z(features)
+
+    known = [lp for lp in logprobs or [] if lp is not None]
+    if known:
+        # Mean per-token probability, centred so an unsure model pulls the score down
+        features["logprob"] = math.exp(sum(known) / len(known))
+        z += LOGPROB_WEIGHT * (features["logprob"] - 0.5)
+
+    if source == "template" and template_confidence is not None:
+        z += TEMPLATE_WEIGHT * template_confidence
+    else:
+        z += SOURCE_PRIORS.get(source, 0.0)
+    features["source"] = source
+
+    features["confidence"] = _sigmoid(z)
+    return features
+
+
+def verify_threshold() -> float:
+    return get_confidence_model().threshold if CONFIDENCE_THRESHOLD is None else CONFIDENCE_THRESHOLD
+
+
+def needs_verification(report: dict, threshold: float = None) -> bool:
+    threshold = verify_threshold() if threshold is None else threshold
+    needed = report["confidence"] < threshold
+    print(f"[CONFIDENCE] {report['confidence']:.2f} ({report['source']}), "
+          f"{'verifying' if needed else 'skipping the verifier'}")
+    return needed
+
+
+def evaluate(rows: list, threshold: float = CONFIDENCE_THRESHOLD) -> dict:
+    """
+    Leave-one-query-out: the labelled plans of each query are scored by a model (and, with no
+    threshold given, the threshold) fitted on the other queries' plans. Reports how many wrong plans would skip the verifier and how
+    many correct ones would still be sent to it.
+    """
+    labelled = [(query, plan_features(plan, query), label) for query, plan, label in labelled_plans(rows)]
+    wrong_accepted = correct_verified = wrong = correct = 0
+    for query, _ in rows:
+        model = ConfidenceModel().fit([(f, y) for q, f, y in labelled if q != query])
+        for q, features, label in labelled:
+            if q != query:
+                continue
+            confident = _sigmoid(model.z(features)) >= (model.threshold if threshold is None else threshold)
+            if label:
+                correct += 1
+                correct_verified += not confident
+            else:
+                wrong += 1
+                wrong_accepted += confident
+    return {"correct": correct, "wrong": wrong, "wrong_accepted": wrong_accepted,
+            "correct_verified": correct_verified}
+
+
+if __name__ == "__main__":
+    rows = load_dataset_rows()
+    model = get_confidence_model()
+    print(f"Fitted on {len(labelled_plans(rows))} labelled plans from {sum(1 for _, gold in rows if gold)} queries:")
+    print(f"  bias {model.bias:+.2f}  " + "  ".join(f"{name} {model.weights[name]:+.2f}" for name in FEATURES))
+    print(f"  verifier threshold {verify_threshold():.2f}"
+          f"{'' if CONFIDENCE_THRESHOLD is None else ' (VERIFY_CONFIDENCE_THRESHOLD)'}")
+    metrics = evaluate(rows)
+    print(f"Leave-one-query-out at {'the fitted thresholds' if CONFIDENCE_THRESHOLD is None else CONFIDENCE_THRESHOLD}: "
+          f"{metrics['wrong_accepted']}/{metrics['wrong']} wrong plans skip the verifier, "
+          f"{metrics['correct_verified']}/{metrics['correct']} correct plans are verified")
@@ -0,0 +1,231 @@
+import atexit
+import hashlib
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+# SQLite-backed history of every plan we produce. Replaces the output.json /
+# filled_output.json / final_output.json files the scripts used to overwrite: writes are
+# queued and committed in batches by a single writer thread, the database runs in WAL
+# mode so lookups never block on it, and rows are indexed by query hash and tool name.
+
+PLAN_STORE_PATH = os.getenv("PLAN_STORE_PATH", "plan_store.db")
+BATCH_SIZE = 64
+FLUSH_INTERVAL_SECONDS = 0.5
+# flush() gives up after this long instead of hanging on a stuck or dead writer
+FLUSH_TIMEOUT_SECONDS = 10.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS plans (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    query_hash TEXT NOT NULL,
+    query TEXT NOT NULL,
+    skeleton TEXT,
+    filled_plan TEXT,
+    verdict TEXT,
+    verdict_message TEXT,
+    latency_ms REAL,
+    model TEXT,
+    source TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_plans_query_hash ON plans (query_hash, created_at);
+CREATE INDEX IF NOT EXISTS idx_plans_latency ON plans (latency_ms);
+CREATE TABLE IF NOT EXISTS plan_tools (
+    plan_id INTEGER NOT NULL REFERENCES plans (id),
+    position INTEGER NOT NULL,
+    tool_name TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_plan_tools_tool ON plan_tools (tool_name, plan_id);
+"""
+
+VERIFIED = "verified"
+REJECTED = "rejected"
+# Confident enough to skip the LLM verifier; never reused as if it had been verified
+ACCEPTED = "accepted"
+
+
+def query_hash(query: str) -> str:
+    """Case- and whitespace-insensitive hash of the query text."""
+    normalized = " ".join(query.lower().split())
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def _is_plan(plan) -> bool:
+    return plan is None or (isinstance(plan, list) and all(isinstance(step, dict) for step in plan))
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+class PlanStore:
+    def __init__(self, path: str = PLAN_STORE_PATH):
+        self.path = path
+        conn = _connect(path)
+        conn.executescript(SCHEMA)
+        conn.close()
+
+        self._start_writer()
+        atexit.register(self.flush)
+
+    def _start_writer(self):
+        """Also called in forked workers, which inherit neither the writer thread nor its connection."""
+        self._queue = queue.Queue()
+        self._local = threading.local()
+        self._writer = threading.Thread(target=self._write_loop, name="plan-store-writer", daemon=True)
+        self._writer.start()
+
+    # --- Writes ---
+
+    def record(self, query: str, skeleton=None, filled_plan=None, verdict: str = None,
+               verdict_message: str = None, latency_ms: float = None, model: str = None,
+               source: str = None):
+        """Queues one plan for the writer thread. Returns immediately, False when the plan is malformed."""
+        if not _is_plan(skeleton) or not _is_plan(filled_plan):
+            print(f"[PLAN STORE] Not recording a malformed plan for query: {query!r}")
+            return False
+        self._queue.put((query, skeleton, filled_plan, verdict, verdict_message, latency_ms, model, source, time.time()))
+        return True
+
+    def flush(self, timeout: float = FLUSH_TIMEOUT_SECONDS) -> bool:
+        """Blocks until every queued record has been committed. False if that took longer than timeout."""
+        if not self._writer.is_alive():
+            print("[PLAN STORE] Writer thread is not running, queued plans were not written")
+            return False
+        done = threading.Event()
+        self._queue.put(done)
+        if not done.wait(timeout):
+            print(f"[PLAN STORE] Flush timed out after {timeout:.0f}s")
+            return False
+        return True
+
+    def _write_loop(self):
+        conn = _connect(self.path)
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + FLUSH_INTERVAL_SECONDS
+            while len(batch) < BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+
+            rows = [item for item in batch if not isinstance(item, threading.Event)]
+            if rows:
+                try:
+                    self._write_batch(conn, rows)
+                except Exception as e:
+                    print(f"[PLAN STORE] Failed to write {len(rows)} plans: {e}")
+            for item in batch:
+                if isinstance(item, threading.Event):
+                    item.set()
+
+    def _write_batch(self, conn: sqlite3.Connection, rows: list):
+        with conn:
+            for row in rows:
+                # A row that cannot be written is rolled back, logged and skipped; it must not
+                # take the rest of the batch (or the writer thread) down with it
+                conn.execute("SAVEPOINT plan_row")
+                try:
+                    self._write_row(conn, *row)
+                except Exception as e:
+                    conn.execute("ROLLBACK TO plan_row")
+                    print(f"[PLAN STORE] Skipping plan for query {row[0]!r}: {e}")
+                conn.execute("RELEASE plan_row")
+
+    @staticmethod
+    def _write_row(conn: sqlite3.Connection, query, skeleton, filled_plan, verdict, message, latency_ms,
+                   model, source, created_at):
+        cursor = conn.execute(
+            "INSERT INTO plans (query_hash, query, skeleton, filled_plan, verdict, verdict_message,"
+            " latency_ms, model, source, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                query_hash(query), query,
+                json.dumps(skeleton) if skeleton is not None else None,
+                json.dumps(filled_plan) if filled_plan is not None else None,
+                verdict, message, latency_ms, model, source, created_at,
+            ),
+        )
+        tools = filled_plan if filled_plan is not None else skeleton or []
+        conn.executemany(
+            "INSERT INTO plan_tools (plan_id, position, tool_name) VALUES (?, ?, ?)",
+            [(cursor.lastrowid, i, step.get("tool_name", "")) for i, step in enumerate(tools)],
+        )
+
+    # --- Reads ---
+
+    def _reader(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = _connect(self.path)
+        return conn
+
+    @staticmethod
+    def _to_dict(row) -> dict:
+        if row is None:
+            return None
+        item = dict(row)
+        for key in ("skeleton", "filled_plan"):
+            if item.get(key) is not None:
+                item[key] = json.loads(item[key])
+        return item
+
+    def latest_for_query(self, query: str, verified_only: bool = True) -> dict:
+        """Most recent plan recorded for the query (only verified ones by default), or None."""
+        sql = "SELECT * FROM plans WHERE query_hash = ?"
+        if verified_only:
+            sql += f" AND verdict = '{VERIFIED}'"
+        sql += " ORDER BY created_at DESC LIMIT 1"
+        return self._to_dict(self._reader().execute(sql, (query_hash(query),)).fetchone())
+
+    def plans_with_tool(self, tool_name: str, limit: int = 50) -> list:
+        rows = self._reader().execute(
+            "SELECT plans.* FROM plan_tools JOIN plans ON plans.id = plan_tools.plan_id"
+            " WHERE plan_tools.tool_name = ? GROUP BY plans.id ORDER BY plans.created_at DESC LIMIT ?",
+            (tool_name, limit),
+        ).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def slowest(self, limit: int = 20) -> list:
+        rows = self._reader().execute(
+            "SELECT * FROM plans WHERE latency_ms IS NOT NULL ORDER BY latency_ms DESC LIMIT ?", (limit,)
+        ).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_plan_store() -> PlanStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = PlanStore()
+        return _store
+
+
+def _reset_after_fork():
+    global _store_lock
+    _store_lock = threading.Lock()
+    if _store is not None:
+        _store._start_writer()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+if __name__ == "__main__":
+    store = get_plan_store()
+    print(f"Slowest plans in {store.path}:")
+    for item in store.slowest(10):
+        tools = " > ".join(step["tool_name"] for step in item["filled_plan"] or item["skeleton"] or [])
+        print(f"  {item['latency_ms']:.0f} ms  [{item['verdict'] or 'unverified'}] {item['query']}  ({tools})")
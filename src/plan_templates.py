@@ -0,0 +1,258 @@
+import csv
+import json
+import math
+import os
+import re
+from collections import Counter
+
+from .entity_extractor import ARG_SLOTS, extract_entities, mask_entities
+from .tool_registry import get_registry
+
+# Canonical plan templates mined from the dataset. A query that matches a template with
+# high confidence gets its plan built locally (slots filled by the entity extractor),
+# so neither the planner nor the argument filler LLM is called.
+
+DATASET_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "dataset")
+
+TEMPLATE_CONFIDENCE = 0.55
+
+# Slots that may fall back to the value seen in the dataset when the query does not say.
+DEFAULTABLE_SLOTS = {"work_type"}
+# Entity kinds that are too generic to count against a template when left unused. Any other
+# entity the template has no slot for rules it out: filling the template would silently drop
+# that filter ("... from slack for customer Acme" losing its source_channel).
+IGNORED_EXTRA_KINDS = {"work_type", "self"}
+
+# A template is only eligible when the actions mentioned in the query are exactly the ones its
+# tools perform, otherwise "Find items related to TKT-1" would pick up a summarize step it never
+# asked for and "... and rank them" would silently lose its prioritize step.
+TOOL_CUES = {
+    "summarize_objects": re.compile(r"summar", re.IGNORECASE),
+    "prioritize_objects": re.compile(r"priorit|rank", re.IGNORECASE),
+    "add_work_items_to_sprint": re.compile(r"sprint", re.IGNORECASE),
+    "get_similar_work_items": re.compile(r"similar|related|\blike\b", re.IGNORECASE),
+    "create_actionable_tasks_from_text": re.compile(r"transcript|action|notes|\bcreate\b|generate (?:\w+ )?(?:issues|tasks)", re.IGNORECASE),
+}
+
+PREV_PATTERN = re.compile(r"^\$\$PREV\[(\d+)\]$")
+
+
+class TemplateMatch:
+    def __init__(self, template_id: str, confidence: float, plan: list):
+        self.template_id = template_id
+        self.confidence = confidence
+        self.plan = plan
+
+    def __repr__(self):
+        return f"TemplateMatch({self.template_id!r}, confidence={self.confidence:.2f})"
+
+
+def load_dataset_rows(dataset_dir: str = DATASET_DIR) -> list:
+    """Returns (query, json_output) pairs from dataset.csv."""
+    rows = []
+    csv_path = os.path.join(dataset_dir, "dataset.csv")
+    if os.path.exists(csv_path):
+        with open(csv_path, newline="") as f:
+            for row in csv.DictReader(f):
+                rows.append((row["query"], json.loads(row["json_output"])))
+    return rows
+
+
+def _prev_binding(value):
+    if isinstance(value, list) and len(value) == 1 and isinstance(value[0], str):
+        m = PREV_PATTERN.match(value[0])
+        return {"prev": int(m.group(1)), "list": True} if m else None
+    if isinstance(value, str):
+        m = PREV_PATTERN.match(value)
+        return {"prev": int(m.group(1)), "list": False} if m else None
+    return None
+
+
+def _binding_for(arg_name: str, value, entities: dict) -> dict:
+    binding = _prev_binding(value)
+    if binding:
+        return binding
+
+    kind = ARG_SLOTS.get(arg_name)
+    is_list = isinstance(value, list)
+    values = value if is_list else [value]
+    found = [str(v).lower() for v in entities.get(kind, [])]
+    if kind and all(str(v).lower() in found for v in values):
+        return {"slot": kind, "list": is_list, "default": value if kind in DEFAULTABLE_SLOTS else None}
+    return {"const": value}
+
+
+def mine_templates(rows: list) -> list:
+    """
+    Groups dataset rows by plan shape (tool sequence, argument names and bindings).
+    Each template keeps the masked example queries it was mined from.
+    """
+    templates = {}
+    for query, plan in rows:
+        if not plan:
+            continue
+        entities = extract_entities(query)
+        steps = []
+        for step in plan:
+            tool_name = get_registry().resolve(step["tool_name"]) or step["tool_name"]
+            arguments = [
+                {"argument_name": arg["argument_name"],
+                 "binding": _binding_for(arg["argument_name"], arg["argument_value"], entities)}
+                for arg in step.get("arguments", [])
+            ]
+            steps.append({"tool_name": tool_name, "arguments": arguments})
+
+        key = json.dumps(steps, sort_keys=True)
+        if key not in templates:
+            required = {
+                arg["binding"]["slot"]
+                for step in steps for arg in step["arguments"]
+                if "slot" in arg["binding"] and arg["binding"]["default"] is None
+            }
+            if any(step["tool_name"] == "who_am_i" for step in steps):
+                required.add("self")
+            used = {arg["binding"]["slot"] for step in steps for arg in step["arguments"] if "slot" in arg["binding"]}
+            templates[key] = {
+                "id": f"t{len(templates)}",
+                "tools": [step["tool_name"] for step in steps],
+                "steps": steps,
+                "required": required,
+                "used": used,
+                "examples": [],
+            }
+        templates[key]["examples"].append(mask_entities(query))
+    return list(templates.values())
+
+
+def _tokens(masked_query: str) -> list:
+    return re.findall(r"<\w+>|[a-z0-9]+", masked_query)
+
+
+class TemplateIndex:
+    """
+    TF-IDF index over the masked example queries of every template, with an inverted
+    token index so only examples sharing a token with the query are scored.
+    """
+
+    def __init__(self, templates: list):
+        self.templates = templates
+        self.examples = []  # (template position, {token: weight})
+        self.postings = {}
+
+        doc_freq = Counter()
+        tokenized = []
+        for pos, template in enumerate(templates):
+            for example in template["examples"]:
+                tokens = Counter(_tokens(example))
+                tokenized.append((pos, tokens))
+                doc_freq.update(tokens.keys())
+
+        n_docs = max(len(tokenized), 1)
+        self.idf = {t: math.log((1 + n_docs) / (1 + df)) + 1.0 for t, df in doc_freq.items()}
+        for pos, tokens in tokenized:
+            vector = self._weigh(tokens)
+            example_id = len(self.examples)
+            self.examples.append((pos, vector))
+            for token in vector:
+                self.postings.setdefault(token, []).append(example_id)
+
+    def _weigh(self, tokens: Counter) -> dict:
+        vector = {t: c * self.idf.get(t, 0.0) for t, c in tokens.items() if t in self.idf}
+        norm = math.sqrt(sum(v * v for v in vector.values())) or 1.0
+        return {t: v / norm for t, v in vector.items()}
+
+    def similarities(self, masked_query: str) -> dict:
+        """Returns {template position: best cosine similarity over its examples}."""
+        query_vector = self._weigh(Counter(_tokens(masked_query)))
+        scores = {}
+        for token, weight in query_vector.items():
+            for example_id in self.postings.get(token, []):
+                scores[example_id] = scores.get(example_id, 0.0) + weight * self.examples[example_id][1][token]
+
+        best = {}
+        for example_id, score in scores.items():
+            pos = self.examples[example_id][0]
+            best[pos] = max(best.get(pos, 0.0), score)
+        return best
+
+
+def fill_template(template: dict, entities: dict) -> list:
+    plan = []
+    for step in template["steps"]:
+        arguments = []
+        for arg in step["arguments"]:
+            binding = arg["binding"]
+            if "prev" in binding:
+                ref = f"$$PREV[{binding['prev']}]"
+                value = [ref] if binding["list"] else ref
+            elif "slot" in binding:
+                values = entities.get(binding["slot"])
+                if values:
+                    value = list(values) if binding["list"] else values[0]
+                else:
+                    value = binding["default"]
+            else:
+                value = binding["const"]
+            arguments.append({"argument_name": arg["argument_name"], "argument_value": value})
+        plan.append({"tool_name": step["tool_name"], "arguments": arguments})
+    return plan
+
+
+_index = None
+
+
+def get_template_index() -> TemplateIndex:
+    global _index
+    if _index is None:
+        _index = TemplateIndex(mine_templates(load_dataset_rows()))
+    return _index
+
+
+def match_template(query: str, min_confidence: float = TEMPLATE_CONFIDENCE, index: TemplateIndex = None):
+    """
+    Returns a TemplateMatch with a fully filled plan, or None when no template matches
+    with at least min_confidence (the caller then falls back to the LLM planner).
+    """
+    index = index or get_template_index()
+    entities = extract_entities(query)
+    present = set(entities)
+    cued_tools = {tool for tool, cue in TOOL_CUES.items() if cue.search(query)}
+
+    best = None
+    for pos, similarity in index.similarities(mask_entities(query)).items():
+        template = index.templates[pos]
+        if not template["required"].issubset(present):
+            continue
+        if {tool for tool in template["tools"] if tool in TOOL_CUES} != cued_tools:
+            continue
+        if present - template["used"] - IGNORED_EXTRA_KINDS:
+            continue
+        if best is None or similarity > best[0]:
+            best = (similarity, template)
+
+    if best is None or best[0] < min_confidence:
+        return None
+    confidence, template = best
+    return TemplateMatch(template["id"], confidence, fill_template(template, entities))
+
+
+if __name__ == "__main__":
+    index = get_template_index()
+    print(f"Mined {len(index.templates)} templates from the dataset:")
+    for template in index.templates:
+        print(f"  {template['id']}: {' -> '.join(template['tools'])}  slots={sorted(template['used'])}")
+
+    # Leave-one-out: each query is matched against the templates mined from the other rows,
+    # so a query only counts as covered when its plan shape generalizes beyond itself
+    rows = load_dataset_rows()
+    exact = matched = 0
+    for i, (query, expected) in enumerate(rows):
+        held_out = TemplateIndex(mine_templates(rows[:i] + rows[i + 1:]))
+        match = match_template(query, index=held_out)
+        if match is None:
+            continue
+        matched += 1
+        expected = get_registry().canonicalize_plan(expected)
+        exact += match.plan == expected
+    print(f"Held-out template coverage: {matched}/{len(rows)} queries, "
+          f"{exact} reproduce the dataset plan exactly, {matched - exact} differ")
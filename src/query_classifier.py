@@ -0,0 +1,250 @@
+import csv
+import json
+import math
+import os
+import re
+import zlib
+
+# Fast out-of-domain gate that runs before generate_tool_chain.
+# Tier 1: rules (known ID formats always in-domain; anything else goes on to tier 2, since a
+# query without domain vocabulary, e.g. "What are my P0s?", can still be in-domain).
+# Tier 2: logistic regression over hashed word/char n-grams trained from the dataset.
+# Tier 3 (optional): a yes/no call to the small model for queries in the uncertain band.
+
+DATASET_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "dataset")
+# Benchmark queries, all in-domain
+QUERIES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "queries.csv")
+
+HASH_BUCKETS = 2 ** 18
+OOD_THRESHOLD = 0.5
+UNCERTAIN_BAND = (0.35, 0.65)
+USE_LLM_TIER = False
+# Labelled out-of-domain queries the linear tier needs before it may reject anything
+MIN_NEGATIVES = int(os.getenv("CLASSIFIER_MIN_NEGATIVES", 20))
+
+ID_PATTERN = re.compile(r"\b(?:TKT|FEAT|ENH|PROD|CAPL|ISS|REV|DEVU|DON)-\d+\b|don:core:", re.IGNORECASE)
+DOMAIN_PHRASES = re.compile(r"\bwho\s*am\s*i\b|\bcurrent user\b", re.IGNORECASE)
+
+LLM_TIER_PROMPT = """
+You decide whether a user query can be answered with a work-management toolset
+(work items, issues, tickets, tasks, sprints, customers, summaries, priorities, transcripts).
+
+Query: "{user_query}"
+
+Respond with only "YES" if the query belongs to this domain, otherwise respond with only "NO".
+"""
+
+
+def _tokenize(text: str) -> list:
+    return re.findall(r"[a-z0-9]+", text.lower())
+
+
+def hash_features(text: str) -> dict:
+    """
+    Maps a query to a sparse {bucket: count} vector of hashed word uni/bigrams and char trigrams.
+    """
+    tokens = _tokenize(text)
+    grams = [f"w:{t}" for t in tokens]
+    grams += [f"b:{a}_{b}" for a, b in zip(tokens, tokens[1:])]
+    for token in tokens:
+        padded = f"#{token}#"
+        grams += [f"c:{padded[i:i + 3]}" for i in range(len(padded) - 2)]
+
+    features = {}
+    for gram in grams:
+        bucket = zlib.crc32(gram.encode("utf-8")) % HASH_BUCKETS
+        features[bucket] = features.get(bucket, 0.0) + 1.0
+    norm = math.sqrt(sum(v * v for v in features.values())) or 1.0
+    return {k: v / norm for k, v in features.items()}
+
+
+def rule_tier(query: str):
+    """
+    Returns 1.0 when a rule is decisive, otherwise None (the linear model decides).
+    The rules only ever say in-domain.
+    """
+    if ID_PATTERN.search(query) or DOMAIN_PHRASES.search(query):
+        return 1.0
+    return None
+
+
+class QueryClassifier:
+    def __init__(self):
+        self.weights = {}
+        self.bias = 0.0
+        self.trained = False
+
+    def _raw_score(self, features: dict) -> float:
+        return self.bias + sum(self.weights.get(k, 0.0) * v for k, v in features.items())
+
+    def predict_proba(self, query: str) -> float:
+        """Probability that the query is in-domain according to the linear model."""
+        z = self._raw_score(hash_features(query))
+        return 1.0 / (1.0 + math.exp(-max(min(z, 30.0), -30.0)))
+
+    def train(self, examples: list, epochs: int = 20, lr: float = 0.5, l2: float = 1e-4):
+        """
+        examples: list of (query, label) with label 1 for in-domain, 0 for out-of-domain.
+        Classes are re-weighted so the handful of empty-output rows is not drowned out.
+        With fewer than MIN_NEGATIVES out-of-domain examples the model stays untrained and
+        every query the rules do not settle is treated as in-domain.
+        """
+        positives = sum(1 for _, y in examples if y == 1)
+        negatives = len(examples) - positives
+        if positives == 0 or negatives < MIN_NEGATIVES:
+            print(f"[CLASSIFIER] {positives} in-domain and {negatives} out-of-domain examples "
+                  f"(need {MIN_NEGATIVES}), relying on rules only.")
+            return self
+
+        class_weight = {1: len(examples) / (2.0 * positives), 0: len(examples) / (2.0 * negatives)}
+        vectors = [(hash_features(q), y) for q, y in examples]
+        for _ in range(epochs):
+            for features, y in vectors:
+                p = 1.0 / (1.0 + math.exp(-max(min(self._raw_score(features), 30.0), -30.0)))
+                grad = (p - y) * class_weight[y]
+                for k, v in features.items():
+                    w = self.weights.get(k, 0.0)
+                    self.weights[k] = w - lr * (grad * v + l2 * w)
+                self.bias -= lr * grad
+        self.trained = True
+        return self
+
+    def save(self, path: str):
+        with open(path, "w") as f:
+            json.dump({"bias": self.bias, "weights": self.weights}, f)
+
+    @classmethod
+    def load(cls, path: str):
+        with open(path, "r") as f:
+            data = json.load(f)
+        clf = cls()
+        clf.bias = data["bias"]
+        clf.weights = {int(k): v for k, v in data["weights"].items()}
+        clf.trained = True
+        return clf
+
+
+def load_training_examples(dataset_dir: str = DATASET_DIR, queries_path: str = QUERIES_PATH) -> list:
+    """
+    Collects (query, label) pairs from dataset.csv, the in-domain benchmark queries and, when
+    they have been generated, dataset_empty.json / merged_dataset.jsonl. An empty json_output
+    means out-of-domain.
+    """
+    examples = []
+
+    csv_path = os.path.join(dataset_dir, "dataset.csv")
+    if os.path.exists(csv_path):
+        with open(csv_path, newline="") as f:
+            for row in csv.DictReader(f):
+                examples.append((row["query"], 1 if json.loads(row["json_output"]) else 0))
+
+    for name in ("merged_dataset.jsonl", "dataset.jsonl"):
+        path = os.path.join(dataset_dir, name)
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    if line.strip():
+                        item = json.loads(line)
+                        examples.append((item["query"], 1 if item["json_output"] else 0))
+            break
+
+    empty_path = os.path.join(dataset_dir, "dataset_empty.json")
+    if os.path.exists(empty_path):
+        with open(empty_path) as f:
+            examples += [(item["query"], 0) for item in json.load(f)]
+
+    if os.path.exists(queries_path):
+        with open(queries_path, newline="") as f:
+            examples += [(row["query"], 1) for row in csv.DictReader(f) if row.get("query")]
+
+    # The same query can show up in several files, keep the first label seen.
+    seen = {}
+    for query, label in examples:
+        seen.setdefault(query, label)
+    return list(seen.items())
+
+
+_classifier = None
+
+
+def get_classifier() -> QueryClassifier:
+    global _classifier
+    if _classifier is None:
+        _classifier = QueryClassifier().train(load_training_examples())
+    return _classifier
+
+
+def _llm_tier(query: str) -> float:
+    from .loadModel import loadSmallModel
+    response = loadSmallModel().invoke(LLM_TIER_PROMPT.format(user_query=query))
+    return 1.0 if response.content.strip().upper().startswith("YES") else 0.0
+
+
+def in_domain_score(query: str, use_llm: bool = USE_LLM_TIER, clf: QueryClassifier = None) -> float:
+    score = rule_tier(query)
+    if score is not None:
+        return score
+
+    clf = clf or get_classifier()
+    if not clf.trained:
+        return 1.0
+    score = clf.predict_proba(query)
+    if use_llm and UNCERTAIN_BAND[0] <= score <= UNCERTAIN_BAND[1]:
+        try:
+            return _llm_tier(query)
+        except Exception as e:
+            print(f"[CLASSIFIER] LLM tier failed, keeping linear score: {e}")
+    return score
+
+
+def is_out_of_domain(query: str, clf: QueryClassifier = None) -> bool:
+    """True when the query should short-circuit to an empty plan."""
+    return in_domain_score(query, clf=clf) < OOD_THRESHOLD
+
+
+def evaluate(examples: list) -> dict:
+    """
+    Leave-one-out precision/recall of the out-of-domain prediction (out-of-domain is the
+    positive class): each query is classified by a model trained on all the other rows,
+    so the numbers are not inflated by scoring the training set.
+    """
+    tp = fp = fn = tn = 0
+    negatives = sum(1 for _, y in examples if y == 0)
+    for i, (query, label) in enumerate(examples):
+        # Too few negatives left to train on: the gate runs on the rules alone
+        enough = negatives - (label == 0) >= MIN_NEGATIVES
+        clf = QueryClassifier().train(examples[:i] + examples[i + 1:]) if enough else QueryClassifier()
+        predicted_ood = is_out_of_domain(query, clf)
+        actual_ood = label == 0
+        if predicted_ood and actual_ood:
+            tp += 1
+        elif predicted_ood:
+            fp += 1
+        elif actual_ood:
+            fn += 1
+        else:
+            tn += 1
+    precision = tp / (tp + fp) if tp + fp else 1.0
+    recall = tp / (tp + fn) if tp + fn else 1.0
+    return {"precision": precision, "recall": recall, "tp": tp, "fp": fp, "fn": fn, "tn": tn}
+
+
+if __name__ == "__main__":
+    import time
+
+    examples = load_training_examples()
+    start = time.perf_counter()
+    clf = get_classifier()
+    print(f"{'Trained' if clf.trained else 'Rules only, not trained'} on {len(examples)} queries "
+          f"in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    start = time.perf_counter()
+    for query, _ in examples:
+        is_out_of_domain(query)
+    per_query_ms = (time.perf_counter() - start) * 1000 / max(len(examples), 1)
+
+    metrics = evaluate(examples)
+    print(f"Leave-one-out over {len(examples)} queries")
+    print(f"Out-of-domain precision: {metrics['precision']:.3f}  recall: {metrics['recall']:.3f}")
+    print(f"Confusion: tp={metrics['tp']} fp={metrics['fp']} fn={metrics['fn']} tn={metrics['tn']}")
+    print(f"Average classification time: {per_query_ms:.3f} ms/query")
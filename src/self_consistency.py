@@ -0,0 +1,154 @@
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, TimeoutError, as_completed
+
+from .deadline import current_deadline
+from .parser import generate_tool_chain, note_skeleton_source
+from .skeleton_cache import skeleton_cache
+from .structured_output import parse_plan_output, reset_last_logprobs
+from .token_budget import compress_text
+from .tool_registry import get_registry
+
+# Self-consistency for the planner: N diverse skeleton samples are requested in parallel,
+# canonicalized and grouped by shape (tool sequence plus argument names). The first shape
+# that reaches the quorum wins and the remaining samples are abandoned; when the latency
+# budget runs out first, the most common shape so far wins, ties going to the shape with
+# fewer registry validation errors. One parallel round replaces the serial verify-and-retry
+# loop for ambiguous queries.
+
+SAMPLES = int(os.getenv("SELF_CONSISTENCY_SAMPLES", 0))
+QUORUM = int(os.getenv("SELF_CONSISTENCY_QUORUM", 0))
+SAMPLE_TEMPERATURE = 0.7
+LATENCY_BUDGET_SECONDS = float(os.getenv("SELF_CONSISTENCY_BUDGET_SECONDS", 20))
+
+_executor = None
+_executor_lock = threading.Lock()
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def enabled() -> bool:
+    return SAMPLES > 1
+
+
+def _pool(size: int) -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None or _executor._max_workers < size:
+            old = _executor
+            _executor = ThreadPoolExecutor(max_workers=max(size, 4), thread_name_prefix="planner-sample")
+            if old is not None:
+                # Samples already queued on the old pool still run; its threads exit after them
+                old.shutdown(wait=False)
+        return _executor
+
+
+def plan_shape(skeleton: list) -> str:
+    """Voting key: canonical tool names in order with their sorted argument names."""
+    return json.dumps([
+        [step["tool_name"], sorted(arg["argument_name"] for arg in step.get("arguments", []))]
+        for step in get_registry().canonicalize_plan(skeleton)
+    ])
+
+
+def _sample(query: str, index: int):
+    """Returns (raw output, skeleton), skeleton None when the output is not a plan."""
+    # Sample 0 stays greedy so the vote always includes the usual answer
+    raw = generate_tool_chain(query, use_cache=False, temperature=None if index == 0 else SAMPLE_TEMPERATURE)
+    try:
+        return raw, get_registry().canonicalize_plan(parse_plan_output(raw, stage="planner_sample"))
+    except json.JSONDecodeError:
+        return raw, None
+
+
+def vote_tool_chain(query: str, samples: int = None, quorum: int = None,
+                    budget: float = LATENCY_BUDGET_SECONDS, use_cache: bool = True) -> str:
+    """
+    Drop-in for generate_tool_chain: returns the winning skeleton as a JSON string. When no
+    sample could be parsed it returns, like generate_tool_chain, the raw output of one of
+    them (an empty string when none produced any), so callers' JSONDecodeError handling runs.
+    """
+    samples = samples or max(SAMPLES, 1)
+    quorum = quorum or QUORUM or samples // 2 + 1
+    query = compress_text(query)
+    if use_cache:
+        cached = skeleton_cache.get(query)
+        if cached is not None:
+            print("Skeleton cache hit, skipping the planning calls.")
+            note_skeleton_source("skeleton_cache")
+            return json.dumps(cached)
+    note_skeleton_source("planner")
+    # The samples run (and record their log-probs) on pool threads, not this one
+    reset_last_logprobs("planner")
+
+    deadline = current_deadline()
+    if deadline is not None:
+        budget = min(budget, deadline.stage_timeout("planner_sample"))
+
+    start = time.perf_counter()
+    # Each sample runs in a copy of the request context so it sees the request's deadline
+    futures = [_pool(samples).submit(contextvars.copy_context().run, _sample, query, i) for i in range(samples)]
+    votes = Counter()
+    plans = {}
+    winner = None
+    unparsed = ""
+    try:
+        for future in as_completed(futures, timeout=budget):
+            try:
+                raw, skeleton = future.result()
+            except Exception as e:
+                print(f"[CONSISTENCY] Sample failed: {e}")
+                continue
+            if skeleton is None:
+                print("[CONSISTENCY] Sample output is not a plan")
+                unparsed = raw
+                continue
+            shape = plan_shape(skeleton)
+            votes[shape] += 1
+            plans.setdefault(shape, skeleton)
+            if votes[shape] >= quorum:
+                winner = shape
+                _count(early_stops=1)
+                break
+    except TimeoutError:
+        _count(budget_exhausted=1)
+        print(f"[CONSISTENCY] Latency budget of {budget}s reached with {sum(votes.values())}/{samples} samples")
+    for future in futures:
+        future.cancel()
+
+    _count(queries=1)
+    if not votes:
+        _count(no_valid_sample=1)
+        return unparsed
+    if winner is None:
+        registry = get_registry()
+        winner = max(votes, key=lambda shape: (votes[shape], -len(registry.validate_plan(plans[shape]))))
+    _count(samples_used=sum(votes.values()))
+    print(f"[CONSISTENCY] {votes[winner]}/{sum(votes.values())} samples agree "
+          f"({len(votes)} distinct plans, {(time.perf_counter() - start):.1f}s)")
+
+    if use_cache:
+        skeleton_cache.put(query, plans[winner])
+    return json.dumps(plans[winner])
+
+
+def _count(**values):
+    with _stats_lock:
+        _stats.update(values)
+
+
+def consistency_stats() -> dict:
+    with _stats_lock:
+        return dict(_stats)
+
+
+def _reset_after_fork():
+    global _executor, _executor_lock, _stats_lock
+    _executor, _executor_lock, _stats_lock = None, threading.Lock(), threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,246 @@
+import copy
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+
+from .entity_extractor import extract_entities
+
+# Server-side conversation state. Each session keeps the last plan and a bounded summary
+# of earlier turns, so a follow-up such as "change this list to
+# show only those in triage stage" becomes a local edit of the previous works_list step
+# instead of a fresh planning call over the whole transcript.
+#
+# Sessions live in a SQLite file (SESSION_STORE_PATH) shared by every worker process of the
+# server, so a follow-up can land on any worker. Each request loads its session and saves it
+# after the turn; two concurrent requests on the same session keep the last write. An empty
+# SESSION_STORE_PATH keeps sessions in process memory, only correct with a single worker.
+
+SESSION_STORE_PATH = os.getenv("SESSION_STORE_PATH", "session_store.db")
+SESSION_TTL_SECONDS = 60 * 60
+MAX_SESSIONS = 10000
+MAX_SUMMARY_TURNS = 6
+MAX_TURN_CHARS = 160
+
+# Only phrases that clearly point back at the previous result count as a follow-up;
+# "... and add them to the sprint" on its own is a new request.
+FOLLOW_UP_PATTERN = re.compile(
+    r"\b(?:this|that|these|those|the same|the previous|the last) (?:list|results?|items?|ones|issues|tickets|tasks)\b"
+    r"|\bonly (?:those|these|the ones|ones)\b"
+    r"|\b(?:change|update|narrow|filter|restrict) (?:it|this|that|them|those|these|the list|the results)\b"
+    r"|\binstead\b",
+    re.IGNORECASE,
+)
+LIMIT_PATTERN = re.compile(r"\b(?:top|first|only|limit(?: it)?(?: to)?)\s+(\d+)\b", re.IGNORECASE)
+
+# Entity kind -> works_list argument that a follow-up may set.
+WORKS_LIST_FILTERS = {
+    "priority": "issue.priority",
+    "severity": "ticket.severity",
+    "stage": "stage.name",
+    "channel": "ticket.source_channel",
+    "part": "applies_to_part",
+    "work_type": "type",
+}
+
+
+class SessionState:
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.last_plan = []
+        self.summary = []
+        self.updated_at = time.time()
+
+    def record_turn(self, query: str, plan: list):
+        self.last_plan = copy.deepcopy(plan)
+        tools = " > ".join(step["tool_name"] for step in plan) or "no tools"
+        text = " ".join(query.split())
+        if len(text) > MAX_TURN_CHARS:
+            text = text[:MAX_TURN_CHARS - 3] + "..."
+        self.summary.append(f"user: {text} -> {tools}")
+        del self.summary[:-MAX_SUMMARY_TURNS]
+        self.updated_at = time.time()
+
+    def to_dict(self) -> dict:
+        return {"last_plan": self.last_plan, "summary": self.summary}
+
+    @classmethod
+    def from_dict(cls, session_id: str, data: dict, updated_at: float):
+        session = cls(session_id)
+        session.last_plan = data.get("last_plan", [])
+        session.summary = data.get("summary", [])
+        session.updated_at = updated_at
+        return session
+
+    def compact_history(self) -> str:
+        """Bounded summary of earlier turns, at most MAX_SUMMARY_TURNS lines."""
+        return "\n".join(self.summary)
+
+    def with_history(self, query: str) -> str:
+        if not self.summary:
+            return query
+        return f"Conversation so far:\n{self.compact_history()}\n\nCurrent request: {query}"
+
+
+class SessionStore:
+    def __init__(self, ttl: float = SESSION_TTL_SECONDS, max_sessions: int = MAX_SESSIONS):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def _evict(self, now: float):
+        expired = [sid for sid, s in self._sessions.items() if now - s.updated_at > self.ttl]
+        for sid in expired:
+            del self._sessions[sid]
+        if len(self._sessions) >= self.max_sessions:
+            oldest = min(self._sessions.values(), key=lambda s: s.updated_at)
+            del self._sessions[oldest.session_id]
+
+    def get_or_create(self, session_id: str = None) -> SessionState:
+        now = time.time()
+        with self._lock:
+            session = self._sessions.get(session_id) if session_id else None
+            if session is None:
+                self._evict(now)
+                session = SessionState(session_id or uuid.uuid4().hex)
+                self._sessions[session.session_id] = session
+            return session
+
+    def save(self, session: SessionState):
+        """Sessions are the stored objects themselves, nothing to write back."""
+
+    def drop(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+
+class SqliteSessionStore:
+    """Same interface as SessionStore, backed by a WAL-mode SQLite file all workers share."""
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS sessions (
+        session_id TEXT PRIMARY KEY,
+        state TEXT NOT NULL,
+        updated_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_sessions_updated_at ON sessions (updated_at);
+    """
+
+    def __init__(self, path: str = SESSION_STORE_PATH, ttl: float = SESSION_TTL_SECONDS,
+                 max_sessions: int = MAX_SESSIONS):
+        self.path = path
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._local = threading.local()
+
+    def _conn(self) -> sqlite3.Connection:
+        # One connection per thread (and per process: forked workers start with none)
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(self.SCHEMA)
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def _evict(self, conn: sqlite3.Connection, now: float):
+        conn.execute("DELETE FROM sessions WHERE updated_at < ?", (now - self.ttl,))
+        conn.execute(
+            "DELETE FROM sessions WHERE session_id IN (SELECT session_id FROM sessions"
+            " ORDER BY updated_at DESC LIMIT -1 OFFSET ?)", (self.max_sessions - 1,)
+        )
+
+    def get_or_create(self, session_id: str = None) -> SessionState:
+        now = time.time()
+        conn = self._conn()
+        if session_id:
+            row = conn.execute("SELECT state, updated_at FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+            if row is not None and now - row[1] <= self.ttl:
+                return SessionState.from_dict(session_id, json.loads(row[0]), row[1])
+        session = SessionState(session_id or uuid.uuid4().hex)
+        with conn:
+            self._evict(conn, now)
+            conn.execute("INSERT OR REPLACE INTO sessions (session_id, state, updated_at) VALUES (?, ?, ?)",
+                         (session.session_id, json.dumps(session.to_dict()), session.updated_at))
+        return session
+
+    def save(self, session: SessionState):
+        with self._conn() as conn:
+            conn.execute("INSERT OR REPLACE INTO sessions (session_id, state, updated_at) VALUES (?, ?, ?)",
+                         (session.session_id, json.dumps(session.to_dict()), session.updated_at))
+
+    def drop(self, session_id: str):
+        with self._conn() as conn:
+            conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+
+def is_follow_up(query: str, session: SessionState) -> bool:
+    return bool(session.last_plan) and bool(FOLLOW_UP_PATTERN.search(query))
+
+
+def plan_delta(query: str, session: SessionState):
+    """
+    Computes the edits a follow-up makes to the last plan's works_list step.
+    Returns a list of {"op", "step", "argument_name", "value"} dicts, or None when the
+    follow-up cannot be expressed as a filter change and needs a full replan.
+    """
+    if not is_follow_up(query, session):
+        return None
+
+    steps = [i for i, step in enumerate(session.last_plan) if step["tool_name"] == "works_list"]
+    if not steps:
+        return None
+    step_index = steps[-1]
+
+    delta = []
+    for kind, values in extract_entities(query).items():
+        if kind in WORKS_LIST_FILTERS:
+            delta.append({"op": "set", "step": step_index, "argument_name": WORKS_LIST_FILTERS[kind], "value": values})
+    limit = LIMIT_PATTERN.search(query)
+    if limit:
+        delta.append({"op": "set", "step": step_index, "argument_name": "limit", "value": int(limit.group(1))})
+    return delta or None
+
+
+def apply_delta(plan: list, delta: list) -> list:
+    plan = copy.deepcopy(plan)
+    for edit in delta:
+        arguments = plan[edit["step"]].setdefault("arguments", [])
+        for arg in arguments:
+            if arg["argument_name"] == edit["argument_name"]:
+                arg["argument_value"] = edit["value"]
+                break
+        else:
+            arguments.append({"argument_name": edit["argument_name"], "argument_value": edit["value"]})
+    return plan
+
+
+def plan_follow_up(query: str, session: SessionState):
+    """Returns the updated plan for a follow-up that only changes filters, otherwise None."""
+    delta = plan_delta(query, session)
+    if delta is None:
+        return None
+    print(f"[SESSION] Follow-up applied as a plan delta: {delta}")
+    return apply_delta(session.last_plan, delta)
+
+
+def latest_user_message(query) -> str:
+    """
+    Accepts either a plain query string or a list/dict of chat messages (older frontends
+    sent the whole history) and returns the text of the latest user message.
+    """
+    if isinstance(query, str):
+        return query
+    messages = list(query.values()) if isinstance(query, dict) else list(query or [])
+    for message in reversed(messages):
+        if isinstance(message, dict) and message.get("type", "user") == "user" and message.get("content"):
+            return message["content"]
+    return ""
+
+
+sessions = SqliteSessionStore() if SESSION_STORE_PATH else SessionStore()
@@ -0,0 +1,221 @@
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from .query_classifier import hash_features
+
+# Vector similarity over the local work-item corpus (get_similar_work_items in the local
+# backend). Embeddings are L2-normalized float32 rows of one matrix, memory-mapped from
+# <directory>/vectors.f32 so a million-item corpus is paged in by the OS instead of loaded;
+# the item IDs sit next to it in ids.txt. Appends grow the file in place (capacity doubles)
+# and become visible to searches once written. A search scores the whole matrix with one
+# matrix product per chunk of rows and keeps the top k per query with argpartition, so the
+# cost is a few BLAS calls rather than a Python loop over items.
+#
+#   python3 -m src.similarity_engine                        # p50/p99 at 10k, 100k and 1M items
+#   python3 -m src.similarity_engine --sizes 10000 --batch 32
+
+DIM = int(os.getenv("SIMILARITY_DIM", 256))
+CHUNK_ROWS = 131072
+INITIAL_CAPACITY = 1024
+
+
+def embed(text: str, dim: int = DIM) -> np.ndarray:
+    """Dense version of query_classifier's hashed n-gram features, folded to dim buckets."""
+    vector = np.zeros(dim, dtype=np.float32)
+    for bucket, value in hash_features(text).items():
+        vector[bucket % dim] += value
+    return vector
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class SimilarityEngine:
+    def __init__(self, directory: str = None, dim: int = DIM):
+        """directory=None keeps the matrix in memory (tests, small corpora)."""
+        self.directory = directory
+        self.dim = dim
+        self.count = 0
+        self.ids = []
+        self._rows = {}
+        self._lock = threading.Lock()
+        self._matrix = np.zeros((0, dim), dtype=np.float32)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._open()
+
+    # --- Storage ---
+
+    def _paths(self):
+        return (os.path.join(self.directory, "vectors.f32"), os.path.join(self.directory, "ids.txt"),
+                os.path.join(self.directory, "meta.json"))
+
+    def _open(self):
+        vectors_path, ids_path, meta_path = self._paths()
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+            self.dim, self.count = meta["dim"], meta["count"]
+            with open(ids_path, encoding="utf-8") as f:
+                self.ids = [line.rstrip("\n") for line in f][:self.count]
+            self._rows = {item_id: row for row, item_id in enumerate(self.ids)}
+            self._map(os.path.getsize(vectors_path) // (4 * self.dim))
+        else:
+            self._map(INITIAL_CAPACITY)
+
+    def _map(self, capacity: int):
+        vectors_path = self._paths()[0]
+        size = capacity * self.dim * 4
+        with open(vectors_path, "ab") as f:
+            if f.tell() < size:
+                f.truncate(size)
+        self._matrix = np.memmap(vectors_path, dtype=np.float32, mode="r+", shape=(capacity, self.dim))
+
+    def _reserve(self, rows: int):
+        capacity = len(self._matrix)
+        if self.count + rows <= capacity:
+            return
+        capacity = max(capacity * 2, self.count + rows, INITIAL_CAPACITY)
+        if self.directory:
+            self._matrix.flush()
+            self._map(capacity)
+        else:
+            grown = np.zeros((capacity, self.dim), dtype=np.float32)
+            grown[:self.count] = self._matrix[:self.count]
+            self._matrix = grown
+
+    def append(self, ids: list, vectors) -> int:
+        """Adds (or, for a known ID, replaces) items. Returns the new item count."""
+        vectors = _normalize(np.atleast_2d(vectors))
+        if vectors.shape != (len(ids), self.dim):
+            raise ValueError(f"expected {len(ids)} vectors of dimension {self.dim}, got {vectors.shape}")
+        with self._lock:
+            new_ids = []
+            rows = np.empty(len(ids), dtype=np.int64)
+            for i, item_id in enumerate(ids):
+                row = self._rows.get(item_id)
+                if row is None:
+                    row = self._rows[item_id] = self.count + len(new_ids)
+                    new_ids.append(item_id)
+                rows[i] = row
+            self._reserve(len(new_ids))
+            self._matrix[rows] = vectors
+            self.ids.extend(new_ids)
+            self.count += len(new_ids)
+            if self.directory:
+                self._persist(new_ids)
+            return self.count
+
+    def _persist(self, new_ids: list):
+        vectors_path, ids_path, meta_path = self._paths()
+        self._matrix.flush()
+        if new_ids:
+            with open(ids_path, "a", encoding="utf-8") as f:
+                f.write("".join(f"{item_id}\n" for item_id in new_ids))
+        tmp_path = f"{meta_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"dim": self.dim, "count": self.count}, f)
+        os.replace(tmp_path, meta_path)
+
+    # --- Search ---
+
+    def vector(self, item_id: str):
+        row = self._rows.get(item_id)
+        return None if row is None else np.array(self._matrix[row])
+
+    def search(self, queries, k: int = 10, exclude: list = None) -> list:
+        """
+        Top-k cosine matches for each query vector (one row per query). Returns one list of
+        (item_id, score) per query, best first. exclude holds one item ID (or None) per query.
+        """
+        queries = _normalize(np.atleast_2d(queries))
+        matrix, count = self._matrix, self.count
+        if count == 0:
+            return [[] for _ in queries]
+        keep = min(k + 1, count)
+
+        best_rows = np.empty((len(queries), 0), dtype=np.int64)
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        for start in range(0, count, CHUNK_ROWS):
+            scores = queries @ matrix[start:min(start + CHUNK_ROWS, count)].T
+            take = min(keep, scores.shape[1])
+            top = np.argpartition(scores, -take, axis=1)[:, -take:]
+            best_rows = np.hstack([best_rows, top + start])
+            best_scores = np.hstack([best_scores, np.take_along_axis(scores, top, axis=1)])
+
+        if best_scores.shape[1] > keep:
+            top = np.argpartition(best_scores, -keep, axis=1)[:, -keep:]
+            best_rows = np.take_along_axis(best_rows, top, axis=1)
+            best_scores = np.take_along_axis(best_scores, top, axis=1)
+        order = np.argsort(-best_scores, axis=1)
+        best_rows = np.take_along_axis(best_rows, order, axis=1)
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+
+        results = []
+        for i, (rows, scores) in enumerate(zip(best_rows, best_scores)):
+            skip = exclude[i] if exclude else None
+            matches = [(self.ids[row], float(score)) for row, score in zip(rows, scores) if self.ids[row] != skip]
+            results.append(matches[:k])
+        return results
+
+    def similar_to(self, item_id: str, k: int = 10) -> list:
+        vector = self.vector(item_id)
+        if vector is None:
+            return []
+        return self.search(vector, k, exclude=[item_id])[0]
+
+
+def benchmark(sizes: list, queries: int = 200, batch: int = 1, k: int = 10, dim: int = DIM) -> list:
+    """Builds a random memory-mapped corpus per size and times searches of batch queries."""
+    rng = np.random.default_rng(0)
+    results = []
+    for size in sizes:
+        directory = tempfile.mkdtemp(prefix="similarity-")
+        try:
+            engine = SimilarityEngine(directory, dim)
+            start = time.perf_counter()
+            for offset in range(0, size, 100_000):
+                rows = min(100_000, size - offset)
+                engine.append([f"ISS-{offset + i}" for i in range(rows)],
+                              rng.standard_normal((rows, dim), dtype=np.float32))
+            build_s = time.perf_counter() - start
+
+            engine.search(rng.standard_normal((batch, dim), dtype=np.float32), k)
+            latencies = []
+            for _ in range(queries):
+                query = rng.standard_normal((batch, dim), dtype=np.float32)
+                start = time.perf_counter()
+                engine.search(query, k)
+                latencies.append((time.perf_counter() - start) * 1000)
+            latencies.sort()
+            results.append({"items": size, "batch": batch, "build_s": build_s,
+                            "p50_ms": latencies[len(latencies) // 2],
+                            "p99_ms": latencies[min(len(latencies) - 1, int(0.99 * len(latencies)))]})
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Benchmark the similarity engine.")
+    arg_parser.add_argument("--sizes", default="10000,100000,1000000", help="comma separated corpus sizes")
+    arg_parser.add_argument("--queries", type=int, default=200)
+    arg_parser.add_argument("--batch", type=int, default=1, help="query vectors per search call")
+    arg_parser.add_argument("--k", type=int, default=10)
+    arg_parser.add_argument("--dim", type=int, default=DIM)
+    args = arg_parser.parse_args()
+
+    print("    items  batch  build(s)  p50(ms)  p99(ms)")
+    for row in benchmark([int(s) for s in args.sizes.split(",")], args.queries, args.batch, args.k, args.dim):
+        print(f"{row['items']:>9}  {row['batch']:>5}  {row['build_s']:>8.1f}  {row['p50_ms']:>7.2f}  {row['p99_ms']:>7.2f}")
@@ -0,0 +1,97 @@
+import copy
+import re
+import threading
+from collections import OrderedDict
+
+from .entity_extractor import mask_entities
+from .tool_registry import get_registry
+
+# Second-level cache for planner skeletons. Skeletons carry no argument values, so
+# "P0 issues" and "P1 issues" share one entry: the key is the query with its entities
+# masked out (the intent signature), not the raw query text.
+
+MAX_ENTRIES = 1024
+
+
+def intent_signature(query: str) -> str:
+    masked = mask_entities(query)
+    return " ".join(re.findall(r"<\w+>|[a-z0-9]+", masked))
+
+
+class SkeletonCache:
+    def __init__(self, max_entries: int = MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _record(self, signature: str, hit: bool):
+        stats = self._stats.setdefault(signature, {"hits": 0, "misses": 0})
+        stats["hits" if hit else "misses"] += 1
+
+    def get(self, query: str):
+        """Returns a copy of the cached skeleton for the query's intent, or None."""
+        signature = intent_signature(query)
+        with self._lock:
+            skeleton = self._entries.get(signature)
+            self._record(signature, skeleton is not None)
+            if skeleton is None:
+                return None
+            self._entries.move_to_end(signature)
+            return copy.deepcopy(skeleton)
+
+    def put(self, query: str, skeleton: list):
+        signature = intent_signature(query)
+        # Values are query specific, only the tool/argument structure is shared across an intent
+        blank = [
+            dict(step, arguments=[dict(arg, argument_value="") for arg in step.get("arguments", [])])
+            for step in skeleton
+        ]
+        with self._lock:
+            self._entries[signature] = blank
+            self._entries.move_to_end(signature)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, query: str):
+        """Drops the entry for the query's intent, e.g. after the plan failed verification."""
+        with self._lock:
+            self._entries.pop(intent_signature(query), None)
+
+    def invalidate_tools(self, tool_names: set):
+        """Drops every skeleton that uses one of the given tools (changed or removed)."""
+        with self._lock:
+            stale = [
+                signature for signature, skeleton in self._entries.items()
+                if any(step.get("tool_name") in tool_names for step in skeleton)
+            ]
+            for signature in stale:
+                del self._entries[signature]
+        if stale:
+            print(f"[SKELETON CACHE] Dropped {len(stale)} skeletons using {sorted(tool_names)}")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """Per-intent hit ratios plus the overall totals."""
+        with self._lock:
+            per_intent = {
+                signature: dict(s, hit_ratio=s["hits"] / (s["hits"] + s["misses"]))
+                for signature, s in self._stats.items()
+            }
+            hits = sum(s["hits"] for s in self._stats.values())
+            lookups = hits + sum(s["misses"] for s in self._stats.values())
+            return {
+                "entries": len(self._entries),
+                "hits": hits,
+                "lookups": lookups,
+                "hit_ratio": hits / lookups if lookups else 0.0,
+                "per_intent": per_intent,
+            }
+
+
+skeleton_cache = SkeletonCache()
+# Registry changes only invalidate the skeletons that reference the changed tools.
+get_registry().subscribe(lambda version, changed: skeleton_cache.invalidate_tools(changed))
@@ -0,0 +1,467 @@
+import copy
+import json
+import os
+import re
+import threading
+from collections import Counter
+
+from langchain_core.output_parsers import StrOutputParser
+
+from .deadline import DeadlineExceeded, run_with_deadline, with_stage_timeout
+from .tool_registry import get_registry
+
+# Structured output for the planner and the filler. The model is asked for
+# {"plan": [...]} under the strongest constraint the provider accepts (JSON schema generated
+# from the tool registry, then plain JSON mode, then nothing), and whatever comes back goes
+# through a local parser that only accepts text it can turn into a plan of that shape:
+# fences and prose are cut, small syntax slips repaired, names canonicalized and the
+# structure conformed to the registry. Only output it cannot recover counts as malformed.
+
+STRUCTURED_OUTPUT = True
+RESPONSE_FORMAT_MODES = ["json_schema", "json_object", "none"]
+# Ask for token log-probs (OpenAI-compatible providers); used as a plan confidence signal
+REQUEST_LOGPROBS = os.getenv("REQUEST_LOGPROBS", "0") == "1"
+
+_stats = {}
+_stats_lock = threading.Lock()
+_last_logprob = threading.local()
+_unsupported_modes = set()
+_schema_cache = {}
+
+
+def record_output(stage: str, outcome: str):
+    """outcome is one of "parsed", "repaired" or "malformed"."""
+    with _stats_lock:
+        _stats.setdefault(stage, Counter())["calls"] += 1
+        _stats[stage][outcome] += 1
+
+
+def output_stats() -> dict:
+    with _stats_lock:
+        return {stage: dict(counter) for stage, counter in _stats.items()}
+
+
+def reset_output_stats():
+    with _stats_lock:
+        _stats.clear()
+
+
+# --- Schema generated from the registry ---
+
+def plan_schema() -> dict:
+    """JSON schema for {"plan": [...]} allowing only registry tools and their argument names."""
+    registry = get_registry()
+    key = ("full", registry.version)
+    if key in _schema_cache:
+        return _schema_cache[key]
+
+    variants = []
+    for name, entry in registry.snapshot.entries.items():
+        argument = {
+            "type": "object",
+            "properties": {
+                "argument_name": {"type": "string", "enum": list(entry.arguments)},
+                "argument_value": {},
+            },
+            "required": ["argument_name", "argument_value"],
+        }
+        arguments = {"type": "array", "items": argument} if entry.arguments else {"type": "array", "maxItems": 0}
+        variants.append({
+            "type": "object",
+            "properties": {"tool_name": {"type": "string", "enum": [name]}, "arguments": arguments},
+            "required": ["tool_name", "arguments"],
+        })
+
+    schema = {
+        "type": "object",
+        "properties": {"plan": {"type": "array", "items": {"anyOf": variants}}},
+        "required": ["plan"],
+    }
+    return _cache_schema(key, schema)
+
+
+def _cache_schema(key: tuple, schema: dict) -> dict:
+    """Stores a (kind, registry version) schema, dropping the schemas of older registry versions."""
+    for stale in [k for k in _schema_cache if k[1] != key[1]]:
+        _schema_cache.pop(stale, None)
+    _schema_cache[key] = schema
+    return schema
+
+
+def _mean_logprob(message):
+    metadata = getattr(message, "response_metadata", None) or {}
+    logprobs = metadata.get("logprobs") or {}
+    tokens = [t["logprob"] for t in logprobs.get("content") or [] if isinstance(t, dict) and "logprob" in t]
+    return sum(tokens) / len(tokens) if tokens else None
+
+
+def last_logprob(stage: str):
+    """Mean token log-prob of this thread's last response for the stage, None if not exposed."""
+    return getattr(_last_logprob, stage, None)
+
+
+def reset_last_logprobs(*stages):
+    """
+    Forgets this thread's log-probs for the stages (all of them by default). Called at the
+    start of every request and on cache hits, so a plan is never scored with the log-prob
+    of an earlier request's response.
+    """
+    for stage in stages or list(vars(_last_logprob)):
+        _last_logprob.__dict__.pop(stage, None)
+
+
+def _invoke(prompt, model, inputs: dict, stage: str) -> str:
+    chain = prompt | with_stage_timeout(model, stage)
+    message = run_with_deadline(lambda: chain.invoke(inputs), stage)
+    setattr(_last_logprob, stage, _mean_logprob(message))
+    return StrOutputParser().invoke(message)
+
+
+def lean_plan_schema() -> dict:
+    """JSON schema for the lean planner output {"plan": ["tool_name(arg, arg)", ...]}."""
+    registry = get_registry()
+    key = ("lean", registry.version)
+    if key in _schema_cache:
+        return _schema_cache[key]
+    names = "|".join(re.escape(name) for name in registry.snapshot.entries)
+    return _cache_schema(key, {
+        "type": "object",
+        "properties": {"plan": {"type": "array", "items": {"type": "string", "pattern": rf"^({names})(\(.*\))?$"}}},
+        "required": ["plan"],
+    })
+
+
+def fill_schema(skeleton: list) -> dict:
+    """JSON schema for the compact fill map {"<step index>": {"<argument name>": value}}."""
+    return {
+        "type": "object",
+        "properties": {
+            str(i): {
+                "type": "object",
+                "properties": {arg["argument_name"]: {} for arg in step.get("arguments", [])},
+                "additionalProperties": False,
+            }
+            for i, step in enumerate(skeleton) if step.get("arguments")
+        },
+        "additionalProperties": False,
+    }
+
+
+def _bind(model, mode: str, schema: dict = None):
+    if REQUEST_LOGPROBS:
+        model = model.bind(logprobs=True)
+    if mode == "json_schema":
+        return model.bind(response_format={
+            "type": "json_schema",
+            "json_schema": {"name": "tool_plan" if schema is None else "tool_arguments",
+                            "schema": plan_schema() if schema is None else schema},
+        })
+    if mode == "json_object":
+        return model.bind(response_format={"type": "json_object"})
+    return model
+
+
+def _rejects_format(error: Exception, mode: str) -> bool:
+    """
+    True when the error says the provider does not accept the response format: an HTTP 400
+    or a message naming the format. Rate limits, timeouts and network errors are transient
+    and must not disable a mode for the rest of the process.
+    """
+    status = getattr(error, "status_code", None) or getattr(error, "status", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    if status is not None:
+        return status == 400
+    message = str(error).lower()
+    return "response_format" in message or mode in message
+
+
+def invoke_structured(prompt, model, inputs: dict, stage: str, schema: dict = None) -> str:
+    """
+    Runs prompt | model with the strongest response format the provider accepts and returns
+    the raw text. A mode the provider rejects is remembered and skipped on later calls; any
+    other error is raised to the caller.
+    schema replaces the registry plan schema (e.g. fill_schema for the compact fill map).
+    """
+    if not STRUCTURED_OUTPUT:
+        return _invoke(prompt, model, inputs, stage)
+
+    model_key = type(model).__name__ + ":" + str(getattr(model, "model_name", getattr(model, "model", "")))
+    modes = [m for m in RESPONSE_FORMAT_MODES if (model_key, m) not in _unsupported_modes]
+    for mode in modes:
+        try:
+            return _invoke(prompt, _bind(model, mode, schema), inputs, stage)
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            if mode == "none" or not _rejects_format(e, mode):
+                raise
+            print(f"[STRUCTURED] {stage}: response format '{mode}' rejected ({e}), falling back")
+            _unsupported_modes.add((model_key, mode))
+    return _invoke(prompt, model, inputs, stage)
+
+
+# --- Local parsing and repair ---
+
+def _decode_first_json(text: str):
+    decoder = json.JSONDecoder()
+    starts = [i for i in (text.find("["), text.find("{")) if i != -1]
+    if not starts:
+        raise json.JSONDecodeError("No JSON value found", text, 0)
+    value, _ = decoder.raw_decode(text[min(starts):])
+    return value
+
+
+# A JSON string (left untouched), a Python literal, or a trailing comma before } or ]
+_REPAIRABLE = re.compile(r'"(?:[^"\\]|\\.)*"|\b(?:True|False|None)\b|,\s*(?=[}\]])')
+_PYTHON_LITERALS = {"True": "true", "False": "false", "None": "null"}
+
+
+def _repair(text: str) -> str:
+    if '"' not in text:
+        text = text.replace("'", '"')
+
+    def fix(m):
+        token = m.group(0)
+        if token.startswith('"'):
+            return token
+        return _PYTHON_LITERALS.get(token, "")
+    return _REPAIRABLE.sub(fix, text)
+
+
+def _unwrap(value):
+    if isinstance(value, dict):
+        for key in ("plan", "tools", "tool_chain", "steps"):
+            if isinstance(value.get(key), list):
+                return value[key]
+        if "tool_name" in value:
+            return [value]
+    if isinstance(value, list):
+        return value
+    raise json.JSONDecodeError("JSON value is not a plan", json.dumps(value), 0)
+
+
+def _keyed(value, wrapper: str) -> dict:
+    """{"<index>": ...} from a map, a map under the wrapper key or a list in index order."""
+    if isinstance(value, dict) and isinstance(value.get(wrapper), (dict, list)):
+        value = value[wrapper]
+    if isinstance(value, list):
+        value = {str(i): v for i, v in enumerate(value)}
+    if not isinstance(value, dict):
+        raise json.JSONDecodeError(f"JSON value is not a map of {wrapper}", json.dumps(value), 0)
+    return value
+
+
+def _decode(text: str, stage: str, shape):
+    """
+    (value, outcome) for model output: fences are cut and the text is decoded as is
+    ("parsed"), else its first JSON value after small repairs ("repaired"). shape(value)
+    returns the expected structure or raises json.JSONDecodeError; output that cannot be
+    recovered either way is recorded as malformed and the error is raised.
+    """
+    cleaned = text.strip().replace("```json", "").replace("```", "").strip()
+    try:
+        return shape(json.loads(cleaned)), "parsed"
+    except json.JSONDecodeError:
+        pass
+    try:
+        return shape(_decode_first_json(_repair(cleaned))), "repaired"
+    except json.JSONDecodeError:
+        record_output(stage, "malformed")
+        raise
+
+
+def parse_plan_output(text: str, stage: str = "planner"):
+    """
+    Parses model output into a plan list. Raises json.JSONDecodeError (like json.loads)
+    when nothing plan-shaped can be recovered, so existing retry handling keeps working.
+    """
+    plan, outcome = _decode(text, stage, _unwrap)
+    plan, fixes = conform_plan(plan)
+    record_output(stage, "repaired" if fixes and outcome == "parsed" else outcome)
+    return plan
+
+
+def conform_plan(plan: list):
+    """
+    Forces every step into {"tool_name", "arguments": [{"argument_name", "argument_value"}]},
+    canonicalizes tool names and drops arguments the tool does not have.
+    Returns (plan, number_of_fixes).
+    """
+    registry = get_registry()
+    fixes = 0
+    conformed = []
+    for step in plan:
+        if not isinstance(step, dict) or "tool_name" not in step:
+            fixes += 1
+            continue
+        canonical = registry.resolve(step["tool_name"]) or step["tool_name"]
+        fixes += canonical != step["tool_name"]
+        known = registry.get(canonical)
+        known_args = {arg["argument_name"] for arg in known.get("arguments", [])} if known else None
+
+        arguments = []
+        raw_arguments = step.get("arguments") or []
+        if isinstance(raw_arguments, dict):
+            raw_arguments = [{"argument_name": k, "argument_value": v} for k, v in raw_arguments.items()]
+            fixes += 1
+        for arg in raw_arguments:
+            if not isinstance(arg, dict) or "argument_name" not in arg:
+                fixes += 1
+                continue
+            if known_args is not None and arg["argument_name"] not in known_args:
+                fixes += 1
+                continue
+            arguments.append({"argument_name": arg["argument_name"], "argument_value": arg.get("argument_value", "")})
+        conformed.append({"tool_name": canonical, "arguments": arguments})
+    return conformed, fixes
+
+
+def parse_fill_output(text: str, skeleton: list, stage: str = "filler") -> dict:
+    """
+    Parses the compact fill map into {step_index: {argument_name: value}}, keeping only steps
+    and arguments the skeleton has. Accepts "0"/"step_0" keys or a list in step order.
+    Raises json.JSONDecodeError when nothing usable can be recovered.
+    """
+    value, outcome = _decode(text, stage, lambda value: _keyed(value, "values"))
+
+    values = {}
+    dropped = 0
+    for key, arguments in value.items():
+        digits = re.sub(r"\D", "", str(key))
+        index = int(digits) if digits else -1
+        if not 0 <= index < len(skeleton) or not isinstance(arguments, dict):
+            dropped += 1
+            continue
+        known = {arg["argument_name"] for arg in skeleton[index].get("arguments", [])}
+        values[index] = {name: v for name, v in arguments.items() if name in known}
+        dropped += len(arguments) - len(values[index])
+    record_output(stage, "repaired" if dropped and outcome == "parsed" else outcome)
+    return values
+
+
+LEAN_STEP = re.compile(r"^\s*([\w.\-]+)\s*(?:\((.*)\))?\s*$")
+
+
+def parse_lean_output(text: str, stage: str = "planner"):
+    """
+    Parses the lean planner output into a full skeleton expanded from the registry.
+    Steps are "tool_name" or "tool_name(arg, arg)"; objects with tool_name/arguments are
+    accepted too. Raises json.JSONDecodeError when nothing usable can be recovered.
+    """
+    steps, outcome = _decode(text, stage, _unwrap)
+    plan, fixes = expand_lean_plan(_lean_steps(steps))
+    record_output(stage, "repaired" if fixes and outcome == "parsed" else outcome)
+    return plan
+
+
+def _lean_steps(steps: list) -> list:
+    lean = []
+    for step in steps:
+        if isinstance(step, dict) and "tool_name" in step:
+            names = [a.get("argument_name") if isinstance(a, dict) else a for a in step.get("arguments") or []]
+            lean.append((step["tool_name"], names or None))
+            continue
+        m = LEAN_STEP.match(step) if isinstance(step, str) else None
+        if m is None:
+            lean.append((None, None))
+            continue
+        names = [n.strip() for n in (m.group(2) or "").split(",") if n.strip()]
+        lean.append((m.group(1), names or None))
+    return lean
+
+
+def packed_plan_schema(count: int) -> dict:
+    """JSON schema for a packed planner output {"<query index>": ["tool_name(arg, arg)", ...]}."""
+    step = lean_plan_schema()["properties"]["plan"]
+    return {
+        "type": "object",
+        "properties": {str(i): step for i in range(count)},
+        "required": [str(i) for i in range(count)],
+        "additionalProperties": False,
+    }
+
+
+def parse_packed_output(text: str, count: int, stage: str = "planner_pack") -> list:
+    """
+    Parses a packed planner output into one skeleton per query, in query order. Accepts
+    "0"/"q0" keys or a list of lean plans; a query whose entry is missing or unusable gets
+    None. Raises json.JSONDecodeError when nothing usable can be recovered.
+    """
+    value, outcome = _decode(text, stage, lambda value: _keyed(value, "plans"))
+
+    entries = {}
+    for key, steps in value.items():
+        digits = re.sub(r"\D", "", str(key))
+        if digits and 0 <= int(digits) < count:
+            entries[int(digits)] = steps
+
+    plans = []
+    missing = 0
+    for i in range(count):
+        try:
+            plans.append(expand_lean_plan(_lean_steps(_unwrap(entries[i])))[0])
+        except (KeyError, json.JSONDecodeError):
+            plans.append(None)
+            missing += 1
+    record_output(stage, "repaired" if missing and outcome == "parsed" else outcome)
+    return plans
+
+
+def expand_lean_plan(steps: list):
+    """
+    [(tool_name, argument_names or None)] -> (skeleton, number_of_fixes). Argument names come
+    from the registry: listed names the tool does not have are dropped, and a step without
+    a list gets all of its tool's arguments. A step naming no registry tool is kept as it
+    was written, so validate_plan rejects the skeleton and later $$PREV indexes still line up.
+    """
+    registry = get_registry()
+    skeleton = []
+    fixes = 0
+    for name, argument_names in steps:
+        canonical = registry.resolve(name) if name else None
+        tool = registry.get(canonical) if canonical else None
+        if tool is None:
+            fixes += 1
+            skeleton.append({"tool_name": str(name) if name else "",
+                             "arguments": [{"argument_name": n, "argument_value": ""}
+                                           for n in dict.fromkeys(argument_names or []) if isinstance(n, str)]})
+            continue
+        known = [arg["argument_name"] for arg in tool.get("arguments", [])]
+        if argument_names is None:
+            chosen = known
+        else:
+            chosen = [n for n in dict.fromkeys(argument_names) if n in known]
+            fixes += len(set(argument_names) - set(chosen))
+        skeleton.append({"tool_name": canonical,
+                         "arguments": [{"argument_name": n, "argument_value": ""} for n in chosen]})
+    return skeleton, fixes
+
+
+def merge_fill(skeleton: list, values: dict) -> list:
+    """Copy of the skeleton with the fill map's values written into its arguments."""
+    result = copy.deepcopy(skeleton)
+    for index, arguments in values.items():
+        for arg in result[index].get("arguments", []):
+            if arg["argument_name"] in arguments:
+                arg["argument_value"] = arguments[arg["argument_name"]]
+    return result
+
+
+def project_onto_skeleton(skeleton: list, filled: list) -> list:
+    """
+    Copies argument values from the filler's output onto the skeleton, so tools and argument
+    names can never be added, dropped or renamed by the filler.
+    """
+    result = copy.deepcopy(skeleton)
+    for i, step in enumerate(result):
+        source = filled[i] if i < len(filled) and filled[i].get("tool_name") == step.get("tool_name") else None
+        if source is None:
+            source = next((s for s in filled if s.get("tool_name") == step.get("tool_name")), None)
+        if source is None:
+            continue
+        values = {arg["argument_name"]: arg.get("argument_value", "") for arg in source.get("arguments", [])}
+        for arg in step.get("arguments", []):
+            if arg["argument_name"] in values:
+                arg["argument_value"] = values[arg["argument_name"]]
+    return result
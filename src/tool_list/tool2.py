@@ -385,11 +385,11 @@ API_DEFINITIONS: List[Dict[str, Any]] = [
 ]
 
 
+API_BY_NAME: Dict[str, Dict[str, Any]] = {entry["name"]: entry for entry in API_DEFINITIONS}
+
+
 def get_api_by_name(name: str) -> Dict[str, Any] | None:
-    for entry in API_DEFINITIONS:
-        if entry.get("name") == name:
-            return entry
-    return None
+    return API_BY_NAME.get(name)
 
 
 __all__ = ["API_DEFINITIONS", "get_api_by_name"]
\ No newline at end of file
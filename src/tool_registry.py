@@ -0,0 +1,374 @@
+import hashlib
+import json
+import os
+import re
+import threading
+
+# Tool registry loaded from a watched directory of JSON/YAML tool definitions
+# (src/tool_list/registry by default, one tool per file or a list of tools per file).
+# Every reload builds a new immutable snapshot and swaps it in with a single assignment,
+# reusing the doc fragment and validator of every tool whose definition did not change.
+# Each swap bumps the registry version and tells subscribers exactly which tools changed,
+# so dependent caches can drop only the entries that used them.
+
+REGISTRY_DIR = os.getenv(
+    "TOOL_REGISTRY_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "tool_list", "registry"),
+)
+WATCH_INTERVAL_SECONDS = 2.0
+FUZZY_MATCH_THRESHOLD = 0.5
+
+PREV_REF = re.compile(r"^\$\$PREV\[\d+\]$")
+
+
+def format_tool_doc(tool: dict) -> str:
+    """Doc fragment for one tool, as shown to the planner and the filler."""
+    doc_string = f"Tool Name: {tool['name']}\n"
+    doc_string += f"Description: {tool['description']}\n"
+    if tool.get('arguments'):
+        doc_string += "Arguments:\n"
+        for arg in tool['arguments']:
+            doc_string += f"- {arg['argument_name']} ({arg['argument_type']}): {arg['argument_description']}\n"
+    doc_string += "---\n"
+    return doc_string
+
+
+def normalize_tool_name(name: str) -> str:
+    """"Who_Am_I", "who-am-i" and "whoami" all normalize to "whoami"."""
+    return re.sub(r"[^a-z0-9]", "", str(name).lower())
+
+
+def _trigrams(key: str) -> set:
+    padded = f"#{key}#"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _is_prev_ref(value) -> bool:
+    if isinstance(value, str):
+        return bool(PREV_REF.match(value))
+    if isinstance(value, list):
+        return bool(value) and all(isinstance(v, str) and PREV_REF.match(v) for v in value)
+    return False
+
+
+def _type_ok(argument_type: str, value) -> bool:
+    if value == "" or value is None or _is_prev_ref(value):
+        return True
+    argument_type = argument_type.lower()
+    if argument_type.startswith("array"):
+        return isinstance(value, list)
+    if argument_type.startswith("boolean"):
+        return isinstance(value, bool) or str(value).lower() in ("true", "false")
+    if argument_type.startswith("integer"):
+        return isinstance(value, int) and not isinstance(value, bool) or str(value).isdigit()
+    if argument_type.startswith("string") or argument_type == "str":
+        return isinstance(value, str)
+    return True
+
+
+class ToolValidator:
+    def __init__(self, tool: dict):
+        self.name = tool["name"]
+        self.arg_types = {arg["argument_name"]: arg.get("argument_type", "") for arg in tool.get("arguments", [])}
+
+    def validate(self, step: dict) -> list:
+        """Returns a list of human readable problems with one plan step (empty when valid)."""
+        errors = []
+        for arg in step.get("arguments", []):
+            name = arg.get("argument_name")
+            if name not in self.arg_types:
+                errors.append(f"{self.name}: unknown argument '{name}'")
+            elif not _type_ok(self.arg_types[name], arg.get("argument_value")):
+                errors.append(f"{self.name}: argument '{name}' should be {self.arg_types[name]}")
+        return errors
+
+
+class ToolEntry:
+    def __init__(self, tool: dict, fingerprint: str, source: str = None):
+        self.name = tool["name"]
+        self.definition = tool
+        self.fingerprint = fingerprint
+        self.source = source
+        self.aliases = list(tool.get("aliases", []))
+        self.arguments = {arg["argument_name"]: arg for arg in tool.get("arguments", [])}
+        self.keys = {normalize_tool_name(n) for n in [self.name] + self.aliases}
+        self.doc = format_tool_doc(tool)
+        self.validator = ToolValidator(tool)
+
+
+class RegistrySnapshot:
+    """
+    Immutable view of the registry at one version: hashed name and alias indexes (case and
+    separators ignored, so "Who_Am_I" is who_am_i) plus a trigram index over the normalized
+    names, only used to suggest the intended tool for a near miss ("work_list").
+    """
+
+    def __init__(self, version: int, entries: list):
+        self.version = version
+        self.entries = {entry.name: entry for entry in entries}
+        self.api_list = [entry.definition for entry in entries]
+        self.docs = "".join(entry.doc for entry in entries)
+
+        self.aliases = {}
+        self.trigrams = {}
+        self.trigram_counts = {}
+        for entry in entries:
+            for alias in entry.aliases:
+                self.aliases.setdefault(alias, entry.name)
+            for key in entry.keys:
+                self.aliases.setdefault(key, entry.name)
+                grams = _trigrams(key)
+                self.trigram_counts[key] = len(grams)
+                for gram in grams:
+                    self.trigrams.setdefault(gram, set()).add(key)
+        self._resolved = {}
+
+    def resolve(self, name: str):
+        """Canonical tool name for an exact name or an alias, else None. Misspellings never resolve."""
+        if name in self.entries:
+            return name
+        if name in self._resolved:
+            return self._resolved[name]
+
+        canonical = self.aliases.get(name) or self.aliases.get(normalize_tool_name(name))
+        if len(self._resolved) > 10000:
+            self._resolved.clear()
+        self._resolved[name] = canonical
+        return canonical
+
+    def closest(self, name: str):
+        """Canonical name of the tool whose name is most similar to a misspelled one, else None."""
+        key = normalize_tool_name(name)
+        grams = _trigrams(key)
+        shared = {}
+        for gram in grams:
+            for candidate in self.trigrams.get(gram, ()):
+                shared[candidate] = shared.get(candidate, 0) + 1
+        best_score, closest = FUZZY_MATCH_THRESHOLD, None
+        for candidate, count in shared.items():
+            score = count / (len(grams) + self.trigram_counts[candidate] - count)
+            if score >= best_score:
+                best_score, closest = score, self.aliases[candidate]
+        return closest
+
+
+def _shape_error(tool) -> str:
+    """Why a loaded tool definition cannot be used, or None when it has the expected shape."""
+    if not isinstance(tool, dict):
+        return f"expected an object, got {type(tool).__name__}"
+    if not isinstance(tool.get("name"), str) or not tool["name"]:
+        return "missing a string 'name'"
+    if not isinstance(tool.get("description"), str):
+        return f"'{tool['name']}' is missing a string 'description'"
+    if not isinstance(tool.get("aliases", []), list):
+        return f"'{tool['name']}' has non-list 'aliases'"
+    arguments = tool.get("arguments", [])
+    if not isinstance(arguments, list):
+        return f"'{tool['name']}' has non-list 'arguments'"
+    for arg in arguments:
+        if not isinstance(arg, dict) or not all(
+            isinstance(arg.get(key), str) for key in ("argument_name", "argument_type", "argument_description")
+        ):
+            return f"'{tool['name']}' has an argument without string argument_name/argument_type/argument_description"
+    return None
+
+
+def _fingerprint(tool: dict) -> str:
+    return hashlib.sha1(json.dumps(tool, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _load_file(path: str) -> list:
+    with open(path, "r") as f:
+        if path.endswith((".yaml", ".yml")):
+            try:
+                import yaml
+            except ImportError:
+                print(f"[REGISTRY] PyYAML is not installed, skipping {path}")
+                return []
+            data = yaml.safe_load(f)
+        else:
+            data = json.load(f)
+    return data if isinstance(data, list) else [data]
+
+
+class ToolRegistry:
+    def __init__(self, directory: str = REGISTRY_DIR):
+        self.directory = directory
+        self._snapshot = RegistrySnapshot(0, [])
+        self._mtimes = {}
+        self._subscribers = []
+        self._reload_lock = threading.Lock()
+        self._watcher = None
+        self.reload()
+
+    @property
+    def snapshot(self) -> RegistrySnapshot:
+        return self._snapshot
+
+    @property
+    def version(self) -> int:
+        return self._snapshot.version
+
+    def subscribe(self, callback):
+        """callback(version, changed_tool_names) runs after every swap that changed something."""
+        self._subscribers.append(callback)
+
+    def _scan(self) -> dict:
+        if not os.path.isdir(self.directory):
+            return {}
+        return {
+            os.path.join(self.directory, name): os.path.getmtime(os.path.join(self.directory, name))
+            for name in sorted(os.listdir(self.directory))
+            if name.endswith((".json", ".yaml", ".yml"))
+        }
+
+    def reload(self, force: bool = False) -> bool:
+        """
+        Re-reads the directory if any file was added, removed or touched. Returns True when
+        the set of tool definitions changed and a new snapshot was swapped in.
+        """
+        with self._reload_lock:
+            mtimes = self._scan()
+            if mtimes == self._mtimes and not force:
+                return False
+
+            old = self._snapshot
+            entries = {}
+            for path in list(mtimes):
+                try:
+                    tools = _load_file(path)
+                except Exception as e:
+                    # Keep serving the previous definitions of a file that is mid-write or broken,
+                    # and forget its mtime so the next scan retries it
+                    print(f"[REGISTRY] Could not load {path}: {e}")
+                    tools = [entry.definition for entry in old.entries.values() if entry.source == path]
+                    mtimes[path] = None
+                for tool in tools:
+                    # A malformed definition is skipped on its own, it must not take down the
+                    # watcher thread (or the import that builds the first snapshot)
+                    error = _shape_error(tool)
+                    if error:
+                        print(f"[REGISTRY] Skipping a tool in {path}: {error}")
+                        continue
+                    fingerprint = _fingerprint(tool)
+                    previous = old.entries.get(tool["name"])
+                    if previous and previous.fingerprint == fingerprint and previous.source == path:
+                        entries[tool["name"]] = previous
+                    else:
+                        entries[tool["name"]] = ToolEntry(tool, fingerprint, path)
+            entries = sorted(entries.values(), key=lambda entry: entry.name)
+
+            new_fingerprints = {entry.name: entry.fingerprint for entry in entries}
+            old_fingerprints = {name: entry.fingerprint for name, entry in old.entries.items()}
+            changed = {
+                name for name in set(new_fingerprints) | set(old_fingerprints)
+                if new_fingerprints.get(name) != old_fingerprints.get(name)
+            }
+            self._mtimes = mtimes
+            if not changed:
+                return False
+
+            self._snapshot = RegistrySnapshot(old.version + 1, entries)
+            print(f"[REGISTRY] Loaded version {self._snapshot.version}, changed tools: {sorted(changed)}")
+
+        for callback in self._subscribers:
+            try:
+                callback(self._snapshot.version, changed)
+            except Exception as e:
+                print(f"[REGISTRY] Subscriber failed: {e}")
+        return True
+
+    def start_watching(self, interval: float = WATCH_INTERVAL_SECONDS):
+        """Polls the directory in a daemon thread and hot-swaps on change."""
+        if self._watcher is not None:
+            return
+        stop = threading.Event()
+
+        def watch():
+            while not stop.wait(interval):
+                self.reload()
+
+        self._watcher = threading.Thread(target=watch, name="tool-registry-watcher", daemon=True)
+        self._watcher.start()
+
+    def _after_fork(self):
+        # Threads do not survive fork: a pre-forking server's workers start their own watcher
+        self._reload_lock = threading.Lock()
+        if self._watcher is not None:
+            self._watcher = None
+            self.start_watching()
+
+    # --- Lookups (always against one consistent snapshot) ---
+
+    @property
+    def api_list(self) -> list:
+        return self._snapshot.api_list
+
+    def resolve(self, name: str):
+        return self._snapshot.resolve(name)
+
+    def get(self, name: str):
+        snapshot = self._snapshot
+        canonical = snapshot.resolve(name)
+        return snapshot.entries[canonical].definition if canonical else None
+
+    def get_argument(self, tool_name: str, argument_name: str):
+        snapshot = self._snapshot
+        canonical = snapshot.resolve(tool_name)
+        return snapshot.entries[canonical].arguments.get(argument_name) if canonical else None
+
+    def canonicalize_plan(self, plan: list) -> list:
+        """
+        Copy of the plan with aliased tool names replaced by canonical ones. Names that do not
+        resolve are kept, so validation and the verifier see the hallucinated tool.
+        """
+        snapshot = self._snapshot
+        return [
+            dict(step, tool_name=snapshot.resolve(step.get("tool_name")) or step.get("tool_name"))
+            for step in plan
+        ]
+
+    def tool_docs(self, names=None) -> str:
+        """Concatenated doc fragments for all tools, or only for the given tool names."""
+        snapshot = self._snapshot
+        if names is None:
+            return snapshot.docs
+        resolved = [snapshot.resolve(n) for n in names]
+        return "".join(snapshot.entries[n].doc for n in dict.fromkeys(resolved) if n)
+
+    def validate_plan(self, plan: list) -> list:
+        snapshot = self._snapshot
+        errors = []
+        for i, step in enumerate(plan):
+            canonical = snapshot.resolve(step.get("tool_name"))
+            entry = snapshot.entries.get(canonical) if canonical else None
+            if entry is None:
+                suggestion = snapshot.closest(step.get("tool_name"))
+                errors.append(f"step {i}: unknown tool '{step.get('tool_name')}'" +
+                              (f" (did you mean '{suggestion}'?)" if suggestion else ""))
+            else:
+                errors += [f"step {i}: {e}" for e in entry.validator.validate(step)]
+        return errors
+
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry() -> ToolRegistry:
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = ToolRegistry()
+        return _registry
+
+
+def _reset_after_fork():
+    global _registry_lock
+    _registry_lock = threading.Lock()
+    if _registry is not None:
+        _registry._after_fork()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
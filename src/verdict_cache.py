@@ -0,0 +1,142 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from .tool_registry import get_registry
+
+# Whole-plan verdict cache in front of the LLM verifier. The key is the normalized query plus
+# a canonical plan hash (canonical tool names, arguments sorted by name, whitespace collapsed
+# in values), so the same plan written with its arguments in another order or spacing is
+# not verified twice. Entries expire after VERDICT_TTL_SECONDS and are stamped with the tool
+# registry fingerprint and the verifier prompt version: a verdict given against other tool
+# definitions or another prompt is never returned. With VERDICT_CACHE_PATH set the verdicts
+# are loaded at start and saved by save(), so benchmark runs reuse them.
+
+MAX_ENTRIES = int(os.getenv("VERDICT_CACHE_ENTRIES", 4096))
+VERDICT_TTL_SECONDS = float(os.getenv("VERDICT_TTL_SECONDS", 24 * 3600))
+CACHE_PATH = os.getenv("VERDICT_CACHE_PATH")
+
+
+def _normalize_value(value):
+    if isinstance(value, str):
+        return " ".join(value.split())
+    if isinstance(value, list):
+        return [_normalize_value(v) for v in value]
+    if isinstance(value, dict):
+        return {k: _normalize_value(v) for k, v in value.items()}
+    return value
+
+
+def plan_hash(plan: list) -> str:
+    registry = get_registry()
+    canonical = [
+        [step.get("tool_name"), sorted(
+            ([arg.get("argument_name"), _normalize_value(arg.get("argument_value"))]
+             for arg in step.get("arguments", [])),
+            # Values of a repeated argument name can be of different types (str vs. list)
+            key=lambda arg: (str(arg[0]), json.dumps(arg[1], sort_keys=True)),
+        )]
+        for step in registry.canonicalize_plan(plan)
+    ]
+    return hashlib.sha1(json.dumps(canonical, sort_keys=True, separators=(",", ":")).encode("utf-8")).hexdigest()
+
+
+def verdict_key(user_query: str, plan: list) -> str:
+    query = " ".join(user_query.lower().split())
+    return hashlib.sha1(f"{query}\x00{plan_hash(plan)}".encode("utf-8")).hexdigest()
+
+
+_fingerprints = {}
+
+
+def registry_fingerprint() -> str:
+    """Hash of every tool definition; unlike the registry version it is stable across processes."""
+    registry = get_registry()
+    version = registry.version
+    if version not in _fingerprints:
+        tools = sorted((name, entry.fingerprint) for name, entry in registry.snapshot.entries.items())
+        _fingerprints.clear()
+        _fingerprints[version] = hashlib.sha1(json.dumps(tools).encode("utf-8")).hexdigest()
+    return _fingerprints[version]
+
+
+class VerdictCache:
+    def __init__(self, max_entries: int = MAX_ENTRIES, ttl: float = VERDICT_TTL_SECONDS, path: str = CACHE_PATH):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "expired": 0, "stale": 0}
+        if path and os.path.exists(path):
+            self._load()
+
+    def get(self, user_query: str, plan: list, prompt_version: int):
+        """(ok, reason) verified before for this query and canonical plan, or None."""
+        key = verdict_key(user_query, plan)
+        stamp = [registry_fingerprint(), prompt_version]
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            if entry["stamp"] != stamp or entry["expires_at"] <= time.time():
+                self._stats["stale" if entry["stamp"] != stamp else "expired"] += 1
+                self._stats["misses"] += 1
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return entry["ok"], entry["reason"]
+
+    def put(self, user_query: str, plan: list, prompt_version: int, ok: bool, reason: str = None):
+        key = verdict_key(user_query, plan)
+        entry = {"ok": ok, "reason": reason, "stamp": [registry_fingerprint(), prompt_version],
+                 "expires_at": time.time() + self.ttl}
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                entries = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"[VERDICTS] Could not load {self.path}: {e}")
+            return
+        now = time.time()
+        for key, entry in entries.items():
+            if entry.get("expires_at", 0) > now:
+                self._entries[key] = entry
+        print(f"[VERDICTS] Loaded {len(self._entries)} verdicts from {self.path}")
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            entries = dict(self._entries)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(entries, f)
+        os.replace(tmp_path, self.path)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return dict(self._stats, entries=len(self._entries), lookups=lookups,
+                        hit_ratio=self._stats["hits"] / lookups if lookups else 0.0)
+
+
+verdict_cache = VerdictCache()
+# Verdicts were given against the old tool definitions; the stamp check would skip them
+# anyway, clearing frees the space right away.
+get_registry().subscribe(lambda version, changed: verdict_cache.clear())
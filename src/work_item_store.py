@@ -0,0 +1,244 @@
+import argparse
+import json
+import os
+import random
+import time
+
+import numpy as np
+
+# Columnar work-item store behind works_list in the local backend. Every filterable field is
+# a column of its distinct values with one posting per value: a packed bitmap (64 rows per
+# uint64 word) for values on more than 1/64 of the rows, a sorted row-index array for rarer
+# ones (a bitmap would be mostly zeros).
+# works_list ORs the postings of each filter's values and ANDs the filters, one chunk of
+# rows at a time, and stops as soon as limit matching rows are found.
+#
+# Items load from JSONL (one work item per line) or Parquet (needs pyarrow); either way a
+# work item is a flat record with "id" plus the fields below, list-valued for multi-valued
+# fields (owned_by, created_by, applies_to_part):
+#   {"id": "ISS-1", "type": "issue", "priority": "p0", "stage": "triage", "owned_by": ["DEVU-1"]}
+#
+#   python3 -m src.work_item_store --items 1000000     # latency vs. a dict scan
+
+# works_list argument -> work item field
+WORKS_LIST_COLUMNS = {
+    "applies_to_part": "applies_to_part",
+    "created_by": "created_by",
+    "issue.priority": "priority",
+    "issue.rev_orgs": "rev_org",
+    "owned_by": "owned_by",
+    "stage.name": "stage",
+    "ticket.needs_response": "needs_response",
+    "ticket.rev_org": "rev_org",
+    "ticket.severity": "severity",
+    "ticket.source_channel": "source_channel",
+    "type": "type",
+}
+DEFAULT_LIMIT = 50
+# Rows evaluated per step before checking the limit (in 64-row words)
+CHUNK_WORDS = 1024
+ONE = np.uint64(1)
+
+
+def _normalize(value) -> str:
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value).strip().lower()
+
+
+def _values(item: dict, field: str) -> list:
+    value = item.get(field)
+    if value is None:
+        return []
+    return [_normalize(v) for v in value] if isinstance(value, list) else [_normalize(value)]
+
+
+def _limit(arguments: dict) -> int:
+    """works_list's limit; missing or not a number means DEFAULT_LIMIT."""
+    try:
+        return int(arguments.get("limit"))
+    except (TypeError, ValueError):
+        return DEFAULT_LIMIT
+
+
+def _words(rows: int) -> int:
+    return (rows + 63) // 64
+
+
+def _bitmap(rows: np.ndarray, words: int) -> np.ndarray:
+    bitmap = np.zeros(words, dtype=np.uint64)
+    np.bitwise_or.at(bitmap, rows >> 6, ONE << (rows & 63).astype(np.uint64))
+    return bitmap
+
+
+def _chunk(posting: np.ndarray, start: int, end: int) -> np.ndarray:
+    """Words [start, end) of a posting; row-index postings are turned into bits on the fly."""
+    if posting.dtype == np.uint64:
+        return posting[start:end]
+    rows = posting[np.searchsorted(posting, start * 64):np.searchsorted(posting, end * 64)] - start * 64
+    return _bitmap(rows, end - start)
+
+
+def _set_rows(words: np.ndarray, offset: int) -> np.ndarray:
+    bits = np.unpackbits(words.astype("<u8").view(np.uint8), bitorder="little")
+    return np.flatnonzero(bits) + offset * 64
+
+
+class Column:
+    def __init__(self, name: str, rows: np.ndarray, values: list, row_count: int):
+        """rows[i] holds values[i]; a multi-valued field has several (row, value) pairs per row."""
+        self.name = name
+        self.dictionary = sorted(set(values))
+        index = {value: code for code, value in enumerate(self.dictionary)}
+        codes = np.fromiter((index[v] for v in values), dtype=np.int32, count=len(values))
+        order = np.lexsort((rows, codes))
+        rows, codes = rows[order], codes[order]
+        bounds = np.searchsorted(codes, np.arange(len(self.dictionary) + 1))
+        words = _words(row_count)
+        self.postings = {}
+        self.counts = {}
+        for code, value in enumerate(self.dictionary):
+            posting = rows[bounds[code]:bounds[code + 1]]
+            self.counts[value] = len(posting)
+            self.postings[value] = _bitmap(posting, words) if len(posting) * 64 > row_count else posting
+
+
+class WorkItemStore:
+    def __init__(self, items: list):
+        self.ids = [item["id"] for item in items]
+        self.rows = {item_id: row for row, item_id in enumerate(self.ids)}
+        self.columns = {}
+        for field in sorted(set(WORKS_LIST_COLUMNS.values())):
+            rows, values = [], []
+            for row, item in enumerate(items):
+                for value in _values(item, field):
+                    rows.append(row)
+                    values.append(value)
+            self.columns[field] = Column(field, np.array(rows, dtype=np.int64), values, len(items))
+        # Bits past the last row are never set, so an unfiltered scan cannot return them
+        self._all = _bitmap(np.arange(len(items), dtype=np.int64), _words(len(items)))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _clauses(self, arguments: dict):
+        """One list of postings per filter (a row must match any of them), or None if a filter matches nothing."""
+        clauses = []
+        for name, wanted in arguments.items():
+            field = WORKS_LIST_COLUMNS.get(name)
+            if field is None or wanted in (None, "", []):
+                continue
+            wanted = wanted if isinstance(wanted, list) else [wanted]
+            column = self.columns[field]
+            values = [v for v in map(_normalize, wanted) if v in column.postings]
+            if not values:
+                return None
+            clauses.append((sum(column.counts[v] for v in values), [column.postings[v] for v in values]))
+        # Rarest filter first, so most chunks are ruled out by the first AND
+        return [postings for _, postings in sorted(clauses, key=lambda clause: clause[0])]
+
+    def works_list(self, arguments: dict) -> list:
+        """IDs of the work items matching every works_list filter, in load order, at most limit of them."""
+        limit = _limit(arguments)
+        clauses = self._clauses(arguments)
+        if clauses is None or limit <= 0:
+            return []
+
+        found = []
+        words = len(self._all)
+        for start in range(0, words, CHUNK_WORDS):
+            end = min(start + CHUNK_WORDS, words)
+            mask = self._all[start:end].copy()
+            for postings in clauses:
+                matched = _chunk(postings[0], start, end).copy()
+                for posting in postings[1:]:
+                    matched |= _chunk(posting, start, end)
+                mask &= matched
+                if not mask.any():
+                    break
+            else:
+                found.extend(_set_rows(mask, start)[:limit - len(found)].tolist())
+                if len(found) >= limit:
+                    break
+        return [self.ids[row] for row in found]
+
+
+def load_work_items(path: str) -> list:
+    """Work items from a .jsonl or .parquet file ([] when it does not exist)."""
+    if not os.path.exists(path):
+        return []
+    if path.endswith(".parquet"):
+        import pyarrow.parquet
+        return pyarrow.parquet.read_table(path).to_pylist()
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def synthetic_items(count: int, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    users = [f"DEVU-{i}" for i in range(2000)]
+    parts = [f"FEAT-{i}" for i in range(500)]
+    items = []
+    for i in range(count):
+        kind = rng.choice(["issue", "ticket", "task"])
+        item = {"id": f"{kind[:3].upper()}-{i}", "type": kind,
+                "stage": rng.choice(["triage", "backlog", "in_progress", "done"]),
+                "owned_by": rng.sample(users, rng.randint(1, 2)), "created_by": [rng.choice(users)],
+                "applies_to_part": [rng.choice(parts)]}
+        if kind == "issue":
+            item["priority"] = rng.choice(["p0", "p1", "p2", "p3"])
+        if kind == "ticket":
+            item.update(severity=rng.choice(["blocker", "high", "medium", "low"]),
+                        source_channel=rng.choice(["slack", "email", "twitter", "github"]),
+                        needs_response=rng.random() < 0.3, rev_org=f"REV-{rng.randrange(300)}")
+        items.append(item)
+    return items
+
+
+def _scan(items: list, arguments: dict) -> list:
+    """Reference implementation: one pass over the dicts."""
+    limit = _limit(arguments)
+    if limit <= 0:
+        return []
+    wanted = {WORKS_LIST_COLUMNS[name]: set(map(_normalize, v if isinstance(v, list) else [v]))
+              for name, v in arguments.items() if name in WORKS_LIST_COLUMNS and v not in (None, "", [])}
+    found = []
+    for item in items:
+        if all(wanted[field] & set(_values(item, field)) for field in wanted):
+            found.append(item["id"])
+            if len(found) >= limit:
+                break
+    return found
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Benchmark works_list on the columnar store.")
+    arg_parser.add_argument("--items", type=int, default=1_000_000)
+    arg_parser.add_argument("--queries", type=int, default=100)
+    args = arg_parser.parse_args()
+
+    items = synthetic_items(args.items)
+    start = time.perf_counter()
+    store = WorkItemStore(items)
+    print(f"Built the store for {len(store)} items in {time.perf_counter() - start:.1f}s")
+
+    rng = random.Random(1)
+    queries = []
+    for _ in range(args.queries):
+        query = {"type": ["ticket"], "ticket.severity": [rng.choice(["blocker", "high"])],
+                 "ticket.source_channel": rng.sample(["slack", "email", "twitter", "github"], 2),
+                 "limit": rng.choice([10, 50, 100000])}
+        if rng.random() < 0.5:
+            query["owned_by"] = [f"DEVU-{rng.randrange(2000)}"]
+        queries.append(query)
+
+    for label, run in (("columnar", store.works_list), ("dict scan", lambda q: _scan(items, q))):
+        latencies = []
+        for query in queries:
+            start = time.perf_counter()
+            run(query)
+            latencies.append((time.perf_counter() - start) * 1000)
+        latencies.sort()
+        print(f"{label:>9}: p50 {latencies[len(latencies) // 2]:.2f} ms, "
+              f"p99 {latencies[min(len(latencies) - 1, int(0.99 * len(latencies)))]:.2f} ms")
+    assert all(store.works_list(q) == _scan(items, q) for q in queries[:20])
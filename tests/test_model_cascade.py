@@ -0,0 +1,60 @@
+from src import model_cascade
+from src.structured_output import parse_lean_output
+
+
+class FakeModel:
+    def __init__(self, output: str):
+        self.output = output
+        self.calls = 0
+
+
+def plan_with(monkeypatch, fast: FakeModel, heavy: FakeModel):
+    monkeypatch.setattr(model_cascade, "CASCADE_ENABLED", True)
+    monkeypatch.setattr(model_cascade, "loadFastModel", lambda: fast)
+    monkeypatch.setattr(model_cascade, "loadHeavyModel", lambda: heavy)
+
+    def attempt(model):
+        model.calls += 1
+        return parse_lean_output(model.output)
+    return model_cascade.run_cascade("planner", attempt, lambda skeleton: not model_cascade.skeleton_problems(skeleton))
+
+
+def test_hallucinated_tool_escalates_to_the_heavy_model(monkeypatch):
+    fast = FakeModel('{"plan": ["works_list(owned_by)", "send_slack_message(channel)", "summarize_objects(objects)"]}')
+    heavy = FakeModel('{"plan": ["works_list(owned_by)", "summarize_objects(objects)"]}')
+
+    skeleton = plan_with(monkeypatch, fast, heavy)
+
+    assert (fast.calls, heavy.calls) == (1, 1)
+    assert [step["tool_name"] for step in skeleton] == ["works_list", "summarize_objects"]
+
+
+def test_valid_fast_plan_is_kept(monkeypatch):
+    fast = FakeModel('{"plan": ["who_am_i", "works_list(owned_by)"]}')
+    heavy = FakeModel('{"plan": []}')
+
+    skeleton = plan_with(monkeypatch, fast, heavy)
+
+    assert (fast.calls, heavy.calls) == (1, 0)
+    assert [step["tool_name"] for step in skeleton] == ["who_am_i", "works_list"]
+
+
+def test_fill_problems():
+    skeleton = [
+        {"tool_name": "who_am_i", "arguments": []},
+        {"tool_name": "works_list", "arguments": [{"argument_name": "owned_by", "argument_value": ""}]},
+        {"tool_name": "summarize_objects", "arguments": [{"argument_name": "objects", "argument_value": ""}]},
+    ]
+
+    def filled(owned_by, objects):
+        return [skeleton[0],
+                {"tool_name": "works_list", "arguments": [{"argument_name": "owned_by", "argument_value": owned_by}]},
+                {"tool_name": "summarize_objects", "arguments": [{"argument_name": "objects", "argument_value": objects}]}]
+
+    assert model_cascade.fill_problems(skeleton, filled(["$$PREV[0]"], "$$PREV[1]")) == []
+    assert model_cascade.fill_problems(skeleton, None)
+    assert model_cascade.fill_problems(skeleton, filled(["$$PREV[0]"], ""))
+    assert model_cascade.fill_problems(skeleton, filled(["$$PREV[0]"], "$$PREV[2]"))
+    assert model_cascade.fill_problems(skeleton, filled(["$$PREV"], "$$PREV[1]"))
+    assert model_cascade.fill_problems(skeleton, filled("DEVU-1", "$$PREV[1]"))
+    assert model_cascade.fill_problems(skeleton, skeleton[:2])